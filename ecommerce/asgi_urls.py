@@ -0,0 +1,13 @@
+"""
+URL configuration used under ASGI (DJANGO_ASYNC_VIEWS=1): the same URLs as
+ecommerce.urls, with the store's hot read views replaced by their async
+versions from store.async_views.
+"""
+from django.urls import include, path
+
+from ecommerce.urls import handler403, handler404, handler500, urlpatterns as sync_urlpatterns
+
+urlpatterns = [
+    path('', include('store.async_urls')) if getattr(pattern, 'app_name', None) == 'store' else pattern
+    for pattern in sync_urlpatterns
+]
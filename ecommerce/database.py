@@ -0,0 +1,75 @@
+"""
+Database connection management.
+
+configure_connections() applies the connection settings read from the
+environment to a DATABASES entry:
+
+- DB_CONN_MAX_AGE: seconds a connection is kept open between requests
+  (default 600, 0 opens one connection per request),
+- DB_CONN_HEALTH_CHECKS: check a persistent connection still works before
+  reusing it (default on),
+- DB_POOL: on PostgreSQL, use a psycopg connection pool instead of
+  persistent connections (needs psycopg 3 with psycopg[pool]), sized by
+  DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE and DB_POOL_TIMEOUT,
+- DB_SQLITE_BUSY_TIMEOUT: milliseconds SQLite waits for a lock before
+  failing (default 5000).
+
+SQLite connections are opened in WAL mode with synchronous=NORMAL, so
+readers don't block the writer and commits don't wait for an fsync each,
+and write transactions take their lock up front (BEGIN IMMEDIATE) so they
+wait for busy_timeout instead of failing when two of them overlap.
+"""
+from django.core.exceptions import ImproperlyConfigured
+
+
+TRUE_VALUES = {'1', 'true', 'yes', 'on'}
+
+
+def env_bool(env, name, default):
+    if name not in env:
+        return default
+    return env[name].strip().lower() in TRUE_VALUES
+
+
+def env_int(env, name, default):
+    if name not in env:
+        return default
+    try:
+        return int(env[name])
+    except ValueError:
+        raise ImproperlyConfigured(f'{name} must be an integer, got {env[name]!r}')
+
+
+def sqlite_init_command(busy_timeout):
+    """PRAGMAs run on every new SQLite connection"""
+    return ';'.join([
+        'PRAGMA journal_mode=WAL',
+        'PRAGMA synchronous=NORMAL',
+        f'PRAGMA busy_timeout={busy_timeout}',
+    ])
+
+
+def configure_connections(config, env):
+    """Return a copy of the DATABASES entry config with the connection settings of env applied"""
+    config = dict(config, OPTIONS=dict(config.get('OPTIONS', {})))
+    engine = config['ENGINE']
+    pool = env_bool(env, 'DB_POOL', False)
+
+    if pool:
+        if 'postgresql' not in engine:
+            raise ImproperlyConfigured('DB_POOL is only supported on PostgreSQL')
+        config['OPTIONS']['pool'] = {
+            'min_size': env_int(env, 'DB_POOL_MIN_SIZE', 2),
+            'max_size': env_int(env, 'DB_POOL_MAX_SIZE', 10),
+            'timeout': env_int(env, 'DB_POOL_TIMEOUT', 10),
+        }
+        # The pool keeps connections open itself; Django refuses both at once
+        config['CONN_MAX_AGE'] = 0
+    else:
+        config['CONN_MAX_AGE'] = env_int(env, 'DB_CONN_MAX_AGE', 600)
+    config['CONN_HEALTH_CHECKS'] = env_bool(env, 'DB_CONN_HEALTH_CHECKS', True)
+
+    if 'sqlite3' in engine:
+        config['OPTIONS'].setdefault('init_command', sqlite_init_command(env_int(env, 'DB_SQLITE_BUSY_TIMEOUT', 5000)))
+        config['OPTIONS'].setdefault('transaction_mode', 'IMMEDIATE')
+    return config
@@ -0,0 +1,130 @@
+"""
+Read-replica routing.
+
+When REPLICA_DATABASE names a database alias, views that opt in with
+ReplicaReadMixin or the use_replica decorator read from it: the catalog
+pages and the admin reports. Every write, and every read anywhere else
+(cart, checkout, orders, accounts), goes to the default database.
+
+Replicas lag behind the primary. After a request that may have written
+(any method but GET, HEAD, OPTIONS or TRACE), ReplicaMiddleware sets a
+cookie that keeps the browser's reads on the primary for
+REPLICA_STICKY_SECONDS (10 by default), so customers see their own
+changes straight away. Code inside a replica view that reads what it is
+about to write, like the recently viewed tracking of the product page,
+runs under use_primary().
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+
+STICKY_COOKIE = 'primary_until'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+
+# Whether the current request must read from the primary
+_primary_only = ContextVar('primary_only', default=False)
+# Whether the code running now may read from the replica
+_replica_reads = ContextVar('replica_reads', default=False)
+
+
+def replica_alias():
+    return getattr(settings, 'REPLICA_DATABASE', None)
+
+
+def read_database():
+    """Alias that replica-enabled code should read from at this moment"""
+    alias = replica_alias()
+    if alias and not _primary_only.get():
+        return alias
+    return DEFAULT_DB_ALIAS
+
+
+@contextmanager
+def use_replica():
+    """Let reads inside the block (or decorated view) go to the replica"""
+    token = _replica_reads.set(True)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+@contextmanager
+def use_primary():
+    """Send reads inside the block to the primary, even inside use_replica()"""
+    token = _replica_reads.set(False)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+class ReplicaReadMixin:
+    """Class-based view reading from the replica, rendering its template response inside the block"""
+
+    def dispatch(self, request, *args, **kwargs):
+        if self.view_is_async:
+            return self._adispatch(request, *args, **kwargs)
+        with use_replica():
+            response = super().dispatch(request, *args, **kwargs)
+            if hasattr(response, 'render') and not response.is_rendered:
+                response.render()
+        return response
+
+    async def _adispatch(self, request, *args, **kwargs):
+        with use_replica():
+            response = await super().dispatch(request, *args, **kwargs)
+            if hasattr(response, 'render') and not response.is_rendered:
+                await sync_to_async(response.render)()
+        return response
+
+
+class ReplicaRouter:
+    """Send reads inside use_replica() to REPLICA_DATABASE, everything else to the default database"""
+
+    def db_for_read(self, model, **hints):
+        if _replica_reads.get():
+            return read_database()
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica holds the same rows as the primary
+        return True
+
+
+class ReplicaMiddleware:
+    """Keep a browser's reads on the primary for a while after it sends a write request"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sticky_seconds = getattr(settings, 'REPLICA_STICKY_SECONDS', 10)
+
+    def __call__(self, request):
+        if not replica_alias():
+            return self.get_response(request)
+
+        try:
+            sticky = float(request.COOKIES.get(STICKY_COOKIE, 0)) > time.time()
+        except ValueError:
+            sticky = False
+        writes = request.method not in SAFE_METHODS
+        token = _primary_only.set(sticky or writes)
+        try:
+            response = self.get_response(request)
+        finally:
+            _primary_only.reset(token)
+
+        if writes:
+            until = time.time() + self.sticky_seconds
+            response.set_cookie(
+                STICKY_COOKIE, f'{until:.0f}', max_age=self.sticky_seconds, httponly=True, samesite='Lax'
+            )
+        return response
@@ -91,6 +91,11 @@ LOGGING = {
             'level': 'INFO', 
             'propagate': True,
         },
+        'store.middleware': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
         'django.core.mail': {
             'handlers': ['console'],
             'level': 'DEBUG',
@@ -106,6 +111,8 @@ LOGGING = {
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',  # For static files in production
+    'store.middleware.QueryInstrumentationMiddleware',  # Query count and DB time per request
+    'ecommerce.routers.ReplicaMiddleware',  # Primary-only reads after writes when a replica is configured
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -114,7 +121,9 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
-ROOT_URLCONF = 'ecommerce.urls'
+# Under ASGI the home, product list and product detail pages use async views
+ASYNC_VIEWS = os.environ.get('DJANGO_ASYNC_VIEWS') == '1'
+ROOT_URLCONF = 'ecommerce.asgi_urls' if ASYNC_VIEWS else 'ecommerce.urls'
 
 TEMPLATES = [
     {
@@ -195,6 +204,16 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 CRISPY_ALLOWED_TEMPLATE_PACKS = "bootstrap5"
 CRISPY_TEMPLATE_PACK = "bootstrap5"
 
+# Query instrumentation, on with DEBUG: requests running more queries than this are logged as warnings
+QUERY_INSTRUMENTATION = DEBUG
+QUERY_BUDGET_WARNING = 50
+
+# Seconds the admin user statistics are cached for; saving or deleting a user clears them
+USER_STATS_CACHE_TIMEOUT = 60
+
+# Seconds coupons are cached for by code and id; saving or deleting a coupon clears them
+COUPON_CACHE_TIMEOUT = 30
+
 # Authentication
 LOGIN_REDIRECT_URL = 'store:home'
 LOGIN_URL = 'login'
@@ -205,4 +224,33 @@ EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 # Configure database for production
 if 'DATABASE_URL' in os.environ:
     import dj_database_url
-    DATABASES['default'] = dj_database_url.config(conn_max_age=600)
+    DATABASES['default'] = dj_database_url.config()
+
+# Persistent connections or pooling, and SQLite tuning; see ecommerce/database.py
+from ecommerce.database import configure_connections
+DATABASES['default'] = configure_connections(DATABASES['default'], os.environ)
+
+# Optional read replica for catalog pages and admin reports; see ecommerce/routers.py.
+# DATABASE_REPLICA_URL points at a replica server, DB_REPLICA_NAME at a second
+# SQLite file for trying it out locally.
+REPLICA_DATABASE = None
+if 'DATABASE_REPLICA_URL' in os.environ:
+    import dj_database_url
+    DATABASES['replica'] = dj_database_url.parse(os.environ['DATABASE_REPLICA_URL'])
+elif 'DB_REPLICA_NAME' in os.environ:
+    DATABASES['replica'] = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': os.environ['DB_REPLICA_NAME']}
+if 'replica' in DATABASES:
+    DATABASES['replica'] = configure_connections(DATABASES['replica'], os.environ)
+    # Tests read the replica through the test database
+    DATABASES['replica']['TEST'] = {'MIRROR': 'default'}
+    REPLICA_DATABASE = 'replica'
+    DATABASE_ROUTERS = ['ecommerce.routers.ReplicaRouter']
+
+# Seconds a browser keeps reading from the primary after sending a write request
+REPLICA_STICKY_SECONDS = 10
+
+# Minutes a started checkout holds the cart's stock, see store/inventory.py
+STOCK_RESERVATION_MINUTES = 15
+
+# Hours a checkout form's idempotency key is remembered, see store/idempotency.py
+CHECKOUT_KEY_TTL_HOURS = 24
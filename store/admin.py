@@ -1,5 +1,9 @@
+import json
+
 from django.contrib import admin
-from .models import Category, Product, Order, OrderItem, Cart, CartItem, ProductHistory, ProductImage
+from django.utils import timezone
+from django.utils.html import format_html
+from .models import Category, Product, Order, OrderItem, Cart, CartItem, ProductHistory, ProductImage, Task
 
 
 @admin.register(Category)
@@ -25,13 +29,10 @@ class ProductAdmin(admin.ModelAdmin):
     ordering = ['name']
 
     def save_model(self, request, obj, form, change):
-        """Override save_model to create history record before saving changes"""
-        if change:  # Only create history if this is an edit, not a new product
-            # Get the original object from the database
-            original_obj = Product.objects.get(pk=obj.pk)
-            # Create history record
-            ProductHistory.create_from_product(original_obj)
+        """Override save_model to record the fields an edit changed"""
         super().save_model(request, obj, form, change)
+        if change:  # Only create history if this is an edit, not a new product
+            ProductHistory.record_form_changes(form)
 
 class ProductImageInline(admin.TabularInline):
     model = ProductImage
@@ -66,11 +67,32 @@ class CartAdmin(admin.ModelAdmin):
 
 @admin.register(ProductHistory)
 class ProductHistoryAdmin(admin.ModelAdmin):
-    list_display = ['product', 'created_at']
-    list_filter = ['created_at']
+    list_display = ['product', 'kind', 'created_at']
+    list_filter = ['kind', 'created_at']
     search_fields = ['product__name']
     date_hierarchy = 'created_at'
-    readonly_fields = ['product', 'data', 'created_at']
+    fields = ['product', 'kind', 'previous_values', 'created_at']
+    readonly_fields = ['product', 'kind', 'previous_values', 'created_at']
+
+    @admin.display(description='Previous values')
+    def previous_values(self, obj):
+        return format_html('<pre>{}</pre>', json.dumps(obj.product_data, indent=2))
 
     def has_add_permission(self, request):
         return False  # Prevent manual creation of history records
+
+
+@admin.register(Task)
+class TaskAdmin(admin.ModelAdmin):
+    list_display = ['name', 'status', 'run_at', 'attempts', 'max_attempts', 'finished_at']
+    list_filter = ['status', 'name']
+    date_hierarchy = 'created_at'
+    readonly_fields = ['locked_by', 'locked_until', 'last_error', 'created_at', 'finished_at']
+    actions = ['retry']
+
+    @admin.action(description='Run selected tasks again')
+    def retry(self, request, queryset):
+        count = queryset.exclude(status=Task.RUNNING).update(
+            status=Task.PENDING, run_at=timezone.now(), attempts=0, last_error=''
+        )
+        self.message_user(request, f'{count} tasks queued again')
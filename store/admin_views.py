@@ -1,17 +1,23 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.contrib.auth.decorators import login_required, user_passes_test
-from django.views.generic import ListView, CreateView, UpdateView, DeleteView, DetailView
+from django.views.generic import ListView, CreateView, UpdateView, DeleteView, DetailView, FormView
 from django.urls import reverse_lazy, reverse
 from django.contrib import messages
 from django.db.models import Count, Sum, Q, F
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse, Http404
+from django.views import View
 from django.core.paginator import Paginator
 from django.contrib.auth.models import User
+from datetime import date
 
-from .models import Product, Category, ProductImage, Order
-from .forms import ProductForm, ProductImageFormSet, CategoryForm
-from users.models import Profile
+from .models import Product, Category, ProductImage, Order, ProductHistory
+from .forms import ProductForm, ProductImageFormSet, CategoryForm, BulkProductEditForm
+from .bulk_edit import filter_products, build_updates, apply_bulk_edit
+from ecommerce.routers import ReplicaReadMixin, read_database
+from .user_stats import get_user_stats
+from .exports import FORMATS, export_lines, export_filename
+from users.models import Profile, normalize_search_text
 
 
 class AdminRequiredMixin(UserPassesTestMixin):
@@ -40,7 +46,7 @@ class ProductListView(LoginRequiredMixin, AdminRequiredMixin, ListView):
         if category_filter:
             queryset = queryset.filter(category_id=category_filter)
             
-        return queryset.order_by('-updated_at')
+        return queryset.select_related('category').order_by('-updated_at')
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -50,6 +56,41 @@ class ProductListView(LoginRequiredMixin, AdminRequiredMixin, ListView):
         return context
 
 
+class ProductBulkEditView(LoginRequiredMixin, AdminRequiredMixin, FormView):
+    """Preview and apply price, stock and flag changes to every product matching a filter"""
+    form_class = BulkProductEditForm
+    template_name = 'store/admin/product_bulk_edit.html'
+    preview_size = 10
+
+    def get_initial(self):
+        # Start from the product list's current filter
+        return {
+            'category': self.request.GET.get('category') or None,
+            'search': self.request.GET.get('search', ''),
+        }
+
+    def form_valid(self, form):
+        products = filter_products(**form.get_filters())
+        updates = build_updates(**form.get_changes())
+
+        if 'apply' in self.request.POST:
+            if not updates:
+                form.add_error(None, "Choose at least one change to apply.")
+                return self.form_invalid(form)
+            count = apply_bulk_edit(products, updates)
+            messages.success(self.request, f"Updated {count} products")
+            return redirect('store:admin_product_list')
+
+        count = products.count()
+        return self.render_to_response(self.get_context_data(
+            form=form,
+            preview_count=count,
+            preview_products=products.select_related('category').order_by('name')[:self.preview_size],
+            preview_more=max(count - self.preview_size, 0),
+            has_changes=bool(updates),
+        ))
+
+
 class ProductCreateView(LoginRequiredMixin, AdminRequiredMixin, CreateView):
     model = Product
     form_class = ProductForm
@@ -110,6 +151,7 @@ class ProductUpdateView(LoginRequiredMixin, AdminRequiredMixin, UpdateView):
         
         if form.is_valid() and image_formset.is_valid():
             self.object = form.save()
+            ProductHistory.record_form_changes(form)
             
             # Save formset with connection to the product
             image_formset.instance = self.object
@@ -153,19 +195,10 @@ class CategoryListView(LoginRequiredMixin, AdminRequiredMixin, ListView):
     template_name = 'store/admin/category_list.html'
     context_object_name = 'categories'
     paginate_by = 20
-    
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        # Add product count for each category
-        categories_with_count = []
-        for category in context['categories']:
-            product_count = Product.objects.filter(category=category).count()
-            categories_with_count.append({
-                'category': category,
-                'product_count': product_count
-            })
-        context['categories_with_count'] = categories_with_count
-        return context
+
+    def get_queryset(self):
+        # Count all products, available or not, in the same query as the categories
+        return Category.objects.annotate(num_products=Count('products')).order_by('name')
 
 
 class CategoryCreateView(LoginRequiredMixin, AdminRequiredMixin, CreateView):
@@ -197,15 +230,16 @@ class CategoryDeleteView(LoginRequiredMixin, AdminRequiredMixin, DeleteView):
     template_name = 'store/admin/category_confirm_delete.html'
     success_url = reverse_lazy('store:admin_category_list')
     
-    def delete(self, request, *args, **kwargs):
-        self.object = self.get_object()
+    def get_queryset(self):
+        return Category.objects.annotate(num_products=Count('products'))
+
+    def form_valid(self, form):
         category_name = self.object.name
         success_url = self.get_success_url()
         
-        # Check if category has products
-        product_count = Product.objects.filter(category=self.object).count()
-        if product_count > 0:
-            messages.error(self.request, f"Cannot delete category '{category_name}' as it contains {product_count} products")
+        # Check if category has products, counted when the category was loaded
+        if self.object.num_products > 0:
+            messages.error(self.request, f"Cannot delete category '{category_name}' as it contains {self.object.num_products} products")
             return redirect(success_url)
         
         self.object.delete()
@@ -226,13 +260,17 @@ class UserListView(LoginRequiredMixin, AdminRequiredMixin, ListView):
         role_filter = self.request.GET.get('role', '')
         status_filter = self.request.GET.get('status', '')
         
-        # Apply search filter
-        if search_query:
+        # Apply search filter on the normalized username, email and name column,
+        # falling back to the raw fields for users without a profile
+        search_text = normalize_search_text(search_query)
+        if search_text:
+            search_query = search_query.strip()
             queryset = queryset.filter(
-                Q(username__icontains=search_query) |
-                Q(email__icontains=search_query) |
-                Q(first_name__icontains=search_query) |
-                Q(last_name__icontains=search_query)
+                Q(profile__search_text__contains=search_text) |
+                Q(profile__isnull=True) & (
+                    Q(username__icontains=search_query) | Q(email__icontains=search_query) |
+                    Q(first_name__icontains=search_query) | Q(last_name__icontains=search_query)
+                )
             )
             
         # Apply role filter
@@ -266,12 +304,13 @@ class UserListView(LoginRequiredMixin, AdminRequiredMixin, ListView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['total_users'] = User.objects.count()
-        context['active_users'] = User.objects.filter(is_active=True).count()
-        context['staff_users'] = User.objects.filter(is_staff=True).count()
-        context['superuser_count'] = User.objects.filter(is_superuser=True).count()
-        context['customer_count'] = User.objects.filter(is_staff=False, is_superuser=False).count()
-        context['inactive_count'] = User.objects.filter(is_active=False).count()
+        stats = get_user_stats()
+        context['total_users'] = stats['total']
+        context['active_users'] = stats['active']
+        context['staff_users'] = stats['staff']
+        context['superuser_count'] = stats['superusers']
+        context['customer_count'] = stats['customers']
+        context['inactive_count'] = stats['inactive']
         
         # Get filter parameters for maintaining filter state in the form
         context['search_query'] = self.request.GET.get('search', '')
@@ -279,4 +318,39 @@ class UserListView(LoginRequiredMixin, AdminRequiredMixin, ListView):
         context['current_role'] = self.request.GET.get('role', '')
         context['current_status'] = self.request.GET.get('status', '')
         
-        return context
\ No newline at end of file
+        return context
+
+
+class ExportView(ReplicaReadMixin, LoginRequiredMixin, AdminRequiredMixin, View):
+    """
+    Stream orders or products as CSV or JSON Lines, filtered by the query
+    string. Rows are read from the replica when one is configured; the
+    response streams after the view returns, so the alias is chosen here.
+    """
+
+    def get_date(self, name):
+        try:
+            return date.fromisoformat(self.request.GET.get(name, ''))
+        except ValueError:
+            return None
+
+    def get_filters(self, kind):
+        filters = {'start': self.get_date('start'), 'end': self.get_date('end')}
+        if kind == 'orders':
+            status = self.request.GET.get('status', '')
+            filters['status'] = status if status in dict(Order.STATUS_CHOICES) else None
+        else:
+            category = self.request.GET.get('category', '')
+            filters['category'] = int(category) if category.isdigit() else None
+            filters['available'] = {'1': True, '0': False}.get(self.request.GET.get('available'))
+        return filters
+
+    def get(self, request, kind):
+        fmt = request.GET.get('format', 'csv')
+        if fmt not in FORMATS:
+            raise Http404('Unknown export format')
+        response = StreamingHttpResponse(
+            export_lines(kind, fmt, using=read_database(), **self.get_filters(kind)), content_type=FORMATS[fmt][0]
+        )
+        response['Content-Disposition'] = f'attachment; filename="{export_filename(kind, fmt)}"'
+        return response
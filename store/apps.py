@@ -3,4 +3,8 @@ from django.apps import AppConfig
 
 class StoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'store'
\ No newline at end of file
+    name = 'store'
+
+    def ready(self):
+        import store.signals
+        import store.tasks
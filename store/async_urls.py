@@ -0,0 +1,20 @@
+"""
+The store's URLs with the async home, product list and product detail
+views in place of the synchronous ones. ecommerce.asgi_urls includes
+these when the site is served under ASGI.
+"""
+from django.urls import path
+
+from . import async_views
+from .urls import app_name, urlpatterns as sync_urlpatterns
+
+ASYNC_VIEWS = {
+    'home': async_views.home,
+    'product_list': async_views.ProductListView.as_view(),
+    'product_detail': async_views.ProductDetailView.as_view(),
+}
+
+urlpatterns = [
+    path(str(pattern.pattern), ASYNC_VIEWS[pattern.name], name=pattern.name) if pattern.name in ASYNC_VIEWS else pattern
+    for pattern in sync_urlpatterns
+]
@@ -0,0 +1,188 @@
+"""
+Async versions of the storefront's hot read views, served under ASGI.
+
+They build the same context as home, ProductListView and ProductDetailView
+in store.views, but read with Django's async ORM and start the queries
+that don't depend on each other together with asyncio.gather(). Templates
+and context processors still use the synchronous ORM, so rendering runs
+in a worker thread through sync_to_async.
+
+Django's async ORM currently runs each query through sync_to_async on the
+request's one database connection, so gathered queries don't overlap on
+the database; what the event loop gains is that waiting requests don't
+each hold a thread. The benchmark_async command measures the difference.
+"""
+import asyncio
+import logging
+
+from asgiref.sync import sync_to_async
+from django.core.paginator import InvalidPage
+from django.http import Http404
+from django.shortcuts import render
+from django.template.response import TemplateResponse
+from django.utils.translation import gettext as _
+
+from ecommerce.routers import use_primary, use_replica
+from . import views
+from .forms import CartAddProductForm, ReviewForm
+from .models import Category, Product, RecentlyViewedProduct, Review
+from .recommendations import get_recommendations
+
+logger = logging.getLogger(__name__)
+
+
+async def as_list(queryset):
+    """Evaluate a queryset with the async ORM"""
+    return [obj async for obj in queryset]
+
+
+async def none():
+    return None
+
+
+async def home(request):
+    """Home page view with featured products, categories, and recently viewed products"""
+    with use_replica():
+        user = await request.auser()
+        recently_viewed = none()
+        if user.is_authenticated:
+            recently_viewed = as_list(views.with_ratings(
+                Product.objects.filter(recentlyviewedproduct__user=user)
+            ).order_by('-recentlyviewedproduct__viewed_at')[:4])
+
+        categories, carousel_products, featured_products, recently_viewed_products = await asyncio.gather(
+            as_list(Category.objects.all()[:6]),
+            as_list(views.with_ratings(Product.objects.filter(available=True, featured=True))[:5]),
+            as_list(views.with_ratings(Product.objects.filter(available=True)).order_by('-created_at')[:8]),
+            recently_viewed,
+        )
+
+        context = {
+            'categories': categories,
+            'featured_products': featured_products,
+            'carousel_products': carousel_products,
+            'title': 'Home'
+        }
+        if recently_viewed_products is not None:
+            context['recently_viewed_products'] = recently_viewed_products
+
+        return await sync_to_async(render)(request, 'store/home.html', context)
+
+
+class ProductListView(views.ProductListView):
+    """Async list view for all products with pagination and filtering"""
+
+    async def get(self, request, *args, **kwargs):
+        queryset = self.get_queryset()
+        page_size = self.get_paginate_by(queryset)
+
+        # The page's count, the category menu and the total don't depend on each other
+        count, categories, total_products = await asyncio.gather(
+            queryset.acount() if page_size else none(),
+            as_list(Category.objects.all()),
+            Product.objects.filter(available=True).acount(),
+        )
+
+        if page_size:
+            paginator = self.get_paginator(queryset, page_size, allow_empty_first_page=self.get_allow_empty())
+            paginator.count = count
+            page_number = self.kwargs.get(self.page_kwarg) or request.GET.get(self.page_kwarg) or 1
+            if page_number == 'last':
+                page_number = paginator.num_pages
+            try:
+                page = paginator.page(page_number)
+            except InvalidPage as e:
+                raise Http404(_('Invalid page (%(page_number)s): %(message)s') % {
+                    'page_number': page_number, 'message': str(e)
+                })
+            page.object_list = await as_list(page.object_list)
+            object_list, is_paginated = page.object_list, page.has_other_pages()
+        else:
+            paginator = page = None
+            object_list, is_paginated = await as_list(queryset), False
+
+        self.object_list = object_list
+        context = {
+            'view': self,
+            'paginator': paginator,
+            'page_obj': page,
+            'is_paginated': is_paginated,
+            'object_list': object_list,
+            self.context_object_name: object_list,
+            'categories': categories,
+            'category_id': request.GET.get('category', ''),
+            'query': request.GET.get('q', ''),
+            'sort': request.GET.get('sort', 'name'),
+            'show_all': request.GET.get('show_all', ''),
+            'min_price': self.get_price_param('min_price'),
+            'max_price': self.get_price_param('max_price'),
+            'total_products': total_products,
+        }
+        return TemplateResponse(request, self.get_template_names(), context)
+
+
+class ProductDetailView(views.ProductDetailView):
+    """Async detail view for a single product"""
+
+    async def get_recently_viewed(self, user):
+        with use_primary():
+            items = await as_list(RecentlyViewedProduct.get_recently_viewed(user))
+        return [item.product for item in items if item.product.id != self.object.id][:4]
+
+    async def get_previous_version(self):
+        try:
+            history = await self.object.history.select_related('product__category').afirst()
+            return history.previous_version() if history else None
+        except Exception as e:
+            logger.error(f"Error retrieving product history: {e}")
+
+    async def get(self, request, *args, **kwargs):
+        try:
+            self.object = await self.get_queryset().aget(pk=kwargs['pk'])
+        except Product.DoesNotExist:
+            raise Http404(_('No %(verbose_name)s found matching the query') % {
+                'verbose_name': Product._meta.verbose_name
+            })
+        user = await request.auser()
+        reviews = self.object.reviews.select_related('user')
+
+        review_list, rating_counts, additional_images, recommendations, user_has_reviewed, previous_version, \
+            recently_viewed_products = await asyncio.gather(
+                as_list(reviews),
+                reviews.aaggregate(**views.rating_aggregates()),
+                as_list(self.object.additional_images.all()),
+                sync_to_async(get_recommendations)(self.object),
+                Review.objects.filter(product=self.object, user=user).aexists() if user.is_authenticated else none(),
+                self.get_previous_version() if user.is_staff else none(),
+                self.get_recently_viewed(user) if user.is_authenticated else none(),
+            )
+
+        context = {
+            'view': self,
+            'object': self.object,
+            'product': self.object,
+            'cart_product_form': CartAddProductForm(),
+            'review_form': ReviewForm(),
+            'reviews': review_list,
+            'user_has_reviewed': bool(user_has_reviewed),
+            'additional_images': additional_images,
+            'exclusive_features': self.object.get_exclusive_features(),
+            **views.rating_stats(rating_counts),
+        }
+        if recommendations['bought_together']:
+            context['related_products'] = recommendations['bought_together']
+            context['similar_products'] = recommendations['similar']
+        elif recommendations['similar']:
+            context['related_products'] = recommendations['similar']
+        else:
+            context['related_products'] = await as_list(views.fallback_related_products(self.object))
+        if previous_version:
+            context['previous_version'] = previous_version
+        if recently_viewed_products is not None:
+            context['recently_viewed_products'] = recently_viewed_products
+
+        # Track this product view in recently viewed products
+        if user.is_authenticated:
+            with use_primary():
+                await sync_to_async(RecentlyViewedProduct.add_product_view)(user, self.object)
+        return TemplateResponse(request, self.get_template_names(), context)
@@ -0,0 +1,9 @@
+"""
+Benchmarks for the storefront.
+
+data generates a synthetic catalog with users, orders and reviews, and load
+replays a scripted shopping scenario against it, reporting latency
+percentiles, throughput and queries per request. Both are driven by the
+generate_benchmark_data and run_benchmark management commands; run them
+against a dedicated database, never production.
+"""
@@ -0,0 +1,155 @@
+"""
+WSGI versus ASGI benchmark for the storefront's hot read views.
+
+Replays anonymous home, product list and product page requests in process:
+
+- wsgi: the synchronous views through Django's WSGI handler, one thread per
+  concurrent client, as under gunicorn's threaded workers,
+- asgi: the async views (ecommerce.asgi_urls) through Django's ASGI
+  handler, one asyncio task per concurrent client on a single event loop,
+  as under uvicorn.
+
+Both modes run the same middleware, so the comparison shows what the async
+views and the event loop change, not the server in front of them.
+"""
+import asyncio
+import platform
+import random
+import threading
+import time
+
+from asgiref.sync import async_to_sync
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.db import connection, connections
+from django.test import override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from ..models import Product
+from .connections import _request
+from .load import StepStats
+
+MODES = ('wsgi', 'asgi')
+ASGI_URLCONF = 'ecommerce.asgi_urls'
+
+
+def _wsgi_client(handler, paths, requests, seed, stats, lock):
+    rng = random.Random(seed)
+    local = StepStats()
+    try:
+        for _ in range(requests):
+            start = time.perf_counter()
+            status = _request(handler, rng.choice(paths))
+            local.record(time.perf_counter() - start, status, None)
+    finally:
+        if threading.current_thread() is not threading.main_thread():
+            connections.close_all()
+    with lock:
+        stats.merge(local)
+
+
+def run_wsgi(paths, requests, concurrency, seed):
+    handler = WSGIHandler()
+    stats = StepStats()
+    lock = threading.Lock()
+    if concurrency == 1:
+        _wsgi_client(handler, paths, requests, seed, stats, lock)
+    else:
+        clients = [
+            threading.Thread(target=_wsgi_client, args=(handler, paths, requests, seed + client, stats, lock))
+            for client in range(concurrency)
+        ]
+        for thread in clients:
+            thread.start()
+        for thread in clients:
+            thread.join()
+    return stats
+
+
+async def _asgi_request(handler, path):
+    """Send one request through the ASGI handler and return its status code"""
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+        'path': path, 'raw_path': path.encode(), 'query_string': b'', 'root_path': '',
+        'headers': [(b'host', b'localhost')], 'client': ('127.0.0.1', 50000), 'server': ('localhost', 80),
+    }
+    received = False
+    status = []
+
+    async def receive():
+        nonlocal received
+        if not received:
+            received = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        # The client never disconnects; Django cancels this once the response is sent
+        await asyncio.Future()
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            status.append(message['status'])
+
+    await handler(scope, receive, send)
+    return status[0]
+
+
+async def _asgi_client(handler, paths, requests, seed, stats):
+    rng = random.Random(seed)
+    for _ in range(requests):
+        start = time.perf_counter()
+        status = await _asgi_request(handler, rng.choice(paths))
+        stats.record(time.perf_counter() - start, status, None)
+
+
+def run_asgi(paths, requests, concurrency, seed):
+    stats = StepStats()
+    with override_settings(ROOT_URLCONF=ASGI_URLCONF):
+        handler = ASGIHandler()
+
+        async def clients():
+            await asyncio.gather(*[
+                _asgi_client(handler, paths, requests, seed + client, stats) for client in range(concurrency)
+            ])
+        async_to_sync(clients)()
+    return stats
+
+
+def run_async_benchmark(requests=200, concurrency=1, modes=None, seed=42):
+    """
+    Replay requests anonymous storefront requests per client in each mode
+    (wsgi and asgi by default). Returns the results document.
+    """
+    product_ids = list(Product.objects.filter(available=True).order_by('id').values_list('id', flat=True)[:1000])
+    if not product_ids:
+        raise ValueError('No products found, run generate_benchmark_data first.')
+    modes = modes or list(MODES)
+    unknown = [mode for mode in modes if mode not in MODES]
+    if unknown:
+        raise ValueError(f"Unknown modes: {', '.join(unknown)}")
+    rng = random.Random(seed)
+    paths = [reverse('store:home'), reverse('store:product_list')] + [
+        reverse('store:product_detail', args=[product_id]) for product_id in rng.sample(product_ids, min(20, len(product_ids)))
+    ]
+
+    started_at = timezone.now()
+    results = {}
+    for mode in modes:
+        run = run_wsgi if mode == 'wsgi' else run_asgi
+        start = time.perf_counter()
+        stats = run(paths, requests, concurrency, seed)
+        duration = time.perf_counter() - start
+        summary = stats.summary()
+        summary['throughput_rps'] = round(summary['requests'] / duration, 2) if duration else None
+        results[mode] = summary
+
+    return {
+        'started_at': started_at.isoformat(),
+        'requests': requests,
+        'concurrency': concurrency,
+        'seed': seed,
+        'environment': {
+            'python': platform.python_version(),
+            'database': connection.vendor,
+        },
+        'modes': results,
+    }
@@ -0,0 +1,230 @@
+"""
+Connection management benchmark.
+
+Replays anonymous storefront requests (home, product list, product page)
+through Django's WSGI handler, so each request ends the way it does under
+gunicorn: request_finished closes the connection unless it is persistent.
+The same requests run once per connection mode:
+
+- per-request: a new connection for every request (CONN_MAX_AGE=0),
+- persistent: connections kept open with health checks,
+- pool: a psycopg connection pool (PostgreSQL only),
+- sqlite-untuned: per-request connections with SQLite's defaults: rollback
+  journal, no busy_timeout PRAGMA and deferred transactions (SQLite only).
+
+Optional writer threads update products throughout, to show lock waits and
+"database is locked" errors under concurrent writes.
+"""
+import io
+import platform
+import random
+import threading
+import time
+from collections import defaultdict
+
+from django.core.handlers.wsgi import WSGIHandler
+from django.db import OperationalError, connection, connections
+from django.db.backends.signals import connection_created
+from django.db.models import F
+from django.urls import reverse
+from django.utils import timezone
+
+from ..models import Product
+from .load import StepStats
+
+
+def connection_modes(vendor):
+    """{mode: settings to apply to the default database} for a database vendor"""
+    modes = {
+        'per-request': {'CONN_MAX_AGE': 0, 'CONN_HEALTH_CHECKS': False},
+        'persistent': {'CONN_MAX_AGE': 600, 'CONN_HEALTH_CHECKS': True},
+    }
+    if vendor == 'postgresql':
+        modes['pool'] = {'CONN_MAX_AGE': 0, 'CONN_HEALTH_CHECKS': False, 'pool': {'min_size': 2, 'max_size': 10}}
+    if vendor == 'sqlite':
+        # WAL mode is stored in the database file, so switch it back explicitly
+        modes['sqlite-untuned'] = {
+            'CONN_MAX_AGE': 0, 'CONN_HEALTH_CHECKS': False,
+            'init_command': 'PRAGMA journal_mode=DELETE', 'transaction_mode': None,
+        }
+    return modes
+
+
+# Mode settings that belong in OPTIONS
+OPTION_KEYS = {'pool', 'init_command', 'transaction_mode'}
+
+
+def _apply_mode(settings_dict, original, mode):
+    """Reset settings_dict in place to original with mode's settings applied, without a pool unless mode has one"""
+    options = dict(original.get('OPTIONS', {}))
+    options.pop('pool', None)
+    settings_dict.clear()
+    settings_dict.update(original, OPTIONS=options)
+    for key, value in mode.items():
+        if key in OPTION_KEYS:
+            options[key] = value
+        else:
+            settings_dict[key] = value
+
+
+def _restore(settings_dict, original):
+    settings_dict.clear()
+    settings_dict.update(original)
+
+
+def _close_connections():
+    connections.close_all()
+    if hasattr(connection, 'close_pool'):
+        connection.close_pool()
+
+
+def _environ(path, query=''):
+    return {
+        'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': query, 'SCRIPT_NAME': '',
+        'SERVER_NAME': 'localhost', 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+        'HTTP_HOST': 'localhost', 'wsgi.url_scheme': 'http', 'wsgi.input': io.BytesIO(),
+        'wsgi.errors': io.StringIO(), 'wsgi.multithread': True, 'wsgi.multiprocess': False,
+        'wsgi.run_once': False, 'wsgi.version': (1, 0),
+    }
+
+
+def _request(handler, path, query=''):
+    """Send one request through the handler and return its status code"""
+    status = []
+    response = handler(_environ(path, query), lambda code, headers, exc_info=None: status.append(code))
+    try:
+        for _ in response:
+            pass
+    finally:
+        # Sends request_finished, which closes connections that aren't persistent
+        response.close()
+    return int(status[0].split()[0])
+
+
+def _reader(handler, paths, requests, seed, stats, lock):
+    rng = random.Random(seed)
+    local = StepStats()
+    try:
+        for _ in range(requests):
+            path, query = rng.choice(paths)
+            start = time.perf_counter()
+            try:
+                status = _request(handler, path, query)
+            except OperationalError:
+                status = 500
+            local.record(time.perf_counter() - start, status, None)
+    finally:
+        if threading.current_thread() is not threading.main_thread():
+            connections.close_all()
+    with lock:
+        stats.merge(local)
+
+
+def _writer(product_ids, stop, counts, lock):
+    writes = errors = 0
+    try:
+        while not stop.is_set():
+            try:
+                Product.objects.filter(pk=random.choice(product_ids)).update(stock=F('stock'))
+                writes += 1
+            except OperationalError:
+                errors += 1
+            time.sleep(0.001)
+    finally:
+        connections.close_all()
+    with lock:
+        counts['writes'] += writes
+        counts['write_errors'] += errors
+
+
+def run_mode(requests, concurrency, writers, seed, paths, product_ids):
+    """Replay the requests in the current connection settings and return a summary"""
+    handler = WSGIHandler()
+    stats = StepStats()
+    counts = defaultdict(int)
+    lock = threading.Lock()
+    opened = []
+
+    def count_connection(sender, connection, **kwargs):
+        opened.append(connection.alias)
+
+    connection_created.connect(count_connection)
+    stop = threading.Event()
+    writer_threads = [
+        threading.Thread(target=_writer, args=(product_ids, stop, counts, lock)) for _ in range(writers)
+    ]
+    try:
+        for thread in writer_threads:
+            thread.start()
+        start = time.perf_counter()
+        if concurrency == 1:
+            _reader(handler, paths, requests, seed, stats, lock)
+        else:
+            readers = [
+                threading.Thread(target=_reader, args=(handler, paths, requests, seed + worker, stats, lock))
+                for worker in range(concurrency)
+            ]
+            for thread in readers:
+                thread.start()
+            for thread in readers:
+                thread.join()
+        duration = time.perf_counter() - start
+    finally:
+        stop.set()
+        for thread in writer_threads:
+            thread.join()
+        connection_created.disconnect(count_connection)
+
+    summary = stats.summary()
+    summary['throughput_rps'] = round(summary['requests'] / duration, 2) if duration else None
+    summary['connections_opened'] = len(opened)
+    summary['writes'] = counts['writes']
+    summary['write_errors'] = counts['write_errors']
+    return summary
+
+
+def run_connection_benchmark(requests=200, concurrency=1, writers=0, modes=None, seed=42):
+    """
+    Replay requests anonymous storefront requests per reader thread in each
+    connection mode (all modes the database supports by default).
+    Returns the results document.
+    """
+    product_ids = list(Product.objects.filter(available=True).order_by('id').values_list('id', flat=True)[:1000])
+    if not product_ids:
+        raise ValueError('No products found, run generate_benchmark_data first.')
+    rng = random.Random(seed)
+    paths = [(reverse('store:home'), ''), (reverse('store:product_list'), '')] + [
+        (reverse('store:product_detail', args=[product_id]), '') for product_id in rng.sample(product_ids, min(20, len(product_ids)))
+    ]
+
+    available = connection_modes(connection.vendor)
+    modes = modes or list(available)
+    unknown = [mode for mode in modes if mode not in available]
+    if unknown:
+        raise ValueError(f"Unsupported modes for {connection.vendor}: {', '.join(unknown)}")
+
+    settings_dict = connections.settings['default']
+    original = dict(settings_dict, OPTIONS=dict(settings_dict.get('OPTIONS', {})))
+    started_at = timezone.now()
+    results = {}
+    try:
+        for mode in modes:
+            _close_connections()
+            _apply_mode(settings_dict, original, available[mode])
+            results[mode] = run_mode(requests, concurrency, writers, seed, paths, product_ids)
+    finally:
+        _close_connections()
+        _restore(settings_dict, original)
+
+    return {
+        'started_at': started_at.isoformat(),
+        'requests': requests,
+        'concurrency': concurrency,
+        'writers': writers,
+        'seed': seed,
+        'environment': {
+            'python': platform.python_version(),
+            'database': connection.vendor,
+        },
+        'modes': results,
+    }
@@ -0,0 +1,263 @@
+"""
+Synthetic catalog generator.
+
+Rows are written with bulk_create in batches, so a catalog of a million
+products takes minutes rather than hours. Generation is seeded and
+therefore repeatable. Generated rows are tagged so clear_benchmark_data()
+can remove them again: products have data_source BENCHMARK_SOURCE,
+categories have it as their description and users have a username
+starting with USERNAME_PREFIX.
+"""
+import random
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+
+from users.models import Profile, user_search_text
+from ..models import Category, Product, Order, OrderItem, Review
+from ..rollups import rebuild_rollups
+from ..user_stats import clear_user_stats
+
+
+BENCHMARK_SOURCE = 'benchmark'
+USERNAME_PREFIX = 'bench_'
+STAFF_USERNAME = 'bench_staff'
+PASSWORD = 'benchmark'
+
+BRANDS = [
+    'Aurora', 'Belle Rose', 'Celeste', 'Dermalux', 'Elixir', 'Flora & Co', 'Glowlab', 'Hydra',
+    'Iris', 'Jade', 'Kalia', 'Lumina', 'Maison Pure', 'Nectar', 'Opaline', 'Petale',
+]
+ADJECTIVES = [
+    'Hydrating', 'Brightening', 'Nourishing', 'Matte', 'Radiant', 'Soothing', 'Firming',
+    'Gentle', 'Intense', 'Velvet', 'Silky', 'Long-Lasting', 'Purifying', 'Renewing',
+]
+PRODUCT_TYPES = {
+    'Skincare': ['Serum', 'Moisturizer', 'Cleanser', 'Toner', 'Eye Cream', 'Face Mask', 'Sunscreen'],
+    'Makeup': ['Foundation', 'Concealer', 'Lipstick', 'Mascara', 'Eyeliner', 'Blush', 'Highlighter'],
+    'Haircare': ['Shampoo', 'Conditioner', 'Hair Oil', 'Hair Mask', 'Styling Cream'],
+    'Fragrance': ['Eau de Parfum', 'Eau de Toilette', 'Body Mist', 'Perfume Oil'],
+    'Bodycare': ['Body Lotion', 'Body Scrub', 'Shower Gel', 'Hand Cream', 'Body Butter'],
+}
+INGREDIENTS = [
+    'aqua', 'glycerin', 'niacinamide', 'hyaluronic acid', 'vitamin c', 'retinol', 'squalane',
+    'shea butter', 'jojoba oil', 'aloe vera', 'ceramides', 'peptides', 'green tea extract',
+    'salicylic acid', 'zinc oxide', 'rosehip oil', 'panthenol', 'allantoin', 'tocopherol',
+]
+REVIEW_TITLES = ['Love it', 'Great value', 'Not for me', 'Holy grail', 'Decent', 'Would buy again']
+CITIES = ['London', 'Manchester', 'Paris', 'Lyon', 'Berlin', 'Madrid', 'Milan', 'Dublin']
+
+
+@contextmanager
+def _manual_timestamps(*fields):
+    """Let bulk_create keep generated created_at values instead of stamping now()"""
+    previous = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in previous:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+def _batches(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class CatalogGenerator:
+    """Generate a seeded synthetic catalog, reporting progress through log"""
+
+    def __init__(self, seed=42, batch_size=5000, days=365, log=None):
+        self.random = random.Random(seed)
+        self.batch_size = batch_size
+        self.days = days
+        self.now = timezone.now()
+        self.log = log or (lambda message: None)
+
+    def _past(self):
+        """A random moment in the generated history, recent dates more likely"""
+        days_ago = min(self.random.expovariate(3 / self.days), self.days)
+        return self.now - timedelta(days=days_ago)
+
+    def _bulk_create(self, model, objects, label):
+        total = 0
+        for batch in _batches(objects, self.batch_size):
+            model.objects.bulk_create(batch, batch_size=self.batch_size)
+            total += len(batch)
+            self.log(f'{label}: {total}')
+        return total
+
+    def categories(self, count):
+        """Create categories named after product groups, e.g. 'Skincare', 'Skincare 2'"""
+        groups = list(PRODUCT_TYPES)
+        categories = []
+        for i in range(count):
+            group, round_number = groups[i % len(groups)], i // len(groups) + 1
+            name = group if round_number == 1 else f'{group} {round_number}'
+            categories.append(Category(name=name, description=BENCHMARK_SOURCE))
+        Category.objects.bulk_create(categories)
+        return list(Category.objects.filter(description=BENCHMARK_SOURCE))
+
+    def _product(self, index, category, group):
+        rng = self.random
+        brand = rng.choice(BRANDS)
+        name = f'{brand} {rng.choice(ADJECTIVES)} {rng.choice(PRODUCT_TYPES[group])}'
+        created_at = self._past()
+        # Long-tailed prices between roughly 3 and 300
+        price = Decimal(str(round(min(max(rng.lognormvariate(3.2, 0.7), 2.99), 299.99), 2)))
+        discounted = rng.random() < 0.2
+        return Product(
+            name=name,
+            description=', '.join(rng.sample(INGREDIENTS, rng.randint(4, 9))),
+            price=price,
+            category=category,
+            stock=rng.choice([0, 0, 3, 10, 25, 50, 100]),
+            available=rng.random() < 0.95,
+            featured=rng.random() < 0.01,
+            is_premium=rng.random() < 0.05,
+            discount_percentage=Decimal(rng.choice([10, 15, 20, 25, 30, 50])) if discounted else Decimal('0'),
+            has_free_shipping=rng.random() < 0.1,
+            limited_edition=rng.random() < 0.02,
+            created_at=created_at,
+            updated_at=created_at,
+            external_id=f'{BENCHMARK_SOURCE}-{index}',
+            data_source=BENCHMARK_SOURCE,
+        )
+
+    def _products(self, count, categories):
+        for i in range(count):
+            category = self.random.choice(categories)
+            group = category.name.split(' ')[0]
+            yield self._product(i, category, group if group in PRODUCT_TYPES else 'Skincare')
+
+    def products(self, count, categories):
+        products = self._products(count, categories)
+        with _manual_timestamps(Product._meta.get_field('created_at'), Product._meta.get_field('updated_at')):
+            total = self._bulk_create(Product, products, 'Products')
+        # bulk_create skips the signals that maintain category product counts
+        Category.refresh_product_counts([category.id for category in categories])
+        return total
+
+    def users(self, count):
+        # Hashing once keeps generation fast, every benchmark user shares the password
+        password = make_password(PASSWORD)
+        users = (
+            User(
+                username=f'{USERNAME_PREFIX}user_{i}',
+                email=f'{USERNAME_PREFIX}user_{i}@example.com',
+                password=password,
+                date_joined=self._past(),
+            )
+            for i in range(count)
+        )
+        total = self._bulk_create(User, users, 'Users')
+        User.objects.update_or_create(
+            username=STAFF_USERNAME,
+            defaults={'password': password, 'is_staff': True, 'email': f'{STAFF_USERNAME}@example.com'},
+        )
+        # bulk_create skips the post_save signal that creates profiles
+        new_users = User.objects.filter(username__startswith=USERNAME_PREFIX, profile__isnull=True)
+        self._bulk_create(
+            Profile, (Profile(user=user, search_text=user_search_text(user)) for user in new_users), 'Profiles'
+        )
+        clear_user_stats()
+        return total
+
+    def orders(self, count, products, user_ids):
+        """Create orders of one to five items; products are (id, unit price) pairs"""
+        rng = self.random
+        statuses = ['delivered'] * 6 + ['shipped'] * 2 + ['processing', 'pending', 'cancelled']
+        created = 0
+        fields = [Order._meta.get_field('created_at'), Order._meta.get_field('updated_at')]
+        with _manual_timestamps(*fields):
+            for batch_start in range(0, count, self.batch_size):
+                orders, lines = [], []
+                for i in range(batch_start, min(count, batch_start + self.batch_size)):
+                    created_at = self._past()
+                    items = {product_id: (price, rng.randint(1, 3)) for product_id, price in rng.sample(products, rng.randint(1, 5))}
+                    subtotal = sum(price * quantity for price, quantity in items.values())
+                    orders.append(Order(
+                        user_id=rng.choice(user_ids),
+                        first_name='Bench', last_name=f'Customer {i}', email=f'order{i}@example.com',
+                        address=f'{i} Benchmark Street', postal_code=f'{10000 + i % 90000}', city=rng.choice(CITIES),
+                        status=rng.choice(statuses), payment_method='credit_card',
+                        subtotal_price=subtotal, total_price=subtotal,
+                        created_at=created_at, updated_at=created_at,
+                    ))
+                    lines.append(items)
+                with transaction.atomic():
+                    # Primary keys are set by bulk_create on PostgreSQL and sqlite
+                    Order.objects.bulk_create(orders)
+                    OrderItem.objects.bulk_create([
+                        OrderItem(order=order, product_id=product_id, price=price, quantity=quantity)
+                        for order, items in zip(orders, lines)
+                        for product_id, (price, quantity) in items.items()
+                    ], batch_size=self.batch_size)
+                created += len(orders)
+                self.log(f'Orders: {created}')
+        return created
+
+    def reviews(self, count, product_ids, user_ids):
+        """Create reviews for distinct (product, user) pairs, ratings skewed towards 4 and 5"""
+        rng = self.random
+        count = min(count, len(product_ids) * len(user_ids))
+        pairs = set()
+        while len(pairs) < count:
+            pairs.add((rng.choice(product_ids), rng.choice(user_ids)))
+        reviews = (
+            Review(
+                product_id=product_id, user_id=user_id,
+                rating=rng.choices([1, 2, 3, 4, 5], weights=[1, 1, 2, 4, 5])[0],
+                title=rng.choice(REVIEW_TITLES), comment='Generated review',
+            )
+            for product_id, user_id in pairs
+        )
+        return self._bulk_create(Review, reviews, 'Reviews')
+
+    def generate(self, products=10000, categories=50, users=1000, orders=20000, reviews=50000):
+        """Generate the whole catalog and return the number of rows created per model"""
+        category_rows = self.categories(categories)
+        counts = {'categories': len(category_rows)}
+        counts['products'] = self.products(products, category_rows)
+        counts['users'] = self.users(users)
+
+        product_rows = list(
+            Product.objects.filter(data_source=BENCHMARK_SOURCE, available=True)
+            .values_list('id', 'effective_price').iterator(chunk_size=self.batch_size)
+        )
+        product_ids = [product_id for product_id, price in product_rows]
+        user_ids = list(
+            User.objects.filter(username__startswith=f'{USERNAME_PREFIX}user_').values_list('id', flat=True)
+        )
+        counts['orders'] = self.orders(orders, product_rows, user_ids) if product_rows and user_ids else 0
+        # bulk_create bypasses checkout, so the dashboard rollups are recomputed
+        rebuild_rollups()
+        self.log('Sales rollups rebuilt')
+        counts['reviews'] = self.reviews(reviews, product_ids, user_ids) if product_ids and user_ids else 0
+        return counts
+
+
+def clear_benchmark_data():
+    """Delete everything generated for benchmarks, returns the number of deleted rows"""
+    deleted = 0
+    with transaction.atomic():
+        # Deleting users cascades to their orders, reviews and profiles
+        deleted += User.objects.filter(username__startswith=USERNAME_PREFIX).delete()[0]
+        deleted += Product.objects.filter(data_source=BENCHMARK_SOURCE).delete()[0]
+        deleted += Category.objects.filter(description=BENCHMARK_SOURCE).delete()[0]
+        rebuild_rollups()
+    clear_user_stats()
+    return deleted
@@ -0,0 +1,367 @@
+"""
+Scripted load scenario for the storefront.
+
+Each virtual shopper repeats the same journey: home page, filtered product
+list, search, product page, add to cart, then the checkout form and its
+submission, while a staff member opens the admin dashboard. Before each
+journey the shopper's cart is emptied and the product they buy is topped up
+to RESTOCK_LEVEL, so checkouts never fail for lack of stock. Requests go through Django's test client
+in-process, or over HTTP to a running server (runserver, gunicorn,
+uvicorn...). Choices are drawn from a seeded random generator, so two runs
+against the same data send the same requests.
+
+Every step states the response it expects: a status code, or a redirect to
+a named URL (checkout must end on the placed order's page). Any other
+response counts as an error, so a checkout that is sent back to the cart
+isn't timed as a success.
+
+Results report latency percentiles, errors, throughput and queries per
+request for every step, and the number of orders placed, as a JSON
+document that compare_results() can diff against a previous run.
+"""
+import json
+import math
+import platform
+import random
+import re
+import threading
+import time
+from collections import defaultdict, namedtuple
+from urllib.parse import urljoin, urlsplit
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection, connections
+from django.test import Client
+from django.urls import Resolver404, resolve, reverse
+from django.utils import timezone
+
+from ..middleware import QueryRecorder
+from ..models import CartItem, Category, Product, Order
+from .data import BENCHMARK_SOURCE, PASSWORD, STAFF_USERNAME, USERNAME_PREFIX
+
+
+SEARCH_TERMS = ['serum', 'matte', 'hydrating', 'lipstick', 'shampoo', 'oil', 'cream', 'parfum']
+SORTS = ['name', 'price_asc', 'price_desc', 'newest']
+
+CHECKOUT_FORM = {
+    'first_name': 'Bench', 'last_name': 'Shopper', 'email': 'shopper@example.com',
+    'address': '1 Benchmark Street', 'postal_code': '10001', 'city': 'London',
+    'payment_method': 'credit_card',
+}
+
+SERVER_TIMING_QUERIES_RE = re.compile(r'db;[^,]*desc="(\d+) queries"')
+IDEMPOTENCY_KEY_RE = re.compile(r'name="idempotency_key" value="([0-9a-f]{32})"')
+
+# Stock the product a shopper buys is topped up to before each journey
+RESTOCK_LEVEL = 1000
+
+# A response: status code, number of queries (None if unknown), Location header and body
+Reply = namedtuple('Reply', ['status', 'queries', 'location', 'text'])
+
+
+def is_expected(reply, expected):
+    """Whether reply is what a step expects: a status code, or a redirect to a URL name"""
+    if isinstance(expected, int):
+        return reply.status == expected
+    if reply.status not in (301, 302, 303):
+        return False
+    try:
+        return resolve(urlsplit(reply.location).path).view_name == expected
+    except Resolver404:
+        return False
+
+
+def percentile(values, percent):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(percent / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+class TestClientTarget:
+    """Send requests in-process through Django's test client"""
+
+    name = 'test-client'
+
+    def __init__(self):
+        self.client = Client()
+
+    def login(self, user):
+        self.client.force_login(user)
+
+    def request(self, method, path, data=None):
+        """Return the Reply to a request"""
+        recorder = QueryRecorder()
+        with connection.execute_wrapper(recorder):
+            response = getattr(self.client, method)(path, data or {})
+        return Reply(response.status_code, recorder.count, response.get('Location', ''), response.content.decode())
+
+    def close(self):
+        """Nothing to release, the client uses the thread's database connection"""
+
+
+class HttpTarget:
+    """
+    Send requests to a running server with the requests library.
+    Query counts are read from the Server-Timing header set by
+    QueryInstrumentationMiddleware. They are None if it is disabled, and
+    for customers unless the server runs with DEBUG on.
+    """
+
+    def __init__(self, base_url):
+        import requests
+        self.base_url = base_url
+        self.session = requests.Session()
+
+    def _csrf_headers(self, path):
+        token = self.session.cookies.get('csrftoken')
+        if token is None:
+            # Any page rendering a form sets the CSRF cookie
+            self.session.get(urljoin(self.base_url, reverse('login')))
+            token = self.session.cookies.get('csrftoken', '')
+        return {'X-CSRFToken': token, 'Referer': urljoin(self.base_url, path)}
+
+    def login(self, user):
+        path = reverse('login')
+        self.session.post(
+            urljoin(self.base_url, path),
+            data={'username': user.username, 'password': PASSWORD},
+            headers=self._csrf_headers(path),
+            allow_redirects=False,
+        )
+
+    def request(self, method, path, data=None):
+        url = urljoin(self.base_url, path)
+        if method == 'post':
+            response = self.session.post(url, data=data or {}, headers=self._csrf_headers(path), allow_redirects=False)
+        else:
+            response = self.session.get(url, params=data or {}, allow_redirects=False)
+        match = SERVER_TIMING_QUERIES_RE.search(response.headers.get('Server-Timing', ''))
+        queries = int(match.group(1)) if match else None
+        return Reply(response.status_code, queries, response.headers.get('Location', ''), response.text)
+
+    def close(self):
+        self.session.close()
+
+
+class StepStats:
+    """Latencies, query counts and errors recorded for one scenario step"""
+
+    def __init__(self):
+        self.latencies = []
+        self.queries = []
+        self.errors = 0
+
+    def record(self, latency, status, queries, failed=False):
+        """Record a request; failed marks a response the step didn't expect"""
+        self.latencies.append(latency)
+        if queries is not None:
+            self.queries.append(queries)
+        if failed or status >= 400:
+            self.errors += 1
+
+    def merge(self, other):
+        self.latencies.extend(other.latencies)
+        self.queries.extend(other.queries)
+        self.errors += other.errors
+
+    def summary(self):
+        def ms(value):
+            return round(value * 1000, 2) if value is not None else None
+        return {
+            'requests': len(self.latencies),
+            'errors': self.errors,
+            'p50_ms': ms(percentile(self.latencies, 50)),
+            'p95_ms': ms(percentile(self.latencies, 95)),
+            'p99_ms': ms(percentile(self.latencies, 99)),
+            'mean_ms': ms(sum(self.latencies) / len(self.latencies)) if self.latencies else None,
+            'max_ms': ms(max(self.latencies)) if self.latencies else None,
+            'queries_mean': round(sum(self.queries) / len(self.queries), 2) if self.queries else None,
+            'queries_max': max(self.queries) if self.queries else None,
+        }
+
+
+class ShoppingScenario:
+    """The steps of one shopper journey, with their inputs drawn from the seeded generator"""
+
+    def __init__(self, rng, category_ids, product_ids):
+        self.rng = rng
+        self.category_ids = category_ids
+        self.product_ids = product_ids
+        # The product the shopper views and buys
+        self.product_id = rng.choice(product_ids)
+
+    def steps(self):
+        """
+        Yield (step name, actor, method, path, data, expected); actor is
+        'customer' or 'staff', expected is a status code or the URL name a
+        redirect must lead to. Send each step's Reply back, later steps may
+        depend on it.
+        """
+        rng = self.rng
+        product_id = self.product_id
+        yield 'home', 'customer', 'get', reverse('store:home'), None, 200
+        yield 'product_list', 'customer', 'get', reverse('store:product_list'), {
+            'category': rng.choice(self.category_ids),
+            'sort': rng.choice(SORTS),
+            'min_price': rng.choice([0, 10, 25]),
+            'max_price': rng.choice([50, 100, 300]),
+        }, 200
+        yield 'search', 'customer', 'get', reverse('store:product_list'), {'q': rng.choice(SEARCH_TERMS)}, 200
+        yield 'product_detail', 'customer', 'get', reverse('store:product_detail', args=[product_id]), None, 200
+        yield 'cart_add', 'customer', 'post', reverse('store:cart_add', args=[product_id]), {
+            'quantity': rng.randint(1, 3),
+        }, 'store:cart_detail'
+        # The checkout page reserves the stock and hands out the form's idempotency key
+        form = yield 'checkout_form', 'customer', 'get', reverse('store:order_create'), None, 200
+        match = IDEMPOTENCY_KEY_RE.search(form.text)
+        checkout = dict(CHECKOUT_FORM, idempotency_key=match.group(1) if match else '')
+        yield 'checkout', 'customer', 'post', reverse('store:order_create'), checkout, 'store:order_detail'
+        yield 'admin_dashboard', 'staff', 'get', reverse('store:admin_dashboard'), None, 200
+
+
+def prepare_journey(user, product_id):
+    """Empty the shopper's cart, which a failed checkout leaves full, and restock the product they buy"""
+    CartItem.objects.filter(cart__user=user).delete()
+    Product.objects.filter(id=product_id, stock__lt=RESTOCK_LEVEL).update(stock=RESTOCK_LEVEL)
+
+
+def _run_worker(worker, iterations, warmup, seed, target_factory, users, staff, category_ids, product_ids, stats, lock):
+    rng = random.Random(seed * 1000 + worker)
+    user = users[worker % len(users)]
+    customer, admin = target_factory(), target_factory()
+    customer.login(user)
+    admin.login(staff)
+    targets = {'customer': customer, 'staff': admin}
+    local = defaultdict(StepStats)
+    try:
+        for iteration in range(warmup + iterations):
+            scenario = ShoppingScenario(rng, category_ids, product_ids)
+            prepare_journey(user, scenario.product_id)
+            journey, reply = scenario.steps(), None
+            while True:
+                try:
+                    step, actor, method, path, data, expected = journey.send(reply)
+                except StopIteration:
+                    break
+                start = time.perf_counter()
+                reply = targets[actor].request(method, path, data)
+                if iteration >= warmup:
+                    local[step].record(
+                        time.perf_counter() - start, reply.status, reply.queries, failed=not is_expected(reply, expected)
+                    )
+    finally:
+        customer.close()
+        admin.close()
+        if threading.current_thread() is not threading.main_thread():
+            # Worker threads open their own database connections
+            connections.close_all()
+    with lock:
+        for step, step_stats in local.items():
+            stats[step].merge(step_stats)
+
+
+def run_load(iterations=20, concurrency=1, warmup=2, seed=42, base_url=None):
+    """
+    Run the shopping scenario with concurrency virtual shoppers, each doing
+    warmup unrecorded journeys then iterations recorded ones.
+    Returns the results document.
+    """
+    users = list(User.objects.filter(username__startswith=f'{USERNAME_PREFIX}user_').order_by('id')[:max(concurrency, 1)])
+    staff = User.objects.filter(username=STAFF_USERNAME).first()
+    category_ids = list(Category.objects.filter(description=BENCHMARK_SOURCE).values_list('id', flat=True))
+    # Shoppers buy what is in stock; prepare_journey() keeps it there
+    product_ids = list(
+        Product.objects.filter(data_source=BENCHMARK_SOURCE, available=True, stock__gt=0)
+        .order_by('id').values_list('id', flat=True)[:10000]
+    )
+    if not users or staff is None or not category_ids or not product_ids:
+        raise ValueError('No benchmark data found, run generate_benchmark_data first.')
+
+    if base_url:
+        target_factory = lambda: HttpTarget(base_url)
+    else:
+        target_factory = TestClientTarget
+
+    stats = defaultdict(StepStats)
+    lock = threading.Lock()
+    started_at = timezone.now()
+    start = time.perf_counter()
+    worker_args = [
+        (worker, iterations, warmup, seed, target_factory, users, staff, category_ids, product_ids, stats, lock)
+        for worker in range(concurrency)
+    ]
+    if concurrency == 1:
+        _run_worker(*worker_args[0])
+    else:
+        workers = [threading.Thread(target=_run_worker, args=args) for args in worker_args]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+    duration = time.perf_counter() - start
+
+    overall = StepStats()
+    for step_stats in stats.values():
+        overall.merge(step_stats)
+    total = overall.summary()
+    # Warmup journeys are included in the wall time, leave them out of the request rate
+    recorded_share = iterations / (iterations + warmup) if iterations + warmup else 1
+    total['throughput_rps'] = round(total['requests'] / (duration * recorded_share), 2) if duration else None
+    checkout = stats['checkout']
+
+    return {
+        'started_at': started_at.isoformat(),
+        'duration_s': round(duration, 2),
+        'target': base_url or TestClientTarget.name,
+        'iterations': iterations,
+        'warmup': warmup,
+        'concurrency': concurrency,
+        'seed': seed,
+        'environment': {
+            'python': platform.python_version(),
+            'database': connection.vendor,
+            'debug': settings.DEBUG,
+        },
+        'dataset': {
+            'products': Product.objects.count(),
+            'orders': Order.objects.count(),
+            'users': User.objects.count(),
+        },
+        'overall': total,
+        # Checkouts that ended on the placed order's page
+        'orders_placed': len(checkout.latencies) - checkout.errors,
+        'steps': {step: step_stats.summary() for step, step_stats in sorted(stats.items())},
+    }
+
+
+def save_results(results, path):
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2)
+
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare_results(baseline, current, metrics=('p50_ms', 'p95_ms', 'p99_ms', 'queries_mean')):
+    """
+    Compare two results documents step by step.
+    Returns rows of (step, metric, baseline value, current value, change in percent).
+    """
+    rows = []
+    steps = dict(current['steps'], overall=current['overall'])
+    baseline_steps = dict(baseline['steps'], overall=baseline['overall'])
+    for step, values in steps.items():
+        previous = baseline_steps.get(step)
+        if previous is None:
+            continue
+        for metric in metrics:
+            old, new = previous.get(metric), values.get(metric)
+            change = round((new - old) / old * 100, 1) if old and new is not None else None
+            rows.append((step, metric, old, new, change))
+    return rows
@@ -0,0 +1,101 @@
+"""
+Bulk product editing.
+
+Products are selected by filter and changed with set-based UPDATE
+statements, one per batch of ids, instead of loading and saving each
+product. Every batch runs in one transaction that:
+
+- records the previous values of the changed fields in ProductHistory
+  with one bulk insert,
+- applies the changes with one UPDATE, bumping updated_at so the
+  incremental similar-products build picks the products up,
+- recounts the product counts of the batch's categories once, when
+  availability changed.
+
+Product.save() and its signals are not called, so the generated
+effective_price column is the only derived value the database updates
+by itself.
+"""
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import F, Q, Value
+from django.db.models.functions import Greatest, Round
+from django.utils import timezone
+
+from .models import Category, Product, ProductHistory
+
+
+FLAGS = ['available', 'featured', 'is_premium', 'has_free_shipping', 'limited_edition']
+
+
+def filter_products(category=None, search='', **flags):
+    """Products of a category, matching a search, with the given flag values (None means any)"""
+    queryset = Product.objects.all()
+    if category:
+        queryset = queryset.filter(category=category)
+    if search:
+        queryset = queryset.filter(Q(name__icontains=search) | Q(description__icontains=search))
+    for flag in FLAGS:
+        if flags.get(flag) is not None:
+            queryset = queryset.filter(**{flag: flags[flag]})
+    return queryset
+
+
+def build_updates(price=None, price_percent=None, discount_percentage=None, stock=None, stock_change=None, **flags):
+    """
+    Turn the requested changes into the keyword arguments of
+    QuerySet.update(). price_percent raises (or with a negative value,
+    lowers) prices by a percentage, rounded to the cent; stock_change adds
+    to the stock without going below zero.
+    """
+    updates = {}
+    if price is not None:
+        updates['price'] = price
+    elif price_percent is not None:
+        factor = (Decimal(100) + price_percent) / Decimal(100)
+        updates['price'] = Round(F('price') * Value(factor), 2)
+    if discount_percentage is not None:
+        updates['discount_percentage'] = discount_percentage
+    if stock is not None:
+        updates['stock'] = stock
+    elif stock_change:
+        updates['stock'] = Greatest(F('stock') + Value(stock_change), Value(0))
+    for flag in FLAGS:
+        if flags.get(flag) is not None:
+            updates[flag] = flags[flag]
+    return updates
+
+
+def _history(product_ids, updates):
+    """Unsaved ProductHistory diffs holding the values updates will replace"""
+    entries = []
+    for row in Product.objects.filter(id__in=product_ids).values('id', *updates):
+        changes = {}
+        for field, new in updates.items():
+            # Expressions always count as a change; plain values only when they differ
+            if hasattr(new, 'resolve_expression') or row[field] != new:
+                changes[field] = ProductHistory.json_value(row[field])
+        if changes:
+            entries.append(ProductHistory.build(row['id'], changes))
+    return entries
+
+
+def apply_bulk_edit(queryset, updates, batch_size=1000):
+    """
+    Apply updates to every product of queryset, batch_size products at a
+    time. Returns the number of products updated.
+    """
+    if not updates:
+        return 0
+    recount = 'available' in updates
+    product_ids = list(queryset.order_by('id').values_list('id', flat=True))
+    for start in range(0, len(product_ids), batch_size):
+        batch = product_ids[start:start + batch_size]
+        with transaction.atomic():
+            ProductHistory.objects.bulk_create(_history(batch, updates))
+            Product.objects.filter(id__in=batch).update(updated_at=timezone.now(), **updates)
+            if recount:
+                category_ids = set(Product.objects.filter(id__in=batch).values_list('category_id', flat=True))
+                Category.refresh_product_counts(category_ids)
+    return len(product_ids)
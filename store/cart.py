@@ -0,0 +1,262 @@
+"""
+Shopping cart services.
+
+Signed-in users keep their cart in the Cart and CartItem tables. Anonymous
+shoppers get a guest cart stored in their session as product id -> quantity,
+so adding to the cart never writes cart rows for visitors who don't buy.
+Both carts expose the same API, and the guest cart is merged into the
+user's Cart when they log in.
+"""
+from functools import cached_property
+
+from django.db import transaction
+from django.db.models import Case, F, Sum, Value, When
+
+from .models import Cart, CartItem, Product
+from .pricing import CartSummary, build_summary, unit_price_cents
+
+
+CART_SESSION_KEY = 'cart'
+
+# Upper bound for a single cart line, matches CartAddProductForm
+MAX_QUANTITY = 100
+
+
+def add_quantities(cart, quantities):
+    """
+    Atomically increment the quantities of many products in a cart.
+
+    Missing lines are inserted with quantity 0 and every line is then bumped
+    with a single UPDATE ... SET quantity = quantity + n, so concurrent adds
+    (double clicks, several tabs) never lose increments.
+    quantities maps product ids to the amount to add.
+    """
+    if not quantities:
+        return
+    with transaction.atomic():
+        CartItem.objects.bulk_create(
+            [CartItem(cart=cart, product_id=product_id, quantity=0) for product_id in quantities],
+            ignore_conflicts=True,
+        )
+        increments = set(quantities.values())
+        if len(increments) == 1:
+            increment = Value(increments.pop())
+        else:
+            increment = Case(
+                *[When(product_id=product_id, then=Value(quantity)) for product_id, quantity in quantities.items()],
+                default=Value(0),
+            )
+        CartItem.objects.filter(cart=cart, product_id__in=quantities.keys()).update(quantity=F('quantity') + increment)
+
+
+def set_quantities(cart, quantities):
+    """
+    Set the quantities of many products in a cart with one upsert.
+    A quantity of 0 removes the line.
+    """
+    removed = [product_id for product_id, quantity in quantities.items() if quantity <= 0]
+    kept = [
+        CartItem(cart=cart, product_id=product_id, quantity=quantity)
+        for product_id, quantity in quantities.items()
+        if quantity > 0
+    ]
+    with transaction.atomic():
+        if removed:
+            CartItem.objects.filter(cart=cart, product_id__in=removed).delete()
+        if kept:
+            CartItem.objects.bulk_create(
+                kept,
+                update_conflicts=True,
+                unique_fields=['cart', 'product'],
+                update_fields=['quantity'],
+            )
+
+
+class SessionCart:
+    """Guest cart kept in the session"""
+
+    def __init__(self, request):
+        self.session = request.session
+        self.quantities = self.session.get(CART_SESSION_KEY, {})
+
+    def _save(self):
+        self.session[CART_SESSION_KEY] = self.quantities
+        self.session.modified = True
+
+    def add(self, product, quantity=1, override_quantity=False):
+        """Add a product to the cart or update its quantity"""
+        if override_quantity:
+            self.set_quantities({product.id: quantity})
+        else:
+            self.add_quantities({product.id: quantity})
+
+    def add_quantities(self, quantities):
+        """Increment the quantities of many products, keyed by product id"""
+        for product_id, quantity in quantities.items():
+            key = str(product_id)
+            self.quantities[key] = self.quantities.get(key, 0) + quantity
+        self._save()
+
+    def set_quantities(self, quantities):
+        """Set the quantities of many products, a quantity of 0 removes the line"""
+        for product_id, quantity in quantities.items():
+            if quantity > 0:
+                self.quantities[str(product_id)] = quantity
+            else:
+                self.quantities.pop(str(product_id), None)
+        self._save()
+
+    def remove(self, product):
+        """Remove a product from the cart, returns False if it wasn't there"""
+        if self.quantities.pop(str(product.id), None) is None:
+            return False
+        self._save()
+        return True
+
+    def clear(self):
+        self.session.pop(CART_SESSION_KEY, None)
+        self.quantities = {}
+
+    def get_summary(self):
+        """Price the cart, loading and pricing its products in one query"""
+        if not self.quantities:
+            return CartSummary()
+        products = Product.objects.filter(id__in=self.quantities.keys()).select_related('category').annotate(
+            unit_cents=unit_price_cents()
+        ).order_by('name')
+        return build_summary(
+            (product, self.quantities[str(product.id)], product.unit_cents) for product in products
+        )
+
+    def get_items(self):
+        return self.get_summary().lines
+
+    def get_total_price(self):
+        return self.get_summary().subtotal
+
+    def get_total_items(self):
+        return sum(self.quantities.values())
+
+
+class DatabaseCart:
+    """Cart of a signed-in user, kept in the Cart table"""
+
+    def __init__(self, request):
+        self.user = request.user
+
+    @cached_property
+    def cart(self):
+        cart, created = Cart.objects.get_or_create(user=self.user)
+        return cart
+
+    def add(self, product, quantity=1, override_quantity=False):
+        """Add a product to the cart or update its quantity"""
+        if override_quantity:
+            self.set_quantities({product.id: quantity})
+        else:
+            self.add_quantities({product.id: quantity})
+
+    def add_quantities(self, quantities):
+        """Atomically increment the quantities of many products, keyed by product id"""
+        add_quantities(self.cart, quantities)
+
+    def set_quantities(self, quantities):
+        """Set the quantities of many products, a quantity of 0 removes the line"""
+        set_quantities(self.cart, quantities)
+
+    def remove(self, product):
+        """Remove a product from the cart, returns False if it wasn't there"""
+        deleted, _ = CartItem.objects.filter(cart__user=self.user, product=product).delete()
+        return deleted > 0
+
+    def clear(self):
+        CartItem.objects.filter(cart__user=self.user).delete()
+
+    def get_summary(self):
+        """Price the cart, loading and pricing its lines in one query"""
+        items = CartItem.objects.filter(cart__user=self.user).select_related('product__category').annotate(
+            unit_cents=unit_price_cents('product__')
+        ).order_by('product__name')
+        return build_summary((item.product, item.quantity, item.unit_cents) for item in items)
+
+    def get_items(self):
+        return self.get_summary().lines
+
+    def get_total_price(self):
+        return self.get_summary().subtotal
+
+    def get_total_items(self):
+        total = CartItem.objects.filter(cart__user=self.user).aggregate(total=Sum('quantity'))['total']
+        return total or 0
+
+
+def get_cart(request):
+    """Return the cart of the current visitor"""
+    if request.user.is_authenticated:
+        return DatabaseCart(request)
+    return SessionCart(request)
+
+
+def get_cart_summary(request):
+    """
+    Price the visitor's cart once per request.
+
+    The summary is cached on the request so a view and the navbar context
+    processor share it; views that change the cart should price it again
+    with get_cart(request).get_summary().
+    """
+    if not hasattr(request, '_cart_summary'):
+        request._cart_summary = get_cart(request).get_summary()
+    return request._cart_summary
+
+
+def merge_session_cart(request, user):
+    """
+    Merge a guest cart into the user's Cart in bulk, adding guest
+    quantities to any quantities already in the cart.
+    Returns the number of merged lines.
+    """
+    quantities = request.session.get(CART_SESSION_KEY)
+    if not quantities:
+        return 0
+
+    cart, created = Cart.objects.get_or_create(user=user)
+    product_ids = Product.objects.filter(id__in=quantities.keys()).values_list('id', flat=True)
+    merged = {product_id: quantities[str(product_id)] for product_id in product_ids}
+    add_quantities(cart, merged)
+
+    del request.session[CART_SESSION_KEY]
+    return len(merged)
+
+
+def parse_cart_lines(lines):
+    """
+    Validate a list of {"product_id": ..., "qty": ...} lines sent by the front-end.
+
+    Returns {product_id: quantity} for the accepted lines together with the
+    list of rejected product ids (unknown, or unavailable and not being removed). Raises ValueError on a
+    malformed payload.
+    """
+    if not isinstance(lines, list):
+        raise ValueError('Expected a list of cart lines.')
+
+    quantities = {}
+    for line in lines:
+        if not isinstance(line, dict):
+            raise ValueError('Each cart line must be an object.')
+        product_id, quantity = line.get('product_id'), line.get('qty')
+        if not isinstance(product_id, int) or not isinstance(quantity, int) or isinstance(quantity, bool):
+            raise ValueError('product_id and qty must be integers.')
+        if quantity < 0 or quantity > MAX_QUANTITY:
+            raise ValueError(f'qty must be between 0 and {MAX_QUANTITY}.')
+        quantities[product_id] = quantity
+
+    # Unavailable products can still be removed, but not added
+    availability = dict(Product.objects.filter(id__in=quantities.keys()).values_list('id', 'available'))
+    accepted, rejected = {}, []
+    for product_id, quantity in quantities.items():
+        if product_id in availability and (availability[product_id] or quantity == 0):
+            accepted[product_id] = quantity
+        else:
+            rejected.append(product_id)
+    return accepted, rejected
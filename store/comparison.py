@@ -0,0 +1,209 @@
+"""
+Product comparison helpers.
+
+Anonymous visitors keep their comparison list in a signed cookie, so
+browsing the site never creates database rows; signed-in users keep it
+in ComparisonList. The comparison table is built from a single annotated
+query so the number of queries does not grow with the number of products.
+"""
+import math
+
+from django.conf import settings
+from django.db.models import Avg, Count, F
+
+from .models import Product, ComparisonList, ComparisonItem
+
+
+COOKIE_NAME = 'comparison'
+COOKIE_SALT = 'store.comparison'
+COOKIE_MAX_AGE = 60 * 60 * 24 * 30
+
+# Maximum number of products kept in an anonymous comparison list
+MAX_PRODUCTS = getattr(settings, 'COMPARISON_MAX_PRODUCTS', 4)
+
+
+class CookieComparisonStorage:
+    """Comparison list of an anonymous visitor, kept in a signed cookie"""
+
+    def __init__(self, request):
+        self.request = request
+        self.changed = False
+        self._product_ids = self._read_cookie(request)
+
+    @staticmethod
+    def _read_cookie(request):
+        value = request.get_signed_cookie(COOKIE_NAME, default='', salt=COOKIE_SALT)
+        product_ids = []
+        for part in value.split(','):
+            if part.isdigit() and int(part) not in product_ids:
+                product_ids.append(int(part))
+        return product_ids[:MAX_PRODUCTS]
+
+    def get_product_ids(self):
+        """Product ids, most recently added first"""
+        return list(self._product_ids)
+
+    def count(self):
+        return len(self._product_ids)
+
+    def contains(self, product_id):
+        return product_id in self._product_ids
+
+    def add(self, product_id):
+        """Add a product, dropping the oldest one when the list is full"""
+        if product_id in self._product_ids:
+            return False
+        self._product_ids = [product_id] + self._product_ids[:MAX_PRODUCTS - 1]
+        self.changed = True
+        return True
+
+    def remove(self, product_id):
+        if product_id not in self._product_ids:
+            return False
+        self._product_ids.remove(product_id)
+        self.changed = True
+        return True
+
+    def clear(self):
+        self._product_ids = []
+        self.changed = True
+
+    def update_response(self, response):
+        """Write the list back to the cookie if it changed"""
+        if not self.changed:
+            return response
+        if self._product_ids:
+            response.set_signed_cookie(
+                COOKIE_NAME,
+                ','.join(str(product_id) for product_id in self._product_ids),
+                salt=COOKIE_SALT,
+                max_age=COOKIE_MAX_AGE,
+                httponly=True,
+                samesite='Lax',
+            )
+        else:
+            response.delete_cookie(COOKIE_NAME, samesite='Lax')
+        return response
+
+
+class DatabaseComparisonStorage:
+    """Comparison list of a signed-in user, kept in ComparisonList"""
+
+    def __init__(self, request):
+        self.request = request
+        self.user = request.user
+
+    def _items(self):
+        return ComparisonItem.objects.filter(comparison_list__user=self.user)
+
+    def get_product_ids(self):
+        """Product ids, most recently added first"""
+        return list(self._items().values_list('product_id', flat=True))
+
+    def count(self):
+        return self._items().count()
+
+    def contains(self, product_id):
+        return self._items().filter(product_id=product_id).exists()
+
+    def add(self, product_id):
+        comparison_list, created = ComparisonList.objects.get_or_create(user=self.user)
+        item, created = ComparisonItem.objects.get_or_create(comparison_list=comparison_list, product_id=product_id)
+        return created
+
+    def remove(self, product_id):
+        deleted, _ = self._items().filter(product_id=product_id).delete()
+        return deleted > 0
+
+    def clear(self):
+        self._items().delete()
+
+    def update_response(self, response):
+        """Drop a leftover anonymous cookie, its products were merged on login"""
+        if COOKIE_NAME in self.request.COOKIES:
+            response.delete_cookie(COOKIE_NAME, samesite='Lax')
+        return response
+
+
+def get_comparison_storage(request):
+    """Return the comparison list storage for the current visitor"""
+    if request.user.is_authenticated:
+        return DatabaseComparisonStorage(request)
+    return CookieComparisonStorage(request)
+
+
+def merge_anonymous_comparison(request, user):
+    """Persist an anonymous visitor's comparison list into the user's ComparisonList"""
+    product_ids = CookieComparisonStorage._read_cookie(request)
+    if not product_ids:
+        return 0
+
+    comparison_list, created = ComparisonList.objects.get_or_create(user=user)
+    existing_ids = set(Product.objects.filter(id__in=product_ids).values_list('id', flat=True))
+    # Oldest first so the most recently added product keeps the newest added_at
+    items = [
+        ComparisonItem(comparison_list=comparison_list, product_id=product_id)
+        for product_id in reversed(product_ids)
+        if product_id in existing_ids
+    ]
+    ComparisonItem.objects.bulk_create(items, ignore_conflicts=True)
+    return len(items)
+
+
+def get_comparison_products(product_ids):
+    """
+    Fetch the products to compare, annotated with their rating average,
+    review count and category name, in the order of product_ids.
+    """
+    products = Product.objects.filter(id__in=product_ids).annotate(
+        avg_rating=Avg('reviews__rating'),
+        review_count=Count('reviews'),
+        category_name=F('category__name'),
+    )
+    by_id = {product.id: product for product in products}
+    return [by_id[product_id] for product_id in product_ids if product_id in by_id]
+
+
+def _rating_stars(rating):
+    """Return 'full', 'half' or 'empty' for each of the five rating stars"""
+    full = math.floor(rating)
+    stars = []
+    for position in range(1, 6):
+        if position <= full:
+            stars.append('full')
+        elif position == full + 1 and rating - full >= 0.5:
+            stars.append('half')
+        else:
+            stars.append('empty')
+    return stars
+
+
+def build_comparison_rows(products):
+    """
+    Build the attribute rows of the comparison table.
+
+    Each row is {'label': ..., 'cells': [...]} with one cell per product in
+    the same order as products; rating cells also carry their star icons.
+    Products must come from get_comparison_products.
+    """
+    if not products:
+        return []
+
+    def row(label, values):
+        return {'label': label, 'cells': [{'value': value} for value in values]}
+
+    rows = [
+        row('Price', [f"${p.price}" for p in products]),
+        row('Category', [p.category_name or "Uncategorized" for p in products]),
+        row('In Stock', ["Yes" if p.stock > 0 else "No" for p in products]),
+        row('Stock Count', [p.stock for p in products]),
+    ]
+
+    rating_cells = []
+    for p in products:
+        rating = p.avg_rating or 0
+        rating_cells.append({'value': f"{rating:.1f}/5.0", 'stars': _rating_stars(rating)})
+    rows.append({'label': 'Rating', 'cells': rating_cells})
+
+    rows.append(row('Reviews', [p.review_count for p in products]))
+    return rows
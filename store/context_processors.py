@@ -1,27 +1,18 @@
-from .models import Cart, Wishlist, ComparisonList
+from .models import Wishlist
+from .cart import get_cart_summary
+from .comparison import get_comparison_storage
 
 def cart_processor(request):
     """
     Context processor to add cart information to all templates.
     This makes the cart item count available in all templates.
+    The cart summary is shared with the view, so pages that already
+    priced the cart don't query it again.
     """
     cart_items_count = 0
 
     try:
-        if request.user.is_authenticated:
-            # Get cart for authenticated user
-            cart = Cart.objects.filter(user=request.user).first()
-        else:
-            # Get cart for anonymous user using session
-            session_id = request.session.session_key
-            if session_id:
-                cart = Cart.objects.filter(session_id=session_id).first()
-            else:
-                cart = None
-
-        # Count items in cart
-        if cart:
-            cart_items_count = cart.get_total_items()
+        cart_items_count = get_cart_summary(request).total_items
     except Exception:
         # Fail silently if there's an error
         pass
@@ -55,24 +46,12 @@ def comparison_processor(request):
     """
     Context processor to add comparison list information to all templates.
     This makes the comparison item count available in all templates.
+    Anonymous lists are read from a cookie, so no database query is needed.
     """
     comparison_items_count = 0
 
     try:
-        if request.user.is_authenticated:
-            # Get comparison list for authenticated user
-            comparison_list = ComparisonList.objects.filter(user=request.user).first()
-        else:
-            # Get comparison list for anonymous user using session
-            session_id = request.session.session_key
-            if session_id:
-                comparison_list = ComparisonList.objects.filter(session_id=session_id).first()
-            else:
-                comparison_list = None
-
-        # Count items in comparison list
-        if comparison_list:
-            comparison_items_count = comparison_list.get_products_count()
+        comparison_items_count = get_comparison_storage(request).count()
     except Exception:
         # Fail silently if there's an error
         pass
@@ -0,0 +1,125 @@
+"""
+Coupon lookups and usage claims.
+
+Codes are matched case-insensitively through an index on UPPER(code).
+The coupons they point to are cached for COUPON_CACHE_TIMEOUT seconds (30
+by default), so applying a coupon and pricing the checkout page don't
+query for it again. Saving or deleting a coupon clears its cache entries
+through signals in store.signals.
+
+A cached coupon's current_uses can lag behind, so it is only a hint.
+Placing an order claims a use with a single
+UPDATE ... WHERE current_uses < max_uses, which fails instead of going
+over the cap however many orders race for the last use. The UPDATE also
+locks the coupon's row until the order commits. The per-user limit is
+therefore counted from CouponUse after it, and the order's use is
+recorded in the same transaction.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Q
+from django.db.models.functions import Upper
+from django.utils import timezone
+
+from .models import Coupon, CouponUse
+
+MISSING = object()
+
+
+class CouponError(Exception):
+    """A coupon code that doesn't exist or can't be used; the message is shown to the customer"""
+
+
+def normalize_code(code):
+    return (code or '').strip().upper()
+
+
+def cache_timeout():
+    return getattr(settings, 'COUPON_CACHE_TIMEOUT', 30)
+
+
+def _code_key(code):
+    return f'store:coupon:code:{normalize_code(code)}'
+
+
+def _id_key(coupon_id):
+    return f'store:coupon:{coupon_id}'
+
+
+def get_coupon_by_id(coupon_id):
+    """The coupon with coupon_id, from the cache when fresh, or None"""
+    coupon = cache.get(_id_key(coupon_id), MISSING)
+    if coupon is MISSING:
+        coupon = Coupon.objects.filter(id=coupon_id).first()
+        cache.set(_id_key(coupon_id), coupon, cache_timeout())
+    return coupon
+
+
+def code_lookup(code):
+    """Ids of the coupons matching a normalized code, through the UPPER(code) index"""
+    return Coupon.objects.alias(normalized_code=Upper('code')).filter(normalized_code=code).values_list('id', flat=True)
+
+
+def get_coupon(code):
+    """The coupon with code, in any case, or None; unknown codes are cached too"""
+    code = normalize_code(code)
+    if not code:
+        return None
+    coupon_id = cache.get(_code_key(code), MISSING)
+    if coupon_id is MISSING:
+        coupon_id = code_lookup(code).first()
+        cache.set(_code_key(code), coupon_id, cache_timeout())
+    coupon = get_coupon_by_id(coupon_id) if coupon_id else None
+    # The coupon's code may have changed since its id was cached
+    if coupon is None or normalize_code(coupon.code) != code:
+        return None
+    return coupon
+
+
+def invalidate_coupon(coupon):
+    cache.delete_many([_code_key(coupon.code), _id_key(coupon.id)])
+
+
+def user_uses(coupon, user):
+    return CouponUse.objects.filter(coupon=coupon, user=user).count()
+
+
+def check_coupon(coupon, user=None):
+    """Raise CouponError unless coupon can be used, by user if given; returns the coupon"""
+    if coupon is None:
+        raise CouponError("Invalid coupon code.")
+    if not coupon.is_valid():
+        raise CouponError("This coupon is no longer valid.")
+    if user is not None and coupon.max_uses_per_user and user_uses(coupon, user) >= coupon.max_uses_per_user:
+        raise CouponError("You have already used this coupon the maximum number of times.")
+    return coupon
+
+
+def lookup_coupon(code, user=None):
+    """The usable coupon with code; raises CouponError"""
+    return check_coupon(get_coupon(code), user)
+
+
+def claim_coupon(coupon, order):
+    """
+    Count one use of coupon for order and record it; call inside the
+    order's transaction. Raises CouponError, claiming nothing, if the
+    coupon has expired, is used up or the customer reached their limit.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        claimed = Coupon.objects.filter(
+            Q(max_uses=0) | Q(current_uses__lt=F('max_uses')),
+            id=coupon.id, active=True, valid_from__lte=now, valid_to__gte=now,
+        ).update(current_uses=F('current_uses') + 1)
+        if not claimed:
+            raise CouponError("This coupon is no longer valid.")
+        if coupon.max_uses_per_user and user_uses(coupon, order.user) >= coupon.max_uses_per_user:
+            raise CouponError("You have already used this coupon the maximum number of times.")
+        use = CouponUse.objects.create(
+            coupon=coupon, user=order.user, order=order, discount_amount=order.discount_amount
+        )
+    # Cached copies would keep the old current_uses until they expire
+    transaction.on_commit(lambda: invalidate_coupon(coupon))
+    return use
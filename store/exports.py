@@ -0,0 +1,190 @@
+"""
+Streaming exports of orders and products for the back office.
+
+Rows are read as values with .iterator(chunk_size), which keeps one chunk
+of rows in memory at a time (with the items of a chunk of orders), and
+are written as CSV or JSON Lines one record at a time. Memory use is
+therefore constant however many rows are exported, and the admin
+endpoints can return them through a StreamingHttpResponse.
+"""
+import csv
+import json
+from datetime import datetime
+from decimal import Decimal
+
+from django.utils import timezone
+
+from .models import Order, OrderItem, Product
+from .rollups import day_bounds
+
+
+FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'jsonl': ('application/x-ndjson', 'jsonl'),
+}
+
+ORDER_FIELDS = [
+    'id', 'created_at', 'status', 'user_id', 'username', 'first_name', 'last_name', 'email',
+    'address', 'postal_code', 'city', 'country', 'phone', 'payment_method', 'coupon',
+    'subtotal_price', 'discount_amount', 'total_price', 'item_count', 'items',
+]
+
+PRODUCT_FIELDS = [
+    'id', 'name', 'category', 'price', 'discount_percentage', 'effective_price', 'stock',
+    'available', 'featured', 'external_id', 'data_source', 'created_at', 'updated_at',
+]
+
+# Spreadsheet applications evaluate cells starting with these as formulas
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def _created_between(queryset, start, end):
+    lower, upper = day_bounds(start, end)
+    if lower:
+        queryset = queryset.filter(created_at__gte=lower)
+    if upper:
+        queryset = queryset.filter(created_at__lt=upper)
+    return queryset
+
+
+ORDER_VALUES = [
+    'id', 'created_at', 'status', 'user_id', 'user__username', 'first_name', 'last_name', 'email',
+    'address', 'postal_code', 'city', 'country', 'phone', 'payment_method', 'coupon__code',
+    'subtotal_price', 'discount_amount', 'total_price',
+]
+
+PRODUCT_VALUES = [
+    'id', 'name', 'category__name', 'price', 'discount_percentage', 'effective_price', 'stock',
+    'available', 'featured', 'external_id', 'data_source', 'created_at', 'updated_at',
+]
+
+
+def order_queryset(start=None, end=None, status=None):
+    """Orders placed between two dates (inclusive), optionally with one status"""
+    queryset = Order.objects.order_by('id')
+    if status:
+        queryset = queryset.filter(status=status)
+    return _created_between(queryset, start, end)
+
+
+def product_queryset(start=None, end=None, category=None, available=None):
+    """Products created between two dates (inclusive), optionally of one category or availability"""
+    queryset = Product.objects.order_by('id')
+    if category:
+        queryset = queryset.filter(category_id=category)
+    if available is not None:
+        queryset = queryset.filter(available=available)
+    return _created_between(queryset, start, end)
+
+
+def _chunks(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def order_records(queryset, chunk_size):
+    """
+    Yield one dict per order with its items. Rows are read as values rather
+    than model instances, and the items of each chunk of orders are loaded
+    with one query.
+    """
+    rows = queryset.values_list(*ORDER_VALUES).iterator(chunk_size=chunk_size)
+    for chunk in _chunks(rows, chunk_size):
+        items = {}
+        item_rows = OrderItem.objects.using(queryset.db).filter(order_id__in=[row[0] for row in chunk]).order_by('id').values_list(
+            'order_id', 'product_id', 'product__name', 'quantity', 'price'
+        )
+        for order_id, product_id, name, quantity, price in item_rows:
+            items.setdefault(order_id, []).append(
+                {'product_id': product_id, 'name': name, 'quantity': quantity, 'price': price}
+            )
+        for row in chunk:
+            record = dict(zip(ORDER_FIELDS, row))
+            record['country'] = record['country'] or ''
+            record['phone'] = record['phone'] or ''
+            record['coupon'] = record['coupon'] or ''
+            record['items'] = items.get(record['id'], [])
+            record['item_count'] = sum(item['quantity'] for item in record['items'])
+            yield record
+
+
+def product_records(queryset, chunk_size):
+    for row in queryset.values_list(*PRODUCT_VALUES).iterator(chunk_size=chunk_size):
+        record = dict(zip(PRODUCT_FIELDS, row))
+        record['external_id'] = record['external_id'] or ''
+        record['data_source'] = record['data_source'] or ''
+        yield record
+
+
+EXPORTS = {
+    'orders': (order_queryset, order_records, ORDER_FIELDS),
+    'products': (product_queryset, product_records, PRODUCT_FIELDS),
+}
+
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f'Cannot serialize {type(value).__name__}')
+
+
+def _csv_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, list):
+        # Order items as "quantity x name @ price" separated by semicolons
+        return '; '.join(f"{item['quantity']} x {item['name']} @ {item['price']}" for item in value)
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+class _Echo:
+    """File-like object whose write() returns the line instead of storing it"""
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(records, fields):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(fields)
+    for record in records:
+        yield writer.writerow([_csv_value(record[field]) for field in fields])
+
+
+def jsonl_lines(records):
+    for record in records:
+        yield json.dumps(record, default=_json_default) + '\n'
+
+
+def export_lines(kind, fmt, chunk_size=2000, using=None, **filters):
+    """
+    Yield the lines of an export of kind ('orders' or 'products') in fmt
+    ('csv' or 'jsonl'), filtered by the keyword arguments of its queryset,
+    read from the database alias using (the router's choice if None).
+    """
+    if kind not in EXPORTS:
+        raise ValueError(f'Unknown export: {kind}')
+    if fmt not in FORMATS:
+        raise ValueError(f'Unknown format: {fmt}')
+    get_queryset, get_records, fields = EXPORTS[kind]
+    queryset = get_queryset(**filters)
+    if using:
+        queryset = queryset.using(using)
+    records = get_records(queryset, chunk_size)
+    if fmt == 'csv':
+        return csv_lines(records, fields)
+    return jsonl_lines(records)
+
+
+def export_filename(kind, fmt):
+    return f"{kind}-{timezone.localdate().isoformat()}.{FORMATS[fmt][1]}"
@@ -1,6 +1,10 @@
+from decimal import Decimal
+
 from django import forms
 from django.forms import inlineformset_factory
-from .models import Order, Review, Coupon, Product, Category, ProductImage
+from .coupons import CouponError, lookup_coupon
+from .models import Order, Review, Product, Category, ProductImage
+from .bulk_edit import FLAGS
 
 
 class CartAddProductForm(forms.Form):
@@ -15,6 +19,9 @@ class CartAddProductForm(forms.Form):
 
 class OrderCreateForm(forms.ModelForm):
     """Form for creating a new order"""
+    # Identifies this rendering of the form so resubmissions place one order, see store.idempotency
+    idempotency_key = forms.CharField(widget=forms.HiddenInput, required=False, max_length=64)
+
     class Meta:
         model = Order
         fields = ['first_name', 'last_name', 'email', 'address', 'postal_code', 'city', 
@@ -104,16 +111,18 @@ class CouponApplyForm(forms.Form):
         })
     )
 
+    def __init__(self, *args, user=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.user = user
+        self.coupon = None
+
     def clean_code(self):
         code = self.cleaned_data.get('code')
         if code:
             try:
-                coupon = Coupon.objects.get(code__iexact=code, active=True)
-                if not coupon.is_valid():
-                    raise forms.ValidationError("This coupon is no longer valid.")
-                return code
-            except Coupon.DoesNotExist:
-                raise forms.ValidationError("Invalid coupon code.")
+                self.coupon = lookup_coupon(code, self.user)
+            except CouponError as e:
+                raise forms.ValidationError(str(e))
         return code
 
 
@@ -186,4 +195,93 @@ ProductImageFormSet = inlineformset_factory(
     extra=3,  # Number of empty forms to display
     max_num=10,  # Maximum number of forms
     can_delete=True  # Allow deleting images
-)
\ No newline at end of file
+)
+
+FLAG_CHOICES = (
+    ('', 'Any'),
+    ('1', 'Yes'),
+    ('0', 'No'),
+)
+
+CHANGE_FLAG_CHOICES = (
+    ('', 'Leave unchanged'),
+    ('1', 'Set'),
+    ('0', 'Clear'),
+)
+
+
+def flag_field(choices, label):
+    """Optional yes/no select, cleaned to True, False or None"""
+    return forms.TypedChoiceField(
+        choices=choices, required=False, label=label, coerce=lambda value: value == '1', empty_value=None,
+        widget=forms.Select(attrs={'class': 'form-select'})
+    )
+
+
+class BulkProductEditForm(forms.Form):
+    """Select products by filter and describe the changes to apply to all of them"""
+
+    # Filters
+    category = forms.ModelChoiceField(
+        queryset=Category.objects.order_by('name'), required=False, empty_label='All Categories',
+        widget=forms.Select(attrs={'class': 'form-select'})
+    )
+    search = forms.CharField(
+        required=False, widget=forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Name or description'})
+    )
+    filter_available = flag_field(FLAG_CHOICES, 'Available')
+    filter_featured = flag_field(FLAG_CHOICES, 'Featured')
+    filter_is_premium = flag_field(FLAG_CHOICES, 'Premium')
+
+    # Changes
+    price = forms.DecimalField(
+        required=False, max_digits=10, decimal_places=2, min_value=Decimal('0.01'), label='Set price to',
+        widget=forms.NumberInput(attrs={'class': 'form-control', 'step': '0.01'})
+    )
+    price_percent = forms.DecimalField(
+        required=False, max_digits=5, decimal_places=2, min_value=Decimal('-99.99'), max_value=Decimal('1000'),
+        label='Or change price by %', widget=forms.NumberInput(attrs={'class': 'form-control', 'step': '0.01'})
+    )
+    discount_percentage = forms.DecimalField(
+        required=False, max_digits=5, decimal_places=2, min_value=0, max_value=100, label='Set discount %',
+        widget=forms.NumberInput(attrs={'class': 'form-control', 'step': '0.01'})
+    )
+    stock = forms.IntegerField(
+        required=False, min_value=0, label='Set stock to', widget=forms.NumberInput(attrs={'class': 'form-control'})
+    )
+    stock_change = forms.IntegerField(
+        required=False, label='Or add to stock', widget=forms.NumberInput(attrs={'class': 'form-control'})
+    )
+    set_available = flag_field(CHANGE_FLAG_CHOICES, 'Available')
+    set_featured = flag_field(CHANGE_FLAG_CHOICES, 'Featured')
+    set_is_premium = flag_field(CHANGE_FLAG_CHOICES, 'Premium')
+    set_has_free_shipping = flag_field(CHANGE_FLAG_CHOICES, 'Free shipping')
+    set_limited_edition = flag_field(CHANGE_FLAG_CHOICES, 'Limited edition')
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if cleaned_data.get('price') is not None and cleaned_data.get('price_percent') is not None:
+            raise forms.ValidationError("Set a new price or a percentage change, not both.")
+        if cleaned_data.get('stock') is not None and cleaned_data.get('stock_change') is not None:
+            raise forms.ValidationError("Set the stock or add to it, not both.")
+        return cleaned_data
+
+    def get_filters(self):
+        """Keyword arguments for bulk_edit.filter_products()"""
+        filters = {
+            'category': self.cleaned_data.get('category'),
+            'search': self.cleaned_data.get('search', ''),
+        }
+        for flag in FLAGS:
+            filters[flag] = self.cleaned_data.get(f'filter_{flag}')
+        return filters
+
+    def get_changes(self):
+        """Keyword arguments for bulk_edit.build_updates()"""
+        changes = {
+            name: self.cleaned_data.get(name)
+            for name in ['price', 'price_percent', 'discount_percentage', 'stock', 'stock_change']
+        }
+        for flag in FLAGS:
+            changes[flag] = self.cleaned_data.get(f'set_{flag}')
+        return changes
@@ -0,0 +1,91 @@
+"""
+Product history retention.
+
+Admin edits and bulk edits record one ProductHistory diff per product
+edit. compact_history() bounds how much of that is kept: diffs newer than
+keep_days stay as they are, older entries of each product are collapsed
+into one snapshot per period (day, week or month) holding the product as
+it was at the start of the period, and entries older than drop_days are
+deleted. The compact_product_history command runs it.
+"""
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Product, ProductHistory
+
+
+PERIODS = ['day', 'week', 'month']
+
+
+def period_start(moment, period):
+    """Local date of the start of the day, week (Monday) or month containing moment"""
+    day = timezone.localdate(moment)
+    if period == 'week':
+        return day - timedelta(days=day.weekday())
+    if period == 'month':
+        return day.replace(day=1)
+    return day
+
+
+def _compact_product(product, entries, cutoff, period):
+    """
+    Collapse a product's entries (newest first) older than cutoff into one
+    snapshot per period. Returns the number of entries removed.
+    """
+    state = ProductHistory.current_values(product)
+    groups = {}
+    for entry in entries:
+        # After applying an entry, state is the product before its edit
+        state = {**state, **entry.product_data}
+        if entry.created_at < cutoff:
+            group = groups.setdefault(period_start(entry.created_at, period), [])
+            # Entries come newest first, so the last one seen is the oldest
+            group.append((entry, state))
+
+    removed, snapshots = [], []
+    for group in groups.values():
+        oldest, oldest_state = group[-1]
+        if len(group) == 1 and oldest.kind == ProductHistory.SNAPSHOT:
+            continue
+        removed.extend(entry.id for entry, _ in group)
+        snapshots.append(ProductHistory.build(
+            product.id, oldest_state, kind=ProductHistory.SNAPSHOT, created_at=oldest.created_at
+        ))
+
+    if removed:
+        with transaction.atomic():
+            ProductHistory.objects.filter(id__in=removed).delete()
+            ProductHistory.objects.bulk_create(snapshots)
+    return len(removed) - len(snapshots)
+
+
+def compact_history(keep_days=90, period='month', drop_days=None, chunk_size=500):
+    """
+    Compact the history of every product with entries older than keep_days
+    and delete entries older than drop_days (kept forever if None). Returns
+    (entries removed by compaction, entries dropped).
+    """
+    if period not in PERIODS:
+        raise ValueError(f'Unknown period: {period}')
+    now = timezone.now()
+
+    dropped = 0
+    if drop_days is not None:
+        dropped, _ = ProductHistory.objects.filter(created_at__lt=now - timedelta(days=drop_days)).delete()
+
+    cutoff = now - timedelta(days=keep_days)
+    product_ids = list(
+        ProductHistory.objects.filter(created_at__lt=cutoff).order_by('product_id')
+        .values_list('product_id', flat=True).distinct()
+    )
+    removed = 0
+    for start in range(0, len(product_ids), chunk_size):
+        chunk = product_ids[start:start + chunk_size]
+        entries = {}
+        for entry in ProductHistory.objects.filter(product_id__in=chunk).order_by('-created_at', '-id'):
+            entries.setdefault(entry.product_id, []).append(entry)
+        for product in Product.objects.filter(id__in=chunk).select_related('category'):
+            removed += _compact_product(product, entries.get(product.id, []), cutoff, period)
+    return removed, dropped
@@ -0,0 +1,60 @@
+"""
+Idempotent checkout submissions.
+
+The checkout form carries a random key, generated when the form is
+rendered. Placing the order stores the key in the order's transaction, as
+its first statement. A repeated submission finds the key's order and is
+sent to it. A concurrent one blocks on the key's unique index until the
+first request commits, then fails to insert and is sent to the same
+order, before anything else is written twice. One that finds the cart
+already cleared by the first looks for the key's order again instead of
+reporting an empty cart.
+
+Keys are kept for CHECKOUT_KEY_TTL_HOURS (24 by default); the
+purge_checkout_keys task deletes older ones.
+"""
+import re
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import CheckoutKey
+
+KEY_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+
+def new_key():
+    return uuid.uuid4().hex
+
+
+def valid_key(key):
+    return bool(key) and bool(KEY_PATTERN.match(key))
+
+
+def key_ttl():
+    return timedelta(hours=getattr(settings, 'CHECKOUT_KEY_TTL_HOURS', 24))
+
+
+def placed_order_id(user, key):
+    """Id of the order a previous submission of key placed, or None"""
+    return CheckoutKey.objects.filter(user=user, key=key).values_list('order_id', flat=True).first()
+
+
+def claim_key(user, key):
+    """
+    Store key for a new order; call first in the order's transaction.
+    Raises IntegrityError if another submission stored it first.
+    """
+    return CheckoutKey.objects.create(user=user, key=key, expires_at=timezone.now() + key_ttl())
+
+
+def attach_order(claim, order):
+    CheckoutKey.objects.filter(pk=claim.pk).update(order=order)
+
+
+def purge_expired_keys():
+    """Delete expired checkout keys; returns the number deleted"""
+    deleted, _ = CheckoutKey.objects.filter(expires_at__lte=timezone.now()).delete()
+    return deleted
@@ -0,0 +1,150 @@
+"""
+Stock reservations.
+
+Starting checkout reserves the cart's quantities for
+STOCK_RESERVATION_MINUTES (15 by default). A product's available stock is
+its stock minus the quantities of unexpired reservations, summed by one
+subquery, so an expired reservation stops counting the moment it expires;
+the release_expired_reservations task only deletes the rows.
+
+Reserving locks the cart's product rows (SELECT ... FOR UPDATE, in id
+order so two carts can't deadlock) and checks their available stock in
+the same query. Shoppers racing for the last units of a hot product queue
+on that one row for a single short transaction, and only those whose
+quantities fit get a reservation. Placing the order checks again,
+decrements stock and deletes the reservations in the order's transaction.
+Cancelling an order, by the customer or by staff, puts its items back;
+reopening a cancelled one takes them out again if they are still there.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Product, StockReservation
+
+
+class OutOfStock(Exception):
+    """Some cart quantities exceed the available stock"""
+
+    def __init__(self, shortages):
+        # {product: available quantity}
+        self.shortages = shortages
+        super().__init__(', '.join(f'{product.name} ({available} left)' for product, available in shortages.items()))
+
+
+def reservation_minutes():
+    return getattr(settings, 'STOCK_RESERVATION_MINUTES', 15)
+
+
+def reserved_quantity(exclude_user=None):
+    """Subquery summing the unexpired reservations of the outer product, other than exclude_user's"""
+    reservations = StockReservation.objects.filter(product=OuterRef('pk'), expires_at__gt=timezone.now())
+    if exclude_user is not None:
+        reservations = reservations.exclude(user=exclude_user)
+    total = reservations.order_by().values('product').annotate(total=Sum('quantity')).values('total')
+    return Coalesce(Subquery(total, output_field=IntegerField()), Value(0))
+
+
+def with_available_stock(queryset, exclude_user=None):
+    """Annotate products with available_stock: stock minus active reservations (other than exclude_user's)"""
+    return queryset.annotate(available_stock=F('stock') - reserved_quantity(exclude_user))
+
+
+def in_stock(queryset):
+    """Products with stock that isn't all reserved"""
+    return queryset.filter(stock__gt=0).alias(unreserved=F('stock') - reserved_quantity()).filter(unreserved__gt=0)
+
+
+def get_available_stock(product_ids, user=None):
+    """{product id: available stock} for the user's point of view, their own reservations count as available"""
+    products = with_available_stock(Product.objects.filter(id__in=product_ids), exclude_user=user)
+    return dict(products.values_list('id', 'available_stock'))
+
+
+def _lock_available(user, quantities):
+    """Lock the products of {product id: quantity} and raise OutOfStock if any quantity exceeds their available stock"""
+    products = list(
+        with_available_stock(Product.objects.filter(id__in=quantities), exclude_user=user)
+        .select_for_update(of=('self',)).order_by('id')
+    )
+    shortages = {
+        product: max(product.available_stock, 0)
+        for product in products if quantities[product.id] > product.available_stock
+    }
+    if shortages:
+        raise OutOfStock(shortages)
+    return products
+
+
+def reserve_stock(user, quantities):
+    """
+    Replace the user's reservations with {product id: quantity}, holding
+    them for reservation_minutes(). Raises OutOfStock, reserving nothing,
+    if any quantity exceeds the product's available stock.
+    """
+    with transaction.atomic():
+        products = _lock_available(user, quantities)
+        expires_at = timezone.now() + timedelta(minutes=reservation_minutes())
+        StockReservation.objects.filter(user=user).delete()
+        StockReservation.objects.bulk_create([
+            StockReservation(product=product, user=user, quantity=quantities[product.id], expires_at=expires_at)
+            for product in products
+        ])
+    return expires_at
+
+
+def commit_stock(user, quantities):
+    """
+    Take {product id: quantity} out of stock for an order and drop the
+    user's reservations; call inside the order's transaction.
+    Raises OutOfStock if the quantities are no longer available.
+    """
+    with transaction.atomic():
+        _lock_available(user, quantities)
+        adjust_stock(quantities, -1)
+        StockReservation.objects.filter(user=user).delete()
+
+
+def adjust_stock(quantities, sign):
+    """Add (sign=1) or remove (sign=-1) {product id: quantity} to stock in one UPDATE"""
+    if not quantities:
+        return
+    Product.objects.filter(id__in=quantities).update(stock=F('stock') + sign * Case(
+        *[When(id=product_id, then=Value(quantity)) for product_id, quantity in quantities.items()],
+        output_field=IntegerField(),
+    ))
+
+
+def order_quantities(order):
+    """{product id: quantity} of an order's items"""
+    return dict(order.items.values('product_id').annotate(total=Sum('quantity')).values_list('product_id', 'total'))
+
+
+def restock_status_change(order, old_status):
+    """
+    Put a newly cancelled order's items back in stock, or take a reopened
+    order's items out again. Raises OutOfStock, changing nothing, if a
+    reopened order's quantities are no longer available.
+    """
+    cancelled, was_cancelled = order.status == 'cancelled', old_status == 'cancelled'
+    if cancelled == was_cancelled:
+        return
+    quantities = order_quantities(order)
+    with transaction.atomic():
+        if was_cancelled:
+            _lock_available(None, quantities)
+        adjust_stock(quantities, 1 if cancelled else -1)
+
+
+def release_reservations(user):
+    StockReservation.objects.filter(user=user).delete()
+
+
+def release_expired_reservations():
+    """Delete expired reservations; returns the number deleted"""
+    deleted, _ = StockReservation.objects.filter(expires_at__lte=timezone.now()).delete()
+    return deleted
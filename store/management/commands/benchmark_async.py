@@ -0,0 +1,46 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from store.benchmarks.asgi import MODES, run_async_benchmark
+from store.benchmarks.load import save_results
+
+
+class Command(BaseCommand):
+    help = 'Compare the synchronous storefront views under WSGI with their async versions under ASGI'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Requests per client and mode')
+        parser.add_argument('--concurrency', type=int, default=1, help='Number of concurrent clients')
+        parser.add_argument('--mode', action='append', dest='modes', choices=MODES, help='Mode to run, repeatable (default: both)')
+        parser.add_argument('--seed', type=int, default=42, help='Random seed for the requested pages')
+        parser.add_argument('--output', help='Results file, defaults to benchmark_results/async-<timestamp>.json')
+
+    def handle(self, *args, **options):
+        try:
+            results = run_async_benchmark(
+                requests=options['requests'],
+                concurrency=options['concurrency'],
+                modes=options['modes'],
+                seed=options['seed'],
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        output = options['output']
+        if not output:
+            directory = os.path.join(settings.BASE_DIR, 'benchmark_results')
+            os.makedirs(directory, exist_ok=True)
+            output = os.path.join(directory, f"async-{timezone.now():%Y%m%d-%H%M%S}.json")
+        save_results(results, output)
+
+        self.stdout.write(
+            f"{'mode':<8}{'requests':>9}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'req/s':>10}"
+        )
+        for mode, summary in results['modes'].items():
+            self.stdout.write(
+                f"{mode:<8}{summary['requests']:>9}{summary['errors']:>8}{summary['p50_ms']:>10}"
+                f"{summary['p95_ms']:>10}{summary['p99_ms']:>10}{summary['throughput_rps']:>10}"
+            )
+        self.stdout.write(self.style.SUCCESS(f'Results saved to {output}'))
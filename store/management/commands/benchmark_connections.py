@@ -0,0 +1,50 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from store.benchmarks.connections import run_connection_benchmark
+from store.benchmarks.load import save_results
+
+
+class Command(BaseCommand):
+    help = 'Compare storefront request latency with per-request, persistent and pooled database connections'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Requests per reader thread and mode')
+        parser.add_argument('--concurrency', type=int, default=1, help='Number of concurrent reader threads')
+        parser.add_argument('--writers', type=int, default=0, help='Threads updating products during the run')
+        parser.add_argument('--mode', action='append', dest='modes', help='Mode to run, repeatable (default: all supported)')
+        parser.add_argument('--seed', type=int, default=42, help='Random seed for the requested pages')
+        parser.add_argument('--output', help='Results file, defaults to benchmark_results/connections-<timestamp>.json')
+
+    def handle(self, *args, **options):
+        try:
+            results = run_connection_benchmark(
+                requests=options['requests'],
+                concurrency=options['concurrency'],
+                writers=options['writers'],
+                modes=options['modes'],
+                seed=options['seed'],
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        output = options['output']
+        if not output:
+            directory = os.path.join(settings.BASE_DIR, 'benchmark_results')
+            os.makedirs(directory, exist_ok=True)
+            output = os.path.join(directory, f"connections-{timezone.now():%Y%m%d-%H%M%S}.json")
+        save_results(results, output)
+
+        self.stdout.write(
+            f"{'mode':<16}{'requests':>9}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+            f"{'req/s':>10}{'conns':>7}{'writes':>8}{'w.errors':>9}"
+        )
+        for mode, summary in results['modes'].items():
+            self.stdout.write(
+                f"{mode:<16}{summary['requests']:>9}{summary['errors']:>8}{summary['p50_ms']:>10}"
+                f"{summary['p95_ms']:>10}{summary['p99_ms']:>10}{summary['throughput_rps']:>10}"
+                f"{summary['connections_opened']:>7}{summary['writes']:>8}{summary['write_errors']:>9}"
+            )
+        self.stdout.write(self.style.SUCCESS(f'Results saved to {output}'))
@@ -0,0 +1,44 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from store.benchmarks.export import run_export
+from store.benchmarks.load import save_results
+from store.exports import EXPORTS, FORMATS
+
+
+class Command(BaseCommand):
+    help = 'Measure export throughput, queries and memory on the current data'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', nargs='?', choices=sorted(EXPORTS), default='orders', help='What to export')
+        parser.add_argument('--format', choices=sorted(FORMATS), default='csv', help='Export format')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Rows fetched from the database at a time')
+        parser.add_argument('--no-memory', action='store_true', help="Don't trace memory, which slows the export down")
+        parser.add_argument('--output', help='Results file, defaults to benchmark_results/export-<timestamp>.json')
+
+    def handle(self, *args, **options):
+        results = run_export(
+            kind=options['kind'],
+            fmt=options['format'],
+            chunk_size=options['chunk_size'],
+            trace_memory=not options['no_memory'],
+        )
+
+        output = options['output']
+        if not output:
+            directory = os.path.join(settings.BASE_DIR, 'benchmark_results')
+            os.makedirs(directory, exist_ok=True)
+            output = os.path.join(directory, f"export-{timezone.now():%Y%m%d-%H%M%S}.json")
+        save_results(results, output)
+
+        self.stdout.write(
+            f"Exported {results['rows']} {results['kind']} ({results['megabytes']} MB) in {results['duration_s']}s: "
+            f"{results['rows_per_s']} rows/s, {results['queries']} queries"
+        )
+        if results['peak_memory_mb'] is not None:
+            self.stdout.write(f"Peak memory: {results['peak_memory_mb']} MB")
+            for rows, current in results['memory_samples_mb']:
+                self.stdout.write(f'  after {rows:>9} rows: {current} MB')
+        self.stdout.write(self.style.SUCCESS(f'Results saved to {output}'))
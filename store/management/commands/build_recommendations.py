@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from store.recommendations import collect_baskets, build_cooccurrence, top_k_neighbours, store_neighbours
+
+
+class Command(BaseCommand):
+    help = 'Build the "frequently bought together" table from order history'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top-k', type=int, default=8, help='Number of neighbours to keep per product')
+        parser.add_argument('--min-support', type=float, default=1.0, help='Minimum weighted co-occurrence for a pair to count')
+        parser.add_argument('--include-wishlists', action='store_true', help='Also count products saved in the same wishlist')
+        parser.add_argument('--include-views', action='store_true', help='Also count products viewed by the same user')
+
+    def handle(self, *args, **options):
+        baskets = collect_baskets(
+            include_wishlists=options['include_wishlists'],
+            include_views=options['include_views'],
+        )
+        pairs, occurrences = build_cooccurrence(baskets)
+        self.stdout.write(f'Counted co-occurrences for {len(pairs)} products')
+
+        neighbours = top_k_neighbours(pairs, occurrences, k=options['top_k'], min_support=options['min_support'])
+        written = store_neighbours(neighbours, 'bought_together')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Stored {written} recommendations for {len(neighbours)} products'
+        ))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from store.recommendations import refresh_similar_products
+
+
+class Command(BaseCommand):
+    help = 'Build content-based "similar products" from product names, descriptions and categories'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top-k', type=int, default=8, help='Number of neighbours to keep per product')
+        parser.add_argument('--full', action='store_true', help='Recompute every product instead of only those changed since the last run')
+
+    def handle(self, *args, **options):
+        updated = refresh_similar_products(k=options['top_k'], full=options['full'])
+        self.stdout.write(self.style.SUCCESS(f'Updated similar products for {updated} products'))
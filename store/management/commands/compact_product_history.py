@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+from store.history import PERIODS, compact_history
+
+
+class Command(BaseCommand):
+    help = 'Collapse old product history diffs into periodic snapshots and drop expired history'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keep-days', type=int, default=90, help='Keep every edit made in this many days')
+        parser.add_argument('--period', choices=PERIODS, default='month', help='Keep one snapshot per period before that')
+        parser.add_argument('--drop-days', type=int, help='Delete history older than this many days (default: never)')
+
+    def handle(self, *args, **options):
+        keep_days, drop_days = options['keep_days'], options['drop_days']
+        if keep_days < 0:
+            raise CommandError('--keep-days must not be negative')
+        if drop_days is not None and drop_days < keep_days:
+            raise CommandError('--drop-days must not be less than --keep-days')
+
+        removed, dropped = compact_history(keep_days, options['period'], drop_days)
+        self.stdout.write(self.style.SUCCESS(
+            f'Compacted away {removed} history entries and dropped {dropped} expired ones'
+        ))
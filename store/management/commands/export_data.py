@@ -0,0 +1,51 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from store.exports import EXPORTS, FORMATS, export_lines
+from store.models import Order
+
+
+class Command(BaseCommand):
+    help = 'Stream orders or products to a CSV or JSON Lines file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(EXPORTS), help='What to export')
+        parser.add_argument('--format', choices=sorted(FORMATS), default='csv', help='Output format')
+        parser.add_argument('--output', help='Output file, defaults to standard output')
+        parser.add_argument('--start', help='First creation date to export (YYYY-MM-DD)')
+        parser.add_argument('--end', help='Last creation date to export (YYYY-MM-DD)')
+        parser.add_argument('--status', choices=[status for status, label in Order.STATUS_CHOICES], help='Only orders with this status')
+        parser.add_argument('--category', type=int, help='Only products of this category id')
+        parser.add_argument('--available', choices=['yes', 'no'], help='Only available or unavailable products')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Rows fetched from the database at a time')
+
+    def parse_date(self, value):
+        if value is None:
+            return None
+        try:
+            return date.fromisoformat(value)
+        except ValueError:
+            raise CommandError(f'Invalid date: {value}')
+
+    def handle(self, *args, **options):
+        kind = options['kind']
+        filters = {'start': self.parse_date(options['start']), 'end': self.parse_date(options['end'])}
+        if kind == 'orders':
+            filters['status'] = options['status']
+        else:
+            filters['category'] = options['category']
+            filters['available'] = {'yes': True, 'no': False}.get(options['available'])
+
+        lines = export_lines(kind, options['format'], chunk_size=options['chunk_size'], **filters)
+        rows = -1 if options['format'] == 'csv' else 0  # Don't count the CSV header
+        output = open(options['output'], 'w', newline='') if options['output'] else self.stdout
+        try:
+            for line in lines:
+                output.write(line)
+                rows += 1
+        finally:
+            if options['output']:
+                output.close()
+
+        if options['output']:
+            self.stdout.write(self.style.SUCCESS(f'Exported {rows} {kind} to {options["output"]}'))
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+from store.benchmarks.data import CatalogGenerator, clear_benchmark_data
+
+
+class Command(BaseCommand):
+    help = 'Generate a synthetic catalog with users, orders and reviews for benchmarks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=10000, help='Number of products')
+        parser.add_argument('--categories', type=int, default=50, help='Number of categories')
+        parser.add_argument('--users', type=int, default=1000, help='Number of customers')
+        parser.add_argument('--orders', type=int, default=20000, help='Number of orders')
+        parser.add_argument('--reviews', type=int, default=50000, help='Number of reviews')
+        parser.add_argument('--days', type=int, default=365, help='Spread orders and products over this many days')
+        parser.add_argument('--seed', type=int, default=42, help='Random seed, the same seed generates the same data')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows per bulk insert')
+        parser.add_argument('--clear', action='store_true', help='Delete previously generated benchmark data first')
+
+    def handle(self, *args, **options):
+        if options['clear']:
+            deleted = clear_benchmark_data()
+            self.stdout.write(f'Deleted {deleted} benchmark rows')
+
+        generator = CatalogGenerator(
+            seed=options['seed'],
+            batch_size=options['batch_size'],
+            days=options['days'],
+            log=self.stdout.write if options['verbosity'] > 1 else None,
+        )
+        counts = generator.generate(
+            products=options['products'],
+            categories=options['categories'],
+            users=options['users'],
+            orders=options['orders'],
+            reviews=options['reviews'],
+        )
+        summary = ', '.join(f'{count} {name}' for name, count in counts.items())
+        self.stdout.write(self.style.SUCCESS(f'Generated {summary}'))
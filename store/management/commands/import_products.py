@@ -6,6 +6,7 @@ import os
 from django.core.management.base import BaseCommand
 from django.db import transaction, IntegrityError, DatabaseError
 from store.models import Category, Product
+from store.signals import deferred_category_counts
 from django.utils.text import slugify
 from decimal import Decimal, InvalidOperation
 from urllib.parse import quote
@@ -42,10 +43,12 @@ class Command(BaseCommand):
             if created:
                 self.stdout.write(self.style.SUCCESS('Created default category: Products'))
 
-        if source == 'csv':
-            self.import_from_csv(csv_file, limit, category)
-        else:
-            self.import_from_api(limit, category_name, category)
+        # Category product counts are refreshed once at the end rather than per product
+        with deferred_category_counts():
+            if source == 'csv':
+                self.import_from_csv(csv_file, limit, category)
+            else:
+                self.import_from_api(limit, category_name, category)
 
     def import_from_csv(self, csv_file, limit, default_category):
         """Import products from a CSV file"""
@@ -122,9 +125,10 @@ class Command(BaseCommand):
                             # Create a unique external_id
                             external_id = f"{row.get('website', '')}-{row.get('brand', '')}-{name}"[:100]
 
-                            # Create or update the product
+                            # Create or update the product, looked up through the unique (external_id, data_source) index
                             product, created = Product.objects.update_or_create(
                                 external_id=external_id,
+                                data_source=row.get('website', 'CSV Import'),
                                 defaults={
                                     'name': name,
                                     'description': description or 'No description available',
@@ -132,7 +136,6 @@ class Command(BaseCommand):
                                     'category': category,
                                     'stock': stock,
                                     'available': True,
-                                    'data_source': row.get('website', 'CSV Import'),
                                 }
                             )
 
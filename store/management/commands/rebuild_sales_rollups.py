@@ -0,0 +1,28 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from store.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = 'Recompute the daily sales rollups shown on the admin dashboard from the orders'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', help='First date to rebuild (YYYY-MM-DD), defaults to the first order')
+        parser.add_argument('--end', help='Last date to rebuild (YYYY-MM-DD), defaults to the last order')
+
+    def parse_date(self, value):
+        if value is None:
+            return None
+        try:
+            return date.fromisoformat(value)
+        except ValueError:
+            raise CommandError(f'Invalid date: {value}')
+
+    def handle(self, *args, **options):
+        start, end = self.parse_date(options['start']), self.parse_date(options['end'])
+        if start and end and start > end:
+            raise CommandError('--start must not be after --end')
+
+        days = rebuild_rollups(start, end)
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt sales rollups for {days} days'))
@@ -0,0 +1,55 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from store.benchmarks.load import run_load, save_results, load_results, compare_results
+
+
+class Command(BaseCommand):
+    help = 'Replay the shopping load scenario and report latency percentiles, throughput and queries per request'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20, help='Recorded journeys per virtual shopper')
+        parser.add_argument('--warmup', type=int, default=2, help='Unrecorded journeys per shopper before measuring')
+        parser.add_argument('--concurrency', type=int, default=1, help='Number of concurrent virtual shoppers')
+        parser.add_argument('--seed', type=int, default=42, help='Random seed for the scenario choices')
+        parser.add_argument('--url', help='Base URL of a running server, defaults to the in-process test client')
+        parser.add_argument('--output', help='Results file, defaults to benchmark_results/<timestamp>.json')
+        parser.add_argument('--compare', help='Previous results file to compare against')
+
+    def handle(self, *args, **options):
+        try:
+            results = run_load(
+                iterations=options['iterations'],
+                concurrency=options['concurrency'],
+                warmup=options['warmup'],
+                seed=options['seed'],
+                base_url=options['url'],
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        output = options['output']
+        if not output:
+            directory = os.path.join(settings.BASE_DIR, 'benchmark_results')
+            os.makedirs(directory, exist_ok=True)
+            output = os.path.join(directory, f"{timezone.now():%Y%m%d-%H%M%S}.json")
+        save_results(results, output)
+
+        self.stdout.write(f"{'step':<18}{'requests':>9}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'queries':>9}")
+        for step, summary in list(results['steps'].items()) + [('overall', results['overall'])]:
+            self.stdout.write(
+                f"{step:<18}{summary['requests']:>9}{summary['errors']:>8}{summary['p50_ms']:>10}"
+                f"{summary['p95_ms']:>10}{summary['p99_ms']:>10}{str(summary['queries_mean']):>9}"
+            )
+        self.stdout.write(f"Throughput: {results['overall']['throughput_rps']} requests/s")
+        self.stdout.write(f"Orders placed: {results['orders_placed']}")
+
+        if options['compare']:
+            self.stdout.write(f"\nCompared with {options['compare']}:")
+            for step, metric, old, new, change in compare_results(load_results(options['compare']), results):
+                change = f'{change:+.1f}%' if change is not None else 'n/a'
+                self.stdout.write(f'{step:<18}{metric:<14}{str(old):>10} -> {str(new):<10}{change:>9}')
+
+        self.stdout.write(self.style.SUCCESS(f'Results saved to {output}'))
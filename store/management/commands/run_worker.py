@@ -0,0 +1,30 @@
+import signal
+
+from django.core.management.base import BaseCommand
+from store.task_queue import Worker
+
+
+class Command(BaseCommand):
+    help = 'Run background tasks from the task queue on a thread pool'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=4, help='Tasks run at the same time')
+        parser.add_argument('--batch-size', type=int, help='Tasks claimed at a time, defaults to --threads')
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds to wait when no task is due')
+        parser.add_argument('--lease', type=int, default=300, help='Seconds before an unfinished task is given to another worker')
+        parser.add_argument('--once', action='store_true', help='Exit once no task is due')
+
+    def handle(self, *args, **options):
+        worker = Worker(
+            threads=options['threads'],
+            batch_size=options['batch_size'],
+            poll_interval=options['poll_interval'],
+            lease=options['lease'],
+        )
+        # Finish the running batch on SIGTERM or Ctrl+C, then exit
+        signal.signal(signal.SIGTERM, lambda signum, frame: worker.stop())
+        signal.signal(signal.SIGINT, lambda signum, frame: worker.stop())
+
+        self.stdout.write(f'Worker {worker.worker_id} started with {worker.threads} threads')
+        worker.run(once=options['once'])
+        self.stdout.write(self.style.SUCCESS(f'Worker {worker.worker_id} stopped'))
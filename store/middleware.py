@@ -0,0 +1,96 @@
+"""
+Request instrumentation.
+
+QueryInstrumentationMiddleware counts the SQL queries a request runs and
+their total database time through connection.execute_wrapper(), so it
+works with DEBUG off. The numbers are logged as one JSON line per request,
+together with the statements that ran more than once, which is what an
+N+1 query in a template looks like. With DEBUG on, or for staff, they are
+also sent back in a Server-Timing header (visible in the browser's network
+panel); other visitors don't get to see the site's database timings.
+"""
+import json
+import logging
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+
+logger = logging.getLogger(__name__)
+
+# Number of duplicated statements reported per request
+TOP_DUPLICATES = 3
+
+
+class QueryRecorder:
+    """execute_wrapper() hook that records every statement and its duration"""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+            self.statements[sql] += 1
+
+    def duplicates(self, limit=TOP_DUPLICATES):
+        """The most repeated statements as (sql, count), parameters excluded"""
+        return [(sql, count) for sql, count in self.statements.most_common(limit) if count > 1]
+
+
+class QueryInstrumentationMiddleware:
+    """
+    Record query count, database time and duplicated SQL for each request.
+
+    Requests running more than QUERY_BUDGET_WARNING queries are logged as
+    warnings, the others at DEBUG level. QUERY_INSTRUMENTATION turns it on,
+    by default only with DEBUG.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = getattr(settings, 'QUERY_INSTRUMENTATION', settings.DEBUG)
+        self.warning_threshold = getattr(settings, 'QUERY_BUDGET_WARNING', 50)
+
+    def __call__(self, request):
+        if not self.enabled:
+            return self.get_response(request)
+
+        recorder = QueryRecorder()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(recorder))
+            response = self.get_response(request)
+        total = time.perf_counter() - start
+
+        user = getattr(request, 'user', None)
+        if settings.DEBUG or (user is not None and user.is_staff):
+            response['Server-Timing'] = ', '.join([
+                f'db;dur={recorder.duration * 1000:.1f};desc="{recorder.count} queries"',
+                f'app;dur={(total - recorder.duration) * 1000:.1f}',
+            ])
+        self.log(request, response, recorder, total)
+        return response
+
+    def log(self, request, response, recorder, total):
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'queries': recorder.count,
+            'db_ms': round(recorder.duration * 1000, 1),
+            'total_ms': round(total * 1000, 1),
+            'duplicates': [{'sql': sql, 'count': count} for sql, count in recorder.duplicates()],
+        }
+        level = logging.WARNING if recorder.count > self.warning_threshold else logging.DEBUG
+        logger.log(level, json.dumps(record))
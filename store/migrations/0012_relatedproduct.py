@@ -0,0 +1,30 @@
+# Generated by Django 5.2 on 2026-10-19 18:06
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0011_order_country_order_notes_order_payment_method_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RelatedProduct',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(choices=[('bought_together', 'Frequently Bought Together')], default='bought_together', max_length=20)),
+                ('score', models.FloatField(default=0)),
+                ('rank', models.PositiveSmallIntegerField(default=0)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recommendations', to='store.product')),
+                ('related', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recommended_for', to='store.product')),
+            ],
+            options={
+                'ordering': ['product', 'source', 'rank'],
+                'indexes': [models.Index(fields=['product', 'source', 'rank'], name='store_relprod_lookup_idx')],
+                'unique_together': {('product', 'source', 'related')},
+            },
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2 on 2026-10-19 18:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0012_relatedproduct'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecommendationBuild',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(choices=[('bought_together', 'Frequently Bought Together'), ('similar', 'Similar Products')], max_length=20)),
+                ('started_at', models.DateTimeField()),
+                ('finished_at', models.DateTimeField(auto_now_add=True)),
+                ('full_rebuild', models.BooleanField(default=False)),
+                ('products_updated', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['-started_at'],
+            },
+        ),
+        migrations.AlterField(
+            model_name='relatedproduct',
+            name='source',
+            field=models.CharField(choices=[('bought_together', 'Frequently Bought Together'), ('similar', 'Similar Products')], default='bought_together', max_length=20),
+        ),
+    ]
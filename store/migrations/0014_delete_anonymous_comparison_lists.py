@@ -0,0 +1,20 @@
+# Generated by Django 5.2 on 2026-10-19 18:20
+
+from django.db import migrations
+
+
+def delete_anonymous_comparison_lists(apps, schema_editor):
+    """Anonymous comparison lists now live in a cookie, the session-based rows are unreachable"""
+    ComparisonList = apps.get_model('store', 'ComparisonList')
+    ComparisonList.objects.filter(user__isnull=True).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0013_recommendationbuild_alter_relatedproduct_source'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_anonymous_comparison_lists, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2 on 2026-10-19 18:12
+
+from django.db import migrations
+from django.db.models import Count
+
+
+def merge_duplicate_cart_items(apps, schema_editor):
+    """Fold duplicate (cart, product) lines into one before adding the constraint"""
+    CartItem = apps.get_model('store', 'CartItem')
+    duplicates = CartItem.objects.values('cart_id', 'product_id').annotate(lines=Count('id')).filter(lines__gt=1)
+    for duplicate in duplicates:
+        items = list(CartItem.objects.filter(cart_id=duplicate['cart_id'], product_id=duplicate['product_id']).order_by('id'))
+        keep = items[0]
+        keep.quantity = sum(item.quantity for item in items)
+        keep.save(update_fields=['quantity'])
+        CartItem.objects.filter(id__in=[item.id for item in items[1:]]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0014_delete_anonymous_comparison_lists'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_cart_items, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='cartitem',
+            unique_together={('cart', 'product')},
+        ),
+    ]
@@ -0,0 +1,78 @@
+# Generated by Django 5.2 on 2026-10-19 18:22
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def clear_duplicate_external_ids(apps, schema_editor):
+    """
+    Keep external_id on the oldest product of each (external_id, data_source)
+    pair so the unique constraint can be added; later imports update that row.
+    """
+    Product = apps.get_model('store', 'Product')
+    duplicates = (
+        Product.objects.filter(external_id__isnull=False)
+        .values('external_id', 'data_source')
+        .annotate(count=Count('id'))
+        .filter(count__gt=1)
+    )
+    for duplicate in duplicates:
+        ids = list(
+            Product.objects.filter(external_id=duplicate['external_id'], data_source=duplicate['data_source'])
+            .order_by('id')
+            .values_list('id', flat=True)
+        )
+        Product.objects.filter(id__in=ids[1:]).update(external_id=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0016_product_effective_price'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='product',
+            name='store_product_avail_price_idx',
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['-created_at'], name='store_order_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['status', '-created_at'], name='store_order_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', '-created_at'], name='store_order_user_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('available', True)), fields=['name'], name='store_product_avail_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('available', True)), fields=['effective_price'], name='store_product_avail_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('available', True)), fields=['-created_at'], name='store_product_avail_new_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('available', True), ('featured', True)), fields=['-created_at'], name='store_product_avail_feat_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recentlyviewedproduct',
+            index=models.Index(fields=['user', '-viewed_at'], name='store_recview_user_idx'),
+        ),
+        migrations.RunPython(clear_duplicate_external_ids, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='product',
+            constraint=models.UniqueConstraint(fields=('external_id', 'data_source'), name='store_product_external_id_uniq'),
+        ),
+    ]
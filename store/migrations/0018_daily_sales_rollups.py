@@ -0,0 +1,59 @@
+# Generated by Django 5.2 on 2026-10-19 18:33
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0017_catalog_and_order_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailySales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(unique=True)),
+                ('orders', models.IntegerField(default=0)),
+                ('revenue_cents', models.BigIntegerField(default=0)),
+                ('items', models.IntegerField(default=0)),
+            ],
+            options={
+                'verbose_name_plural': 'Daily sales',
+                'ordering': ['date'],
+            },
+        ),
+        migrations.CreateModel(
+            name='DailyStatusSales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('shipped', 'Shipped'), ('delivered', 'Delivered'), ('cancelled', 'Cancelled')], max_length=20)),
+                ('orders', models.IntegerField(default=0)),
+                ('revenue_cents', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name_plural': 'Daily status sales',
+                'ordering': ['date', 'status'],
+                'unique_together': {('date', 'status')},
+            },
+        ),
+        migrations.CreateModel(
+            name='DailyCategorySales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('category_name', models.CharField(blank=True, max_length=100)),
+                ('revenue_cents', models.BigIntegerField(default=0)),
+                ('items', models.IntegerField(default=0)),
+                ('category', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='daily_sales', to='store.category')),
+            ],
+            options={
+                'verbose_name_plural': 'Daily category sales',
+                'ordering': ['date', 'category'],
+                'unique_together': {('date', 'category')},
+            },
+        ),
+    ]
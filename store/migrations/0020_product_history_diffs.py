@@ -0,0 +1,96 @@
+# Generated by Django 5.2 on 2026-10-19 19:05
+
+import json
+import zlib
+
+import django.utils.timezone
+from django.db import migrations, models
+
+# Frozen copies of ProductHistory.TRACKED_FIELDS, COMPRESS_MIN_BYTES and
+# encode() as they were when this migration was written
+TRACKED_FIELDS = [
+    'name', 'description', 'price', 'category_id', 'image', 'stock', 'available', 'featured',
+    'is_premium', 'discount_percentage', 'has_free_shipping', 'limited_edition',
+]
+COMPRESS_MIN_BYTES = 256
+
+
+def encode(values):
+    data = json.dumps(values, separators=(',', ':')).encode()
+    if len(data) >= COMPRESS_MIN_BYTES:
+        packed = zlib.compress(data)
+        if len(packed) < len(data):
+            return packed, True
+    return data, False
+
+
+def convert_to_snapshots(apps, schema_editor):
+    """Earlier entries hold the whole product as JSON text; keep them as snapshots"""
+    ProductHistory = apps.get_model('store', 'ProductHistory')
+    fields = TRACKED_FIELDS + ['category_name']
+    batch, broken = [], []
+    for entry in ProductHistory.objects.only('id', 'legacy_data').iterator(chunk_size=2000):
+        try:
+            values = json.loads(entry.legacy_data)
+        except ValueError:
+            broken.append(entry.id)
+            continue
+        entry.data, entry.compressed = encode(
+            {field: values[field] for field in fields if field in values}
+        )
+        entry.kind = 'snapshot'
+        batch.append(entry)
+        if len(batch) >= 2000:
+            ProductHistory.objects.bulk_update(batch, ['data', 'compressed', 'kind'])
+            batch = []
+    ProductHistory.objects.bulk_update(batch, ['data', 'compressed', 'kind'])
+    ProductHistory.objects.filter(id__in=broken).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0019_category_product_count'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='producthistory',
+            options={'ordering': ['-created_at', '-id'], 'verbose_name_plural': 'Product histories'},
+        ),
+        migrations.RenameField(
+            model_name='producthistory',
+            old_name='data',
+            new_name='legacy_data',
+        ),
+        migrations.AddField(
+            model_name='producthistory',
+            name='data',
+            field=models.BinaryField(default=b''),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='producthistory',
+            name='compressed',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='producthistory',
+            name='kind',
+            field=models.CharField(choices=[('diff', 'Diff'), ('snapshot', 'Snapshot')], default='diff', max_length=10),
+        ),
+        migrations.AlterField(
+            model_name='producthistory',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.RunPython(convert_to_snapshots, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='producthistory',
+            name='legacy_data',
+        ),
+        migrations.AddIndex(
+            model_name='producthistory',
+            index=models.Index(fields=['product', '-created_at'], name='store_prodhist_product_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2 on 2026-10-19 19:43
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0023_checkout_keys'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='coupon',
+            name='max_uses_per_user',
+            field=models.PositiveIntegerField(default=0, help_text='0 means unlimited'),
+        ),
+        migrations.AddIndex(
+            model_name='coupon',
+            index=models.Index(django.db.models.functions.text.Upper('code'), name='store_coupon_code_upper_idx'),
+        ),
+    ]
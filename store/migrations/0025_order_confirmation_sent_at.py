@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-19 20:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0024_coupon_code_index_and_user_limit'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='confirmation_sent_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -1,17 +1,24 @@
 from django.db import models
+from django.db.models.functions import Coalesce, Upper
 from django.contrib.auth.models import User
 from django.utils import timezone
 from django.urls import reverse
 from django.core.validators import MinValueValidator, MaxValueValidator
 import json
+import zlib
 from django.conf import settings
-from decimal import Decimal
+from decimal import Decimal, ROUND_HALF_UP
 import os
 
+from .pricing import effective_price
+
 
 class Category(models.Model):
     name = models.CharField(max_length=100)
     description = models.TextField(blank=True)
+    # Number of available products, kept up to date by signals in store.signals
+    # so the storefront can show counts without counting products
+    product_count = models.PositiveIntegerField(default=0, editable=False)
 
     class Meta:
         verbose_name_plural = 'Categories'
@@ -19,6 +26,17 @@ class Category(models.Model):
     def __str__(self):
         return self.name
 
+    @classmethod
+    def refresh_product_counts(cls, category_ids=None):
+        """Recount the available products of the given categories (all if None) in one UPDATE"""
+        counts = Product.objects.filter(
+            category=models.OuterRef('pk'), available=True
+        ).values('category').annotate(count=models.Count('id')).values('count')
+        categories = cls.objects.all()
+        if category_ids is not None:
+            categories = categories.filter(id__in=category_ids)
+        return categories.update(product_count=Coalesce(models.Subquery(counts), 0))
+
 
 class Product(models.Model):
     name = models.CharField(max_length=200)
@@ -42,6 +60,36 @@ class Product(models.Model):
     external_id = models.CharField(max_length=100, blank=True, null=True)
     data_source = models.CharField(max_length=100, blank=True, null=True)
 
+    # Discounted price computed by the database, kept in sync on save() and
+    # queryset update() so listings can sort and filter on what customers pay
+    effective_price = models.GeneratedField(
+        expression=effective_price(),
+        output_field=models.DecimalField(max_digits=10, decimal_places=2),
+        db_persist=True,
+    )
+
+    class Meta:
+        indexes = [
+            # Catalog listings only show available products sorted by name, price
+            # or date. Partial indexes match the bare boolean WHERE Django emits
+            # on sqlite, which a composite (available, ...) index can't serve.
+            models.Index(fields=['name'], condition=models.Q(available=True), name='store_product_avail_name_idx'),
+            models.Index(
+                fields=['effective_price'], condition=models.Q(available=True), name='store_product_avail_price_idx'
+            ),
+            models.Index(fields=['-created_at'], condition=models.Q(available=True), name='store_product_avail_new_idx'),
+            models.Index(
+                fields=['-created_at'], condition=models.Q(available=True, featured=True),
+                name='store_product_avail_feat_idx',
+            ),
+            # "In stock" filter: products with stock left before reservations are subtracted
+            models.Index(fields=['stock'], condition=models.Q(available=True), name='store_product_avail_stock_idx'),
+        ]
+        constraints = [
+            # Imports look products up by their id in the source data
+            models.UniqueConstraint(fields=['external_id', 'data_source'], name='store_product_external_id_uniq'),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -49,20 +97,24 @@ class Product(models.Model):
         return reverse('store:product_detail', args=[self.id])
 
     def get_average_rating(self):
-        """Calculate the average rating for this product"""
+        """Calculate the average rating for this product, using the avg_rating annotation if present"""
+        if hasattr(self, 'avg_rating'):
+            return self.avg_rating or 0
         from django.db.models import Avg
         avg_rating = self.reviews.aggregate(Avg('rating'))['rating__avg']
         return avg_rating or 0
         
     def get_review_count(self):
-        """Get the number of reviews for this product"""
+        """Get the number of reviews for this product, using the review_count annotation if present"""
+        if hasattr(self, 'review_count'):
+            return self.review_count
         return self.reviews.count()
         
     def get_discounted_price(self):
-        """Calculate the discounted price"""
+        """Calculate the discounted price, rounded half up to the cent"""
         if self.discount_percentage > 0:
             discount_amount = (self.price * self.discount_percentage) / 100
-            return self.price - discount_amount
+            return (self.price - discount_amount).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
         return self.price
         
     def get_exclusive_features(self):
@@ -78,17 +130,35 @@ class Product(models.Model):
             features.append('discount')
         return features
         
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember what the category product counts were computed from
+        if 'category_id' in instance.__dict__ and 'available' in instance.__dict__:
+            instance._loaded_counted = (instance.category_id, instance.available)
+        return instance
+
+    def sync_image_path(self):
+        """
+        Copy image into the legacy image_path column. Returns True if it
+        changed; callers of bulk_create() or bulk_update() should call it on
+        each product and include image_path in the fields they write.
+        """
+        if self.image and self.image_path != self.image.name:
+            self.image_path = self.image.name
+            return True
+        return False
+
     def save(self, *args, **kwargs):
-        """Save product and update image_path for backwards compatibility"""
+        """Save product, updating image_path for backwards compatibility in the same write"""
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or 'image' in update_fields:
+            if self.image:
+                # Store a new upload now so image.name is its final storage name
+                self._meta.get_field('image').pre_save(self, self._state.adding)
+            if self.sync_image_path() and update_fields is not None:
+                kwargs['update_fields'] = [*update_fields, 'image_path']
         super().save(*args, **kwargs)
-        
-        if self.image:
-                
-
-                    
-            self.image_path = self.image.name
-            # Save without triggering the save method again
-            Product.objects.filter(pk=self.pk).update(image_path=self.image.name)
 
 
 class ProductImage(models.Model):
@@ -141,13 +211,28 @@ class Order(models.Model):
     discount_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     subtotal_price = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     total_price = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    # Set when the confirmation email is sent, so a repeated task doesn't send it again
+    confirmation_sent_at = models.DateTimeField(null=True, blank=True, editable=False)
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['-created_at'], name='store_order_created_idx'),
+            models.Index(fields=['status', '-created_at'], name='store_order_status_idx'),
+            models.Index(fields=['user', '-created_at'], name='store_order_user_idx'),
+        ]
 
     def __str__(self):
         return f'Order {self.id}'
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored status so status changes can update the sales rollups
+        if 'status' in instance.__dict__:
+            instance._loaded_status = instance.status
+        return instance
+
     def get_subtotal(self):
         """Calculate the order subtotal (before discount)"""
         return sum(item.get_cost() for item in self.items.all())
@@ -253,50 +338,132 @@ class CartItem(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(default=1)
 
+    class Meta:
+        # One line per product, so merges and adds can upsert on (cart, product)
+        unique_together = ('cart', 'product')
+
     def __str__(self):
         return f'{self.product.name} - {self.quantity}'
 
     def get_price(self):
-        return self.product.price * self.quantity
+        return self.product.get_discounted_price() * self.quantity
 
 
 class ProductHistory(models.Model):
-    """Model to store product history before edits"""
+    """
+    Values of a product's fields before an edit. A diff holds only the fields
+    the edit changed; a snapshot, written when old diffs are compacted, holds
+    them all. Walking a product's entries from newest to oldest and applying
+    each one to its current values gives its earlier versions.
+    """
+    DIFF = 'diff'
+    SNAPSHOT = 'snapshot'
+    KIND_CHOICES = [
+        (DIFF, 'Diff'),
+        (SNAPSHOT, 'Snapshot'),
+    ]
+
+    # Product fields recorded in history
+    TRACKED_FIELDS = [
+        'name', 'description', 'price', 'category_id', 'image', 'stock', 'available', 'featured',
+        'is_premium', 'discount_percentage', 'has_free_shipping', 'limited_edition',
+    ]
+    # Encoded data longer than this is stored zlib-compressed
+    COMPRESS_MIN_BYTES = 256
+
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='history')
-    data = models.TextField()  # JSON serialized product data
-    created_at = models.DateTimeField(auto_now_add=True)
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES, default=DIFF)
+    data = models.BinaryField()  # JSON field values, zlib-compressed when compressed is set
+    compressed = models.BooleanField(default=False)
+    # Not auto_now_add, so compaction can date snapshots at the edits they replace
+    created_at = models.DateTimeField(default=timezone.now)
 
     class Meta:
-        ordering = ['-created_at']
+        ordering = ['-created_at', '-id']
         verbose_name_plural = 'Product histories'
+        indexes = [
+            models.Index(fields=['product', '-created_at'], name='store_prodhist_product_idx'),
+        ]
 
     def __str__(self):
         return f'History for {self.product.name} at {self.created_at}'
 
+    @staticmethod
+    def json_value(value):
+        """A field value as stored in history"""
+        if isinstance(value, Decimal):
+            return str(value)
+        if isinstance(value, models.fields.files.FieldFile):
+            return value.name or None
+        return value
+
+    @classmethod
+    def encode(cls, values):
+        """(data, compressed) for a dict of field values"""
+        data = json.dumps(values, separators=(',', ':')).encode()
+        if len(data) >= cls.COMPRESS_MIN_BYTES:
+            packed = zlib.compress(data)
+            if len(packed) < len(data):
+                return packed, True
+        return data, False
+
+    @classmethod
+    def build(cls, product_id, values, kind=DIFF, created_at=None):
+        """Unsaved entry holding values, for bulk_create()"""
+        data, compressed = cls.encode(values)
+        entry = cls(product_id=product_id, kind=kind, data=data, compressed=compressed)
+        if created_at:
+            entry.created_at = created_at
+        return entry
+
     @property
     def product_data(self):
-        """Return the deserialized product data"""
-        return json.loads(self.data)
+        """Return the deserialized field values"""
+        data = bytes(self.data)
+        if self.compressed:
+            data = zlib.decompress(data)
+        return json.loads(data)
+
+    @classmethod
+    def current_values(cls, product):
+        """A product's tracked field values, with its category name"""
+        values = {field: cls.json_value(getattr(product, field)) for field in cls.TRACKED_FIELDS}
+        values['category_name'] = product.category.name if product.category_id else None
+        return values
+
+    @classmethod
+    def record_changes(cls, product, old_values):
+        """
+        Record the values old_values held before an edit of product, keeping
+        only those that differ from the product's current ones. Returns the
+        entry, or None when nothing changed.
+        """
+        changes = {}
+        for field, old in old_values.items():
+            if old != getattr(product, field):
+                changes[field] = cls.json_value(old)
+        if not changes:
+            return None
+        if 'category_id' in changes:
+            category = Category.objects.filter(pk=changes['category_id']).first()
+            changes['category_name'] = category.name if category else None
+        entry = cls.build(product.pk, changes)
+        entry.save()
+        return entry
 
     @classmethod
-    def create_from_product(cls, product):
-        """Create a history record from a product instance"""
-        product_data = {
-            'name': product.name,
-            'description': product.description,
-            'price': str(product.price),  # Convert Decimal to string for JSON
-            'category_id': product.category_id,
-            'category_name': product.category.name if product.category else None,
-            'image': product.image,
-            'stock': product.stock,
-            'available': product.available,
-            'created_at': product.created_at.isoformat(),
-            'updated_at': product.updated_at.isoformat(),
-        }
-        return cls.objects.create(
-            product=product,
-            data=json.dumps(product_data)
-        )
+    def record_form_changes(cls, form):
+        """Record the fields a product ModelForm changed, from its initial values"""
+        old_values = {}
+        for name in form.changed_data:
+            field = 'category_id' if name == 'category' else name
+            if field in cls.TRACKED_FIELDS:
+                old_values[field] = form.initial.get(name)
+        return cls.record_changes(form.instance, old_values)
+
+    def previous_version(self):
+        """The product as it was before this entry's edit, if this is its newest entry"""
+        return {**self.current_values(self.product), **self.product_data}
 
 
 class Review(models.Model):
@@ -358,6 +525,9 @@ class RecentlyViewedProduct(models.Model):
         ordering = ['-viewed_at']
         # Ensure a product is only in the recently viewed list once per user
         unique_together = ('user', 'product')
+        indexes = [
+            models.Index(fields=['user', '-viewed_at'], name='store_recview_user_idx'),
+        ]
 
     def __str__(self):
         return f'{self.product.name} viewed by {self.user.username}'
@@ -392,7 +562,7 @@ class RecentlyViewedProduct(models.Model):
     def get_recently_viewed(cls, user, limit=5):
         """Get the user's recently viewed products"""
         if user.is_authenticated:
-            return cls.objects.filter(user=user).order_by('-viewed_at')[:limit]
+            return cls.objects.filter(user=user).select_related('product__category').order_by('-viewed_at')[:limit]
         return []
 
 
@@ -410,12 +580,17 @@ class Coupon(models.Model):
     discount_value = models.DecimalField(max_digits=5, decimal_places=2)
     active = models.BooleanField(default=True)
     max_uses = models.PositiveIntegerField(default=0, help_text="0 means unlimited")
+    max_uses_per_user = models.PositiveIntegerField(default=0, help_text="0 means unlimited")
     current_uses = models.PositiveIntegerField(default=0)
     min_order_value = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Codes are looked up case-insensitively, see store.coupons
+            models.Index(Upper('code'), name='store_coupon_code_upper_idx'),
+        ]
 
     def __str__(self):
         return f'{self.code} - {self.discount_value}{"%" if self.discount_type == "percentage" else ""}'
@@ -493,4 +668,171 @@ class ComparisonItem(models.Model):
         ordering = ['-added_at']
 
     def __str__(self):
-        return f'{self.product.name} in comparison list'
\ No newline at end of file
+        return f'{self.product.name} in comparison list'
+
+
+class RelatedProduct(models.Model):
+    """Precomputed product neighbours, rebuilt offline by the build_recommendations command"""
+    SOURCE_CHOICES = (
+        ('bought_together', 'Frequently Bought Together'),
+        ('similar', 'Similar Products'),
+    )
+
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='recommendations')
+    related = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='recommended_for')
+    source = models.CharField(max_length=20, choices=SOURCE_CHOICES, default='bought_together')
+    score = models.FloatField(default=0)
+    rank = models.PositiveSmallIntegerField(default=0)
+
+    class Meta:
+        ordering = ['product', 'source', 'rank']
+        unique_together = ('product', 'source', 'related')
+        indexes = [
+            # Detail pages read one product's neighbours in rank order
+            models.Index(fields=['product', 'source', 'rank'], name='store_relprod_lookup_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.related.name} for {self.product.name} ({self.source})'
+
+
+class RecommendationBuild(models.Model):
+    """Log of recommendation builds, used to refresh only what changed since the last run"""
+    source = models.CharField(max_length=20, choices=RelatedProduct.SOURCE_CHOICES)
+    started_at = models.DateTimeField()
+    finished_at = models.DateTimeField(auto_now_add=True)
+    full_rebuild = models.BooleanField(default=False)
+    products_updated = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ['-started_at']
+
+    def __str__(self):
+        return f'{self.source} build at {self.started_at}'
+
+
+class DailySales(models.Model):
+    """Orders, revenue and items sold per day, maintained by store.rollups"""
+    date = models.DateField(unique=True)
+    orders = models.IntegerField(default=0)
+    revenue_cents = models.BigIntegerField(default=0)
+    items = models.IntegerField(default=0)
+
+    class Meta:
+        ordering = ['date']
+        verbose_name_plural = 'Daily sales'
+
+    def __str__(self):
+        return f'Sales on {self.date}'
+
+
+class DailyStatusSales(models.Model):
+    """Orders and revenue per day and current order status, maintained by store.rollups"""
+    date = models.DateField()
+    status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES)
+    orders = models.IntegerField(default=0)
+    revenue_cents = models.BigIntegerField(default=0)
+
+    class Meta:
+        ordering = ['date', 'status']
+        unique_together = ('date', 'status')
+        verbose_name_plural = 'Daily status sales'
+
+    def __str__(self):
+        return f'{self.status} orders on {self.date}'
+
+
+class DailyCategorySales(models.Model):
+    """Revenue and items sold per day and category, maintained by store.rollups"""
+    date = models.DateField()
+    category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True, related_name='daily_sales')
+    # Kept so sales of deleted categories still have a label
+    category_name = models.CharField(max_length=100, blank=True)
+    revenue_cents = models.BigIntegerField(default=0)
+    items = models.IntegerField(default=0)
+
+    class Meta:
+        ordering = ['date', 'category']
+        unique_together = ('date', 'category')
+        verbose_name_plural = 'Daily category sales'
+
+    def __str__(self):
+        return f'{self.category_name} sales on {self.date}'
+
+
+class Task(models.Model):
+    """Background task run by the run_worker command, see store.task_queue"""
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    )
+
+    name = models.CharField(max_length=100)
+    kwargs = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    run_at = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    # The worker running the task and the end of its lease; expired leases are claimed again
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['run_at', 'id']
+        indexes = [
+            models.Index(fields=['status', 'run_at'], name='store_task_due_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.name} ({self.status})'
+
+
+class StockReservation(models.Model):
+    """Quantity of a product held for a shopper's checkout until expires_at, see store.inventory"""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='reservations')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='stock_reservations')
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'product'], name='store_reservation_user_product_uniq'),
+        ]
+        indexes = [
+            # Active reservations of a product are summed from the index alone
+            models.Index(fields=['product', 'expires_at', 'quantity'], name='store_reservation_active_idx'),
+            models.Index(fields=['expires_at'], name='store_reservation_expiry_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.quantity} x {self.product} for {self.user} until {self.expires_at}'
+
+
+class CheckoutKey(models.Model):
+    """Idempotency key of a checkout form submission and the order it placed, see store.idempotency"""
+    key = models.CharField(max_length=64)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='checkout_keys')
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='checkout_keys', null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='store_checkoutkey_user_key_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['expires_at'], name='store_checkoutkey_expiry_idx'),
+        ]
+
+    def __str__(self):
+        return f'Checkout {self.key} by {self.user}'
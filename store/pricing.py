@@ -0,0 +1,107 @@
+"""
+Cart pricing engine.
+
+Discounted unit prices and line totals are computed by the database in
+integer cents, so a whole cart is priced in the same query that loads its
+lines and the result matches Product.get_discounted_price() exactly
+(rounded half up to the cent). Totals are returned as a CartSummary that
+cart_detail, order_create, the cart sync endpoint and the navbar share.
+"""
+from dataclasses import dataclass, field, replace
+from decimal import Decimal
+
+from django.db.models import BigIntegerField, DecimalField, ExpressionWrapper, F, Value
+from django.db.models.functions import Cast, Round
+
+
+CENT = Decimal('0.01')
+
+
+def unit_price_cents(prefix=''):
+    """
+    Expression for the discounted unit price of a product in cents.
+
+    Computes round_half_up(price_cents * (10000 - discount_bp) / 10000) with
+    integer arithmetic, where discount_bp is the discount in basis points.
+    prefix is the lookup path to the product, e.g. 'product__'.
+    """
+    price_cents = Cast(Round(F(f'{prefix}price') * 100), BigIntegerField())
+    discount_bp = Cast(Round(F(f'{prefix}discount_percentage') * 100), BigIntegerField())
+    return ExpressionWrapper(
+        (price_cents * (Value(10000) - discount_bp) + Value(5000)) / Value(10000),
+        output_field=BigIntegerField(),
+    )
+
+
+def effective_price():
+    """
+    Expression for the discounted unit price of a product as a decimal.
+    Backs the generated Product.effective_price column.
+    """
+    return ExpressionWrapper(
+        unit_price_cents() * Value(CENT),
+        output_field=DecimalField(max_digits=10, decimal_places=2),
+    )
+
+
+def cents_to_decimal(cents):
+    return (Decimal(cents) / 100).quantize(CENT)
+
+
+@dataclass(frozen=True)
+class CartLine:
+    """One priced cart line"""
+    product: object
+    quantity: int
+    unit_price: Decimal
+    line_total: Decimal
+
+    def get_price(self):
+        return self.line_total
+
+
+@dataclass(frozen=True)
+class CartSummary:
+    """Priced cart: lines, item count, subtotal and the optional coupon discount"""
+    lines: tuple = ()
+    total_items: int = 0
+    subtotal: Decimal = Decimal('0.00')
+    free_shipping: bool = False
+    coupon: object = None
+    discount: Decimal = field(default=Decimal('0.00'))
+
+    @property
+    def total(self):
+        return self.subtotal - self.discount
+
+    @property
+    def is_empty(self):
+        return not self.lines
+
+    def apply_coupon(self, coupon):
+        """Return a copy of the summary with the coupon discount applied"""
+        if coupon is None:
+            return replace(self, coupon=None, discount=Decimal('0.00'))
+        return replace(self, coupon=coupon, discount=coupon.get_discount_amount(self.subtotal))
+
+
+def build_summary(rows):
+    """
+    Build a CartSummary from (product, quantity, unit_cents) rows,
+    where product was loaded by the same query that priced it.
+    """
+    lines = tuple(
+        CartLine(
+            product=product,
+            quantity=quantity,
+            unit_price=cents_to_decimal(unit_cents),
+            line_total=cents_to_decimal(unit_cents * quantity),
+        )
+        for product, quantity, unit_cents in rows
+    )
+    return CartSummary(
+        lines=lines,
+        total_items=sum(line.quantity for line in lines),
+        subtotal=sum((line.line_total for line in lines), Decimal('0.00')),
+        free_shipping=bool(lines) and all(line.product.has_free_shipping for line in lines),
+    )
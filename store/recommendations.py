@@ -0,0 +1,297 @@
+"""
+Offline product recommendations.
+
+Neighbour lists are computed by management commands and stored in the
+RelatedProduct table, so product pages only need a single indexed lookup.
+"""
+import heapq
+import math
+import re
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import (
+    Product, RelatedProduct, RecommendationBuild, OrderItem, WishlistItem, RecentlyViewedProduct
+)
+
+
+# Relative weight of each signal when counting co-occurrences
+ORDER_WEIGHT = 1.0
+WISHLIST_WEIGHT = 0.5
+VIEW_WEIGHT = 0.25
+
+# Baskets larger than this are skipped, they add noise and cost O(n^2) pairs
+MAX_BASKET_SIZE = 50
+
+# Term weights for content similarity
+NAME_WEIGHT = 2
+CATEGORY_WEIGHT = 1
+
+TOKEN_RE = re.compile(r'[a-z0-9]+')
+STOP_WORDS = frozenset([
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'in', 'is', 'it',
+    'of', 'on', 'or', 'the', 'to', 'with', 'your', 'you', 'this', 'that', 'no', 'ml',
+])
+
+
+def _group_baskets(rows):
+    """Group (basket_key, product_id) rows into sets of product ids"""
+    baskets = defaultdict(set)
+    for key, product_id in rows:
+        baskets[key].add(product_id)
+    return baskets.values()
+
+
+def collect_baskets(include_wishlists=False, include_views=False, chunk_size=2000):
+    """
+    Yield (weight, product_ids) baskets from order history and, optionally,
+    wishlists and recently viewed products.
+    """
+    order_rows = OrderItem.objects.values_list('order_id', 'product_id').iterator(chunk_size=chunk_size)
+    for basket in _group_baskets(order_rows):
+        yield ORDER_WEIGHT, basket
+
+    if include_wishlists:
+        wishlist_rows = WishlistItem.objects.values_list('wishlist_id', 'product_id').iterator(chunk_size=chunk_size)
+        for basket in _group_baskets(wishlist_rows):
+            yield WISHLIST_WEIGHT, basket
+
+    if include_views:
+        view_rows = RecentlyViewedProduct.objects.values_list('user_id', 'product_id').iterator(chunk_size=chunk_size)
+        for basket in _group_baskets(view_rows):
+            yield VIEW_WEIGHT, basket
+
+
+def build_cooccurrence(baskets, max_basket_size=MAX_BASKET_SIZE):
+    """
+    Count weighted product co-occurrences.
+
+    Returns a sparse matrix as {product_id: {other_id: weight}} together with
+    the weighted occurrence count of each product.
+    """
+    pairs = defaultdict(lambda: defaultdict(float))
+    occurrences = defaultdict(float)
+
+    for weight, basket in baskets:
+        if len(basket) < 2 or len(basket) > max_basket_size:
+            continue
+        items = sorted(basket)
+        for product_id in items:
+            occurrences[product_id] += weight
+        for i, a in enumerate(items):
+            for b in items[i + 1:]:
+                pairs[a][b] += weight
+                pairs[b][a] += weight
+
+    return pairs, occurrences
+
+
+def top_k_neighbours(pairs, occurrences, k=8, min_support=1.0):
+    """
+    Rank each product's neighbours by cosine-normalised co-occurrence
+    so that best sellers don't dominate every list.
+
+    Returns {product_id: [(other_id, score), ...]} sorted by score.
+    """
+    neighbours = {}
+    for product_id, row in pairs.items():
+        candidates = (
+            (other_id, count / math.sqrt(occurrences[product_id] * occurrences[other_id]))
+            for other_id, count in row.items()
+            if count >= min_support
+        )
+        best = heapq.nlargest(k, candidates, key=lambda item: (item[1], -item[0]))
+        if best:
+            neighbours[product_id] = best
+    return neighbours
+
+
+def store_neighbours(neighbours, source, product_ids=None, batch_size=1000):
+    """
+    Replace the stored neighbours for a source.
+
+    If product_ids is given only those products' rows are replaced,
+    otherwise the whole source is rebuilt. Returns the number of rows written.
+    """
+    rows = [
+        RelatedProduct(product_id=product_id, related_id=other_id, source=source, score=score, rank=rank)
+        for product_id, best in neighbours.items()
+        for rank, (other_id, score) in enumerate(best)
+    ]
+
+    with transaction.atomic():
+        existing = RelatedProduct.objects.filter(source=source)
+        if product_ids is not None:
+            existing = existing.filter(product_id__in=product_ids)
+        existing.delete()
+        RelatedProduct.objects.bulk_create(rows, batch_size=batch_size)
+
+    return len(rows)
+
+
+def tokenize(text):
+    """Split text into lowercase word tokens, dropping stop words and single characters"""
+    return [
+        token for token in TOKEN_RE.findall((text or '').lower())
+        if len(token) > 1 and token not in STOP_WORDS
+    ]
+
+
+def product_terms(name, description, category_name):
+    """Weighted term counts for a product's name, description and category"""
+    terms = Counter()
+    for token in tokenize(name):
+        terms[token] += NAME_WEIGHT
+    for token in tokenize(description):
+        terms[token] += 1
+    for token in tokenize(category_name):
+        terms[token] += CATEGORY_WEIGHT
+    return terms
+
+
+def build_tfidf_vectors(rows, max_df=0.5):
+    """
+    Build L2-normalised TF-IDF vectors from (product_id, name, description, category_name) rows.
+
+    Terms that appear in more than max_df of the products are dropped, they
+    carry little signal and make the inverted index expensive to scan.
+    Returns {product_id: {term: weight}}.
+    """
+    term_counts = {
+        product_id: product_terms(name, description, category_name)
+        for product_id, name, description, category_name in rows
+    }
+
+    document_frequency = Counter()
+    for terms in term_counts.values():
+        document_frequency.update(terms.keys())
+
+    total = len(term_counts)
+    max_documents = max(1, int(max_df * total))
+    idf = {
+        term: math.log((1 + total) / (1 + frequency)) + 1
+        for term, frequency in document_frequency.items()
+        if frequency <= max_documents
+    }
+
+    vectors = {}
+    for product_id, terms in term_counts.items():
+        vector = {
+            term: (1 + math.log(count)) * idf[term]
+            for term, count in terms.items()
+            if term in idf
+        }
+        norm = math.sqrt(sum(weight * weight for weight in vector.values()))
+        vectors[product_id] = {term: weight / norm for term, weight in vector.items()} if norm else {}
+    return vectors
+
+
+def build_inverted_index(vectors):
+    """Map each term to the (product_id, weight) pairs that contain it"""
+    index = defaultdict(list)
+    for product_id, vector in vectors.items():
+        for term, weight in vector.items():
+            index[term].append((product_id, weight))
+    return index
+
+
+def similar_neighbours(vectors, product_ids, k=8, min_score=0.05, index=None):
+    """
+    Compute the top-k cosine neighbours of the given products.
+
+    Dot products are accumulated through the inverted index, so only products
+    sharing at least one term are scored. The scores kept while ranking one
+    product are its candidate set, but vectors and index cover the whole
+    catalog. Returns {product_id: [(other_id, score), ...]}.
+    """
+    if index is None:
+        index = build_inverted_index(vectors)
+
+    neighbours = {}
+    for product_id in product_ids:
+        scores = defaultdict(float)
+        for term, weight in vectors.get(product_id, {}).items():
+            for other_id, other_weight in index[term]:
+                if other_id != product_id:
+                    scores[other_id] += weight * other_weight
+        best = heapq.nlargest(
+            k,
+            ((other_id, score) for other_id, score in scores.items() if score >= min_score),
+            key=lambda item: (item[1], -item[0]),
+        )
+        if best:
+            neighbours[product_id] = [(other_id, round(score, 6)) for other_id, score in best]
+    return neighbours
+
+
+def refresh_similar_products(k=8, full=False, chunk_size=2000):
+    """
+    Recompute content-based "similar products".
+
+    Unless full is set, only products changed since the last build are
+    recomputed, together with the products whose stored lists mention them
+    or that they now rank as neighbours. Returns the number of products updated.
+
+    Even an incremental build holds the vectors and inverted index of the
+    whole catalog in memory, since IDF weights and candidate neighbours
+    come from every product. Only the recomputation is limited to the
+    affected products.
+    """
+    started_at = timezone.now()
+    last_build = RecommendationBuild.objects.filter(source='similar').first()
+    full = full or last_build is None
+
+    rows = Product.objects.values_list('id', 'name', 'description', 'category__name').iterator(chunk_size=chunk_size)
+    vectors = build_tfidf_vectors(rows)
+    index = build_inverted_index(vectors)
+
+    if full:
+        targets = list(vectors)
+        neighbours = similar_neighbours(vectors, targets, k=k, index=index)
+        store_neighbours(neighbours, 'similar')
+    else:
+        changed = set(
+            Product.objects.filter(updated_at__gte=last_build.started_at).values_list('id', flat=True)
+        )
+        neighbours = similar_neighbours(vectors, changed, k=k, index=index)
+
+        affected = set(
+            RelatedProduct.objects.filter(source='similar', related_id__in=changed).values_list('product_id', flat=True)
+        )
+        for best in neighbours.values():
+            affected.update(other_id for other_id, score in best)
+        affected -= changed
+        neighbours.update(similar_neighbours(vectors, affected, k=k, index=index))
+
+        targets = changed | affected
+        store_neighbours(neighbours, 'similar', product_ids=targets)
+
+    RecommendationBuild.objects.create(
+        source='similar',
+        started_at=started_at,
+        full_rebuild=full,
+        products_updated=len(targets),
+    )
+    return len(targets)
+
+
+def get_recommendations(product, sources=('bought_together', 'similar'), limit=4):
+    """Return {source: [products]} with the precomputed neighbours of a product, best first"""
+    recommendations = {source: [] for source in sources}
+    rows = RelatedProduct.objects.filter(
+        product=product,
+        source__in=sources,
+        related__available=True,
+    ).select_related('related__category').order_by('source', 'rank')
+
+    for row in rows:
+        if len(recommendations[row.source]) < limit:
+            recommendations[row.source].append(row.related)
+    return recommendations
+
+
+def get_related_products(product, source='bought_together', limit=4):
+    """Return the precomputed neighbours of a product from one source, best first"""
+    return get_recommendations(product, sources=(source,), limit=limit)[source]
@@ -0,0 +1,206 @@
+"""
+Daily sales rollups.
+
+The admin dashboard and order list read pre-aggregated daily rows instead
+of scanning Order and OrderItem on every page load. Rows are keyed by the
+local date the order was placed and store revenue in integer cents, so
+incremental updates are exact on every database backend.
+
+Checkout records each new order with record_order(), and a post_save
+receiver moves orders between status rows when their status changes.
+Orders created or changed outside those paths (queryset.update(), admin
+additions, imports, deletions) are picked up by rebuild_rollups(), which
+the rebuild_sales_rollups command runs for a date range.
+"""
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import F, Max, Sum
+from django.utils import timezone
+
+from .models import Order, OrderItem, DailySales, DailyStatusSales, DailyCategorySales
+from .pricing import cents_to_decimal
+
+
+def to_cents(amount):
+    return int((Decimal(amount) * 100).to_integral_value())
+
+
+def order_date(order):
+    """Date bucket of an order, in the site's time zone"""
+    return timezone.localdate(order.created_at)
+
+
+def _add(model, key, defaults=None, **increments):
+    """Atomically add increments to the rollup row identified by key, creating it if needed"""
+    model.objects.bulk_create([model(**key, **(defaults or {}))], ignore_conflicts=True)
+    model.objects.filter(**key).update(**{
+        field: F(field) + value for field, value in increments.items()
+    })
+
+
+def _item_totals(items):
+    """Sum (category_id, category_name, price, quantity) rows into {category_id: [name, cents, quantity]}"""
+    totals = {}
+    for category_id, category_name, price, quantity in items:
+        total = totals.setdefault(category_id, [category_name or '', 0, 0])
+        total[1] += to_cents(price * quantity)
+        total[2] += quantity
+    return totals
+
+
+def record_order(order):
+    """Add a new order and its items to the rollups; call once its items are saved"""
+    day = order_date(order)
+    revenue = to_cents(order.total_price)
+    totals = _item_totals(
+        OrderItem.objects.filter(order=order).values_list(
+            'product__category_id', 'product__category__name', 'price', 'quantity'
+        )
+    )
+    with transaction.atomic():
+        _add(DailySales, {'date': day}, orders=1, revenue_cents=revenue,
+             items=sum(quantity for name, cents, quantity in totals.values()))
+        _add(DailyStatusSales, {'date': day, 'status': order.status}, orders=1, revenue_cents=revenue)
+        for category_id, (name, cents, quantity) in totals.items():
+            _add(DailyCategorySales, {'date': day, 'category_id': category_id}, defaults={'category_name': name},
+                 revenue_cents=cents, items=quantity)
+
+
+def record_status_change(order, old_status):
+    """Move an order from its old status row to its current one"""
+    if old_status == order.status:
+        return
+    day = order_date(order)
+    revenue = to_cents(order.total_price)
+    with transaction.atomic():
+        _add(DailyStatusSales, {'date': day, 'status': old_status}, orders=-1, revenue_cents=-revenue)
+        _add(DailyStatusSales, {'date': day, 'status': order.status}, orders=1, revenue_cents=revenue)
+
+
+def day_bounds(start, end):
+    """Aware datetimes covering the local dates start to end inclusive; either may be None"""
+    lower = timezone.make_aware(datetime.combine(start, time.min)) if start else None
+    upper = timezone.make_aware(datetime.combine(end + timedelta(days=1), time.min)) if end else None
+    return lower, upper
+
+
+def _in_range(queryset, field, start, end):
+    if start:
+        queryset = queryset.filter(**{f'{field}__gte': start})
+    if end:
+        queryset = queryset.filter(**{f'{field}__lte': end})
+    return queryset
+
+
+def rebuild_rollups(start=None, end=None, chunk_size=5000):
+    """
+    Recompute the rollups of the dates start to end inclusive (all dates if
+    both are None) from the orders. Returns the number of days written.
+    """
+    lower, upper = day_bounds(start, end)
+    orders = Order.objects.all()
+    items = OrderItem.objects.all()
+    if lower:
+        orders, items = orders.filter(created_at__gte=lower), items.filter(order__created_at__gte=lower)
+    if upper:
+        orders, items = orders.filter(created_at__lt=upper), items.filter(order__created_at__lt=upper)
+
+    daily = defaultdict(lambda: [0, 0, 0])
+    by_status = defaultdict(lambda: [0, 0])
+    for created_at, status, total_price in orders.values_list('created_at', 'status', 'total_price').iterator(chunk_size=chunk_size):
+        day = timezone.localdate(created_at)
+        cents = to_cents(total_price)
+        daily[day][0] += 1
+        daily[day][1] += cents
+        by_status[day, status][0] += 1
+        by_status[day, status][1] += cents
+
+    by_category = defaultdict(list)
+    rows = items.values_list(
+        'order__created_at', 'product__category_id', 'product__category__name', 'price', 'quantity'
+    ).iterator(chunk_size=chunk_size)
+    for created_at, category_id, category_name, price, quantity in rows:
+        by_category[timezone.localdate(created_at)].append((category_id, category_name, price, quantity))
+
+    with transaction.atomic():
+        for model in (DailySales, DailyStatusSales, DailyCategorySales):
+            _in_range(model.objects.all(), 'date', start, end).delete()
+
+        category_rows = []
+        for day, day_items in by_category.items():
+            for category_id, (name, cents, quantity) in _item_totals(day_items).items():
+                category_rows.append(DailyCategorySales(
+                    date=day, category_id=category_id, category_name=name, revenue_cents=cents, items=quantity
+                ))
+                daily[day][2] += quantity
+
+        DailySales.objects.bulk_create([
+            DailySales(date=day, orders=count, revenue_cents=cents, items=quantity)
+            for day, (count, cents, quantity) in daily.items()
+        ], batch_size=chunk_size)
+        DailyStatusSales.objects.bulk_create([
+            DailyStatusSales(date=day, status=status, orders=count, revenue_cents=cents)
+            for (day, status), (count, cents) in by_status.items()
+        ], batch_size=chunk_size)
+        DailyCategorySales.objects.bulk_create(category_rows, batch_size=chunk_size)
+
+    return len(daily)
+
+
+def get_sales_totals(start=None, end=None):
+    """Orders, revenue and items sold between two dates (inclusive, None for unbounded)"""
+    totals = _in_range(DailySales.objects.all(), 'date', start, end).aggregate(
+        orders=Sum('orders'), revenue_cents=Sum('revenue_cents'), items=Sum('items')
+    )
+    return {
+        'orders': totals['orders'] or 0,
+        'revenue': cents_to_decimal(totals['revenue_cents'] or 0),
+        'items': totals['items'] or 0,
+    }
+
+
+def get_status_totals(start=None, end=None):
+    """{status: {'orders': n, 'revenue': Decimal}} for orders placed between two dates"""
+    rows = _in_range(DailyStatusSales.objects.all(), 'date', start, end).values('status').annotate(
+        order_count=Sum('orders'), revenue=Sum('revenue_cents')
+    ).order_by('status')
+    return {
+        row['status']: {'orders': row['order_count'], 'revenue': cents_to_decimal(row['revenue'])}
+        for row in rows
+        if row['order_count']
+    }
+
+
+def get_category_totals(start=None, end=None, limit=None):
+    """[(category name, revenue)] for items sold between two dates, best selling first"""
+    rows = _in_range(DailyCategorySales.objects.all(), 'date', start, end).values('category_id').annotate(
+        current_name=Max('category__name'), stored_name=Max('category_name'), revenue=Sum('revenue_cents')
+    ).order_by('-revenue')
+    if limit:
+        rows = rows[:limit]
+    return [
+        (row['current_name'] or row['stored_name'] or 'Uncategorized', cents_to_decimal(row['revenue']))
+        for row in rows
+    ]
+
+
+def get_daily_series(start, end):
+    """One {'date', 'orders', 'revenue', 'items'} entry per day between two dates, zeros included"""
+    rows = {
+        row.date: row for row in _in_range(DailySales.objects.all(), 'date', start, end)
+    }
+    series = []
+    day = start
+    while day <= end:
+        row = rows.get(day)
+        series.append({
+            'date': day.isoformat(),
+            'orders': row.orders if row else 0,
+            'revenue': cents_to_decimal(row.revenue_cents if row else 0),
+            'items': row.items if row else 0,
+        })
+        day += timedelta(days=1)
+    return series
@@ -0,0 +1,133 @@
+from contextlib import contextmanager
+import threading
+
+from django.contrib.auth.models import User
+from django.contrib.auth.signals import user_logged_in
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .cart import merge_session_cart
+from .comparison import merge_anonymous_comparison
+from .coupons import invalidate_coupon
+from .inventory import restock_status_change
+from .models import Category, Coupon, Product, Order
+from .rollups import record_status_change
+from .user_stats import clear_user_stats
+import logging
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+
+@receiver(user_logged_in)
+def merge_comparison_list(sender, request, user, **kwargs):
+    """
+    Signal to move an anonymous visitor's comparison list into
+    the user's ComparisonList when they log in.
+    """
+    if request is None:
+        return
+    try:
+        merge_anonymous_comparison(request, user)
+    except Exception as e:
+        logger.error(f"Error merging comparison list for user {user.username}: {e}")
+
+
+@receiver(user_logged_in)
+def merge_guest_cart(sender, request, user, **kwargs):
+    """
+    Signal to merge an anonymous shopper's session cart into
+    the user's Cart when they log in.
+    """
+    if request is None:
+        return
+    try:
+        merge_session_cart(request, user)
+    except Exception as e:
+        logger.error(f"Error merging guest cart for user {user.username}: {e}")
+
+
+@receiver(post_save, sender=Order)
+def apply_status_change(sender, instance, created, update_fields=None, **kwargs):
+    """
+    Signal to move an order between the daily status rollups, and its items
+    in or out of stock, when its status changes to or from cancelled. New
+    orders are recorded by checkout once their items exist.
+    """
+    if created or (update_fields is not None and 'status' not in update_fields):
+        instance._loaded_status = instance.status
+        return
+    old_status = getattr(instance, '_loaded_status', None)
+    if old_status is not None and old_status != instance.status:
+        restock_status_change(instance, old_status)
+        record_status_change(instance, old_status)
+    instance._loaded_status = instance.status
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_stats(sender, instance, update_fields=None, **kwargs):
+    """
+    Signal to clear the cached admin user statistics when a user changes.
+    Logins only update last_login, which the statistics don't count.
+    """
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+    clear_user_stats()
+
+
+@receiver(post_save, sender=Coupon)
+@receiver(post_delete, sender=Coupon)
+def invalidate_cached_coupon(sender, instance, **kwargs):
+    """Signal to drop a changed or deleted coupon from the coupon cache"""
+    invalidate_coupon(instance)
+
+
+_deferred_counts = threading.local()
+
+
+@contextmanager
+def deferred_category_counts():
+    """
+    Collect the categories whose product counts need refreshing and recount
+    them once on exit, instead of after every saved product. For imports.
+    """
+    if getattr(_deferred_counts, 'category_ids', None) is not None:
+        yield
+        return
+    _deferred_counts.category_ids = set()
+    try:
+        yield
+    finally:
+        category_ids, _deferred_counts.category_ids = _deferred_counts.category_ids, None
+        if category_ids:
+            Category.refresh_product_counts(category_ids)
+
+
+def refresh_category_counts(category_ids):
+    pending = getattr(_deferred_counts, 'category_ids', None)
+    if pending is not None:
+        pending.update(category_ids)
+    else:
+        Category.refresh_product_counts(category_ids)
+
+
+@receiver(post_save, sender=Product)
+def update_category_counts(sender, instance, created, **kwargs):
+    """
+    Signal to recount the products of the categories a product entered or
+    left, when it is created or its category or availability changes.
+    """
+    counted = (instance.category_id, instance.available)
+    loaded = getattr(instance, '_loaded_counted', None)
+    if created or loaded != counted:
+        category_ids = {instance.category_id}
+        if loaded is not None:
+            category_ids.add(loaded[0])
+        refresh_category_counts(category_ids)
+    instance._loaded_counted = counted
+
+
+@receiver(post_delete, sender=Product)
+def update_category_counts_on_delete(sender, instance, **kwargs):
+    """Signal to recount the products of a deleted product's category"""
+    refresh_category_counts({instance.category_id})
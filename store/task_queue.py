@@ -0,0 +1,177 @@
+"""
+Database-backed background task queue.
+
+Functions decorated with @task are registered by name; enqueue() (or the
+function's .enqueue()) stores a Task row with JSON keyword arguments. Rows
+are inserted in the caller's transaction, so a task enqueued during
+checkout only becomes visible to workers if the order commits.
+
+The run_worker command claims due tasks in batches and runs them on a
+thread pool. Claiming sets a lease (locked_until); a task whose worker
+died is claimed again once its lease expires, so delivery is at least
+once and tasks must be safe to run twice. A task that raises is retried
+with exponential backoff until max_attempts, then marked failed.
+"""
+import logging
+import os
+import socket
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.db import close_old_connections, connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Task
+
+logger = logging.getLogger(__name__)
+
+REGISTRY = {}
+
+
+class TaskFunction:
+    """A registered task; call it to run inline, or enqueue() it for a worker"""
+
+    def __init__(self, func, name, max_attempts, retry_delay):
+        self.func = func
+        self.name = name
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.__doc__ = func.__doc__
+
+    def __call__(self, **kwargs):
+        return self.func(**kwargs)
+
+    def enqueue(self, run_at=None, delay=None, **kwargs):
+        return enqueue(self.name, run_at=run_at, delay=delay, **kwargs)
+
+
+def task(name=None, max_attempts=5, retry_delay=30):
+    """Register a function as a task; retry_delay is the first retry's delay in seconds"""
+    def register(func):
+        task_name = name or f'{func.__module__}.{func.__name__}'
+        REGISTRY[task_name] = TaskFunction(func, task_name, max_attempts, retry_delay)
+        return REGISTRY[task_name]
+    return register
+
+
+def enqueue(name, run_at=None, delay=None, **kwargs):
+    """Store a task to run at run_at, or delay seconds from now, or as soon as possible"""
+    if name not in REGISTRY:
+        raise KeyError(f'Unknown task: {name}')
+    if run_at is None:
+        run_at = timezone.now() + timedelta(seconds=delay or 0)
+    return Task.objects.create(name=name, kwargs=kwargs, run_at=run_at, max_attempts=REGISTRY[name].max_attempts)
+
+
+def _claimable(now):
+    """Pending tasks that are due, and running tasks whose lease has expired"""
+    return Q(status=Task.PENDING, run_at__lte=now) | Q(status=Task.RUNNING, locked_until__lt=now)
+
+
+def claim_tasks(worker_id, limit, lease=300):
+    """Lease up to limit due tasks to worker_id and return them"""
+    now = timezone.now()
+    with transaction.atomic():
+        queryset = Task.objects.filter(_claimable(now))
+        if connections[queryset.db].features.has_select_for_update_skip_locked:
+            queryset = queryset.select_for_update(skip_locked=True)
+        ids = list(queryset.order_by('run_at', 'id').values_list('id', flat=True)[:limit])
+        if not ids:
+            return []
+        # The filter is repeated so a task another worker took in the meantime isn't taken twice
+        Task.objects.filter(_claimable(now), id__in=ids).update(
+            status=Task.RUNNING, locked_by=worker_id, locked_until=now + timedelta(seconds=lease),
+            attempts=F('attempts') + 1,
+        )
+        return list(Task.objects.filter(id__in=ids, status=Task.RUNNING, locked_by=worker_id, locked_until__gt=now))
+
+
+def run_task(task_row):
+    """Run a claimed task and record the outcome; returns True if it succeeded"""
+    registered = REGISTRY.get(task_row.name)
+    try:
+        if registered is None:
+            raise KeyError(f'Unknown task: {task_row.name}')
+        registered(**task_row.kwargs)
+    except Exception:
+        error = traceback.format_exc()
+        now = timezone.now()
+        if task_row.attempts < task_row.max_attempts:
+            retry_delay = registered.retry_delay if registered else 30
+            updates = {'status': Task.PENDING, 'run_at': now + timedelta(seconds=retry_delay * 2 ** (task_row.attempts - 1))}
+            logger.warning(f'Task {task_row.name} #{task_row.id} failed, attempt {task_row.attempts}: {error}')
+        else:
+            updates = {'status': Task.FAILED, 'finished_at': now}
+            logger.error(f'Task {task_row.name} #{task_row.id} failed for good: {error}')
+        _finish(task_row, last_error=error, **updates)
+        return False
+
+    _finish(task_row, status=Task.DONE, finished_at=timezone.now())
+    return True
+
+
+def _finish(task_row, **updates):
+    # Only the worker still holding the lease records the outcome
+    Task.objects.filter(id=task_row.id, locked_by=task_row.locked_by, status=Task.RUNNING).update(
+        locked_by='', locked_until=None, **updates
+    )
+
+
+class Worker:
+    """Claims due tasks and runs them on a thread pool until stopped"""
+
+    def __init__(self, threads=4, batch_size=None, poll_interval=1.0, lease=300):
+        self.threads = threads
+        self.batch_size = batch_size or threads
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.worker_id = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self.stopping = threading.Event()
+
+    def _run_in_thread(self, task_row):
+        close_old_connections()
+        try:
+            return run_task(task_row)
+        finally:
+            connections.close_all()
+
+    def run_batch(self, pool=None):
+        """Claim one batch of due tasks and run it; returns the number of tasks run"""
+        tasks = claim_tasks(self.worker_id, self.batch_size, self.lease)
+        if pool is None:
+            for task_row in tasks:
+                run_task(task_row)
+        else:
+            list(pool.map(self._run_in_thread, tasks))
+        return len(tasks)
+
+    def run_until_empty(self):
+        """Run due tasks in this thread until none are left; returns the number run"""
+        total = 0
+        while count := self.run_batch():
+            total += count
+        return total
+
+    def run(self, once=False):
+        """Run tasks on the thread pool, polling for new ones; with once, stop when none are due"""
+        with ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='task-worker') as pool:
+            while not self.stopping.is_set():
+                if not self.run_batch(pool):
+                    if once:
+                        break
+                    self.stopping.wait(self.poll_interval)
+
+    def stop(self):
+        self.stopping.set()
+
+
+def purge_finished_tasks(keep_days=7):
+    """Delete done and failed tasks that finished more than keep_days ago"""
+    cutoff = timezone.now() - timedelta(days=keep_days)
+    deleted, _ = Task.objects.filter(status__in=[Task.DONE, Task.FAILED], finished_at__lt=cutoff).delete()
+    return deleted
@@ -0,0 +1,68 @@
+"""
+Background tasks, run by the run_worker command.
+
+Delivery is at least once, so every task must be safe to run twice.
+"""
+from django.core.mail import send_mail
+from django.utils import timezone
+
+from .history import compact_history
+from .idempotency import purge_expired_keys
+from .inventory import release_expired_reservations
+from .models import Order, Task
+from .task_queue import purge_finished_tasks, task
+
+
+@task(name='store.send_order_confirmation')
+def send_order_confirmation(order_id):
+    """Email the customer a summary of their order, once"""
+    # Claim the email first, so a second run of this task, on a retry or an
+    # expired lease, finds it taken and doesn't send another
+    if not Order.objects.filter(id=order_id, confirmation_sent_at=None).update(confirmation_sent_at=timezone.now()):
+        return
+    order = Order.objects.get(id=order_id)
+    lines = [
+        f'{item.quantity} x {item.product.name}: {item.price * item.quantity}'
+        for item in order.items.select_related('product')
+    ]
+    if order.discount_amount:
+        lines.append(f'Discount: -{order.discount_amount}')
+    lines.append(f'Total: {order.total_price}')
+    try:
+        send_mail(
+            f'Your IDMAX Cosmetics order #{order.id}',
+            f'Hello {order.first_name},\n\nThank you for your order.\n\n' + '\n'.join(lines),
+            None,
+            [order.email],
+        )
+    except Exception:
+        # Not sent, let the retry claim it again
+        Order.objects.filter(id=order_id).update(confirmation_sent_at=None)
+        raise
+
+
+@task(name='store.compact_product_history', max_attempts=1)
+def compact_product_history(keep_days=90, period='month', drop_days=None):
+    """Run product history compaction, see store.history"""
+    compact_history(keep_days=keep_days, period=period, drop_days=drop_days)
+
+
+@task(name='store.purge_finished_tasks', max_attempts=1)
+def purge_tasks(keep_days=7):
+    """Delete finished tasks older than keep_days"""
+    purge_finished_tasks(keep_days=keep_days)
+
+
+@task(name='store.release_expired_reservations', max_attempts=1)
+def release_reservations(every=None):
+    """Delete expired stock reservations; with every, run again every seconds"""
+    # Schedule the next sweep first, so a failed sweep doesn't end the cycle
+    if every and not Task.objects.filter(name=release_reservations.name, status=Task.PENDING).exists():
+        release_reservations.enqueue(delay=every, every=every)
+    release_expired_reservations()
+
+
+@task(name='store.purge_checkout_keys', max_attempts=1)
+def purge_checkout_keys():
+    """Delete checkout idempotency keys past their TTL"""
+    purge_expired_keys()
@@ -1,4 +1,4 @@
-from django.test import TestCase, Client
+from django.test import TestCase, TransactionTestCase, Client, override_settings
 from django.urls import reverse
 from django.contrib.auth.models import User
 from .models import Category, Product, Order, OrderItem, Cart, CartItem, Wishlist, WishlistItem
@@ -187,19 +187,23 @@ class ViewsTest(TestCase):
         self.assertIn('cart_product_form', response.context)
 
     def test_cart_add_view(self):
-        # Test adding to cart as anonymous user - should redirect to login
-        response = self.client.post(reverse('store:cart_add', args=[self.product.id]))
-        self.assertRedirects(response, f"{reverse('login')}?next={reverse('store:cart_add', args=[self.product.id])}")
+        # Test adding to cart as anonymous user - should go to the guest cart
+        response = self.client.post(reverse('store:cart_add', args=[self.product.id]), {'quantity': 2})
+        self.assertRedirects(response, reverse('store:cart_detail'))
+        self.assertEqual(self.client.session['cart'], {str(self.product.id): 2})
+        self.assertFalse(CartItem.objects.exists())
 
         # Test adding to cart as logged in user - should work
         self.client.login(username='testuser', password='testpass')
         response = self.client.post(reverse('store:cart_add', args=[self.product.id]))
         self.assertRedirects(response, reverse('store:cart_detail'))
 
-    def test_cart_remove_view_requires_login(self):
-        # Test removing from cart as anonymous user - should redirect to login
+    def test_cart_remove_view(self):
+        # Test removing from cart as anonymous user
+        self.client.get(reverse('store:cart_add', args=[self.product.id]))
         response = self.client.post(reverse('store:cart_remove', args=[self.product.id]))
-        self.assertRedirects(response, f"{reverse('login')}?next={reverse('store:cart_remove', args=[self.product.id])}")
+        self.assertRedirects(response, reverse('store:cart_detail'))
+        self.assertEqual(self.client.session['cart'], {})
 
         # Test removing from cart as logged in user - should work
         self.client.login(username='testuser', password='testpass')
@@ -209,10 +213,13 @@ class ViewsTest(TestCase):
         response = self.client.post(reverse('store:cart_remove', args=[self.product.id]))
         self.assertRedirects(response, reverse('store:cart_detail'))
 
-    def test_cart_detail_view_requires_login(self):
-        # Test viewing cart as anonymous user - should redirect to login
+    def test_cart_detail_view(self):
+        # Test viewing cart as anonymous user - should show the guest cart
+        self.client.get(reverse('store:cart_add', args=[self.product.id]))
         response = self.client.get(reverse('store:cart_detail'))
-        self.assertRedirects(response, f"{reverse('login')}?next={reverse('store:cart_detail')}")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['cart_total'], Decimal('10.00'))
+        self.assertEqual(response.context['cart_items_count'], 1)
 
         # Test viewing cart as logged in user - should work
         self.client.login(username='testuser', password='testpass')
@@ -220,6 +227,21 @@ class ViewsTest(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertTemplateUsed(response, 'store/cart_detail.html')
 
+    def test_guest_cart_is_merged_on_login(self):
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, product=self.product, quantity=1)
+        self.client.post(reverse('store:cart_add', args=[self.product.id]), {'quantity': 2})
+
+        self.client.post(reverse('login'), {'username': 'testuser', 'password': 'testpass'})
+
+        self.assertEqual(CartItem.objects.get(cart=cart, product=self.product).quantity, 3)
+        self.assertNotIn('cart', self.client.session)
+
+    def test_checkout_requires_login(self):
+        self.client.get(reverse('store:cart_add', args=[self.product.id]))
+        response = self.client.get(reverse('store:order_create'))
+        self.assertRedirects(response, f"{reverse('login')}?next={reverse('store:order_create')}")
+
     def test_order_list_view_requires_login(self):
         # Test without login
         response = self.client.get(reverse('store:order_list'))
@@ -361,4 +383,2230 @@ class DeleteReviewTestCase(TestCase):
             # Check for error message
             messages = list(get_messages(response.wsgi_request))
             self.assertEqual(len(messages), 1)
-            self.assertEqual(str(messages[0]), "Review not found.")
\ No newline at end of file
+            self.assertEqual(str(messages[0]), "Review not found.")
+
+class RecommendationTest(TestCase):
+    """Tests for the precomputed "frequently bought together" table"""
+
+    def setUp(self):
+        from .models import RelatedProduct
+        self.RelatedProduct = RelatedProduct
+        self.user = User.objects.create_user(username='buyer', password='testpass')
+        self.category = Category.objects.create(name='Skincare')
+        self.other_category = Category.objects.create(name='Fragrance')
+        self.cleanser = Product.objects.create(name='Cleanser', description='Foam', price=Decimal('8.00'), category=self.category)
+        self.toner = Product.objects.create(name='Toner', description='Rose', price=Decimal('9.00'), category=self.category)
+        self.perfume = Product.objects.create(name='Perfume', description='Oud', price=Decimal('40.00'), category=self.other_category)
+        self.lonely = Product.objects.create(name='Serum', description='Vitamin C', price=Decimal('20.00'), category=self.category)
+        for products in ([self.cleanser, self.perfume], [self.cleanser, self.perfume], [self.cleanser, self.toner]):
+            order = Order.objects.create(
+                user=self.user, first_name='A', last_name='B', email='a@example.com',
+                address='Street', postal_code='1', city='City'
+            )
+            for product in products:
+                OrderItem.objects.create(order=order, product=product, price=product.price, quantity=1)
+
+    def test_build_recommendations_ranks_by_cooccurrence(self):
+        from django.core.management import call_command
+        from io import StringIO
+        call_command('build_recommendations', stdout=StringIO())
+
+        neighbours = list(
+            self.RelatedProduct.objects.filter(product=self.cleanser).values_list('related_id', flat=True)
+        )
+        self.assertEqual(neighbours, [self.perfume.id, self.toner.id])
+        self.assertFalse(self.RelatedProduct.objects.filter(product=self.lonely).exists())
+
+    def test_detail_view_uses_recommendations(self):
+        from django.core.management import call_command
+        from io import StringIO
+        call_command('build_recommendations', stdout=StringIO())
+
+        response = self.client.get(reverse('store:product_detail', args=[self.cleanser.id]))
+        self.assertEqual(list(response.context['related_products']), [self.perfume, self.toner])
+
+    def test_detail_view_falls_back_to_category(self):
+        response = self.client.get(reverse('store:product_detail', args=[self.lonely.id]))
+        related = list(response.context['related_products'])
+        self.assertIn(self.cleanser, related)
+        self.assertNotIn(self.perfume, related)
+
+
+class SimilarProductsTest(TestCase):
+    """Tests for content-based similar products"""
+
+    def setUp(self):
+        from .models import RelatedProduct, RecommendationBuild
+        self.RelatedProduct = RelatedProduct
+        self.RecommendationBuild = RecommendationBuild
+        skincare = Category.objects.create(name='Skincare')
+        fragrance = Category.objects.create(name='Fragrance')
+        makeup = Category.objects.create(name='Makeup')
+        self.serum = Product.objects.create(name='Hydrating Serum', description='Hyaluronic acid, glycerin', price=Decimal('20.00'), category=skincare)
+        self.serum_plus = Product.objects.create(name='Hydrating Serum Plus', description='Hyaluronic acid, niacinamide', price=Decimal('25.00'), category=skincare)
+        self.oud = Product.objects.create(name='Oud Perfume', description='Oud wood, amber', price=Decimal('40.00'), category=fragrance)
+        self.musk = Product.objects.create(name='Musk Perfume', description='White musk, amber', price=Decimal('35.00'), category=fragrance)
+        self.lipstick = Product.objects.create(name='Matte Lipstick', description='Red pigment, castor oil', price=Decimal('12.00'), category=makeup)
+        self.gloss = Product.objects.create(name='Lip Gloss', description='Pink pigment, castor oil', price=Decimal('10.00'), category=makeup)
+
+    def neighbours(self, product):
+        return list(
+            self.RelatedProduct.objects.filter(product=product, source='similar').values_list('related_id', flat=True)
+        )
+
+    def test_full_build_finds_similar_descriptions(self):
+        from .recommendations import refresh_similar_products
+        refresh_similar_products(full=True)
+
+        self.assertEqual(self.neighbours(self.serum)[0], self.serum_plus.id)
+        self.assertEqual(self.neighbours(self.oud)[0], self.musk.id)
+        self.assertEqual(self.neighbours(self.gloss)[0], self.lipstick.id)
+        self.assertTrue(self.RecommendationBuild.objects.get().full_rebuild)
+
+    def test_incremental_refresh_only_touches_changed_products(self):
+        from .recommendations import refresh_similar_products
+        refresh_similar_products(full=True)
+
+        self.gloss.description = 'White musk, amber'
+        self.gloss.save()
+        updated = refresh_similar_products()
+
+        self.assertLess(updated, Product.objects.count())
+        self.assertIn(self.musk.id, self.neighbours(self.gloss))
+        self.assertFalse(self.RecommendationBuild.objects.first().full_rebuild)
+
+    def test_detail_view_falls_back_to_similar_products(self):
+        from .recommendations import refresh_similar_products
+        refresh_similar_products(full=True)
+
+        response = self.client.get(reverse('store:product_detail', args=[self.oud.id]))
+        self.assertEqual(response.context['related_products'][0], self.musk)
+
+
+class ComparisonViewTest(TestCase):
+    """Tests for the product comparison page"""
+
+    def setUp(self):
+        from .models import Review
+        self.user = User.objects.create_user(username='shopper', password='testpass')
+        self.reviewer = User.objects.create_user(username='reviewer', password='testpass')
+        self.category = Category.objects.create(name='Skincare')
+        self.products = []
+        for i in range(4):
+            product = Product.objects.create(
+                name=f'Product {i}', description='Description', price=Decimal('10.00'),
+                category=self.category, stock=i
+            )
+            Review.objects.create(product=product, user=self.reviewer, rating=4, title='Good', comment='Nice')
+            self.products.append(product)
+        self.client.login(username='shopper', password='testpass')
+
+    def compare_queries(self, count):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        for product in self.products[:count]:
+            self.client.get(reverse('store:comparison_add', args=[product.id]))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('store:comparison_list'))
+        self.assertEqual(response.status_code, 200)
+        self.client.get(reverse('store:comparison_clear'))
+        return len(queries), response
+
+    def test_comparison_rows(self):
+        _, response = self.compare_queries(2)
+        rows = {row['label']: row['cells'] for row in response.context['comparison_rows']}
+        self.assertEqual([cell['value'] for cell in rows['Category']], ['Skincare', 'Skincare'])
+        self.assertEqual([cell['value'] for cell in rows['Reviews']], [1, 1])
+        self.assertEqual(rows['Rating'][0]['value'], '4.0/5.0')
+        self.assertEqual(rows['Rating'][0]['stars'], ['full'] * 4 + ['empty'])
+        self.assertEqual([cell['value'] for cell in rows['In Stock']], ['Yes', 'No'])
+
+    def test_query_count_does_not_depend_on_product_count(self):
+        one_product_queries, _ = self.compare_queries(1)
+        four_product_queries, _ = self.compare_queries(4)
+        self.assertEqual(one_product_queries, four_product_queries)
+
+
+class AnonymousComparisonTest(TestCase):
+    """Tests for cookie-backed anonymous comparison lists"""
+
+    def setUp(self):
+        from .models import ComparisonList
+        self.ComparisonList = ComparisonList
+        self.user = User.objects.create_user(username='shopper', password='testpass')
+        self.category = Category.objects.create(name='Skincare')
+        self.products = [
+            Product.objects.create(name=f'Product {i}', description='Description', price=Decimal('10.00'), category=self.category)
+            for i in range(6)
+        ]
+
+    def test_anonymous_list_creates_no_rows(self):
+        from django.contrib.sessions.models import Session
+        self.client.get(reverse('store:comparison_add', args=[self.products[0].id]))
+        self.client.get(reverse('store:comparison_add', args=[self.products[1].id]))
+        response = self.client.get(reverse('store:comparison_list'))
+
+        self.assertEqual(response.context['products'], [self.products[1], self.products[0]])
+        self.assertEqual(response.context['comparison_items_count'], 2)
+        self.assertEqual(self.ComparisonList.objects.count(), 0)
+        self.assertEqual(Session.objects.count(), 0)
+
+    def test_anonymous_list_is_bounded(self):
+        from .comparison import MAX_PRODUCTS
+        for product in self.products:
+            self.client.get(reverse('store:comparison_add', args=[product.id]))
+        response = self.client.get(reverse('store:comparison_list'))
+
+        self.assertEqual(len(response.context['products']), MAX_PRODUCTS)
+        self.assertEqual(response.context['products'][0], self.products[-1])
+
+    def test_remove_and_clear(self):
+        self.client.get(reverse('store:comparison_add', args=[self.products[0].id]))
+        self.client.get(reverse('store:comparison_add', args=[self.products[1].id]))
+        self.client.get(reverse('store:comparison_remove', args=[self.products[0].id]))
+        response = self.client.get(reverse('store:comparison_list'))
+        self.assertEqual(response.context['products'], [self.products[1]])
+
+        self.client.get(reverse('store:comparison_clear'))
+        response = self.client.get(reverse('store:comparison_list'))
+        self.assertEqual(response.context['products'], [])
+
+    def test_tampered_cookie_is_ignored(self):
+        self.client.cookies['comparison'] = f'{self.products[0].id}'
+        response = self.client.get(reverse('store:comparison_list'))
+        self.assertEqual(response.context['products'], [])
+
+    def test_list_is_merged_on_login(self):
+        self.client.get(reverse('store:comparison_add', args=[self.products[0].id]))
+        self.client.get(reverse('store:comparison_add', args=[self.products[1].id]))
+        self.client.post(reverse('login'), {'username': 'shopper', 'password': 'testpass'})
+
+        comparison_list = self.ComparisonList.objects.get(user=self.user)
+        self.assertCountEqual(
+            comparison_list.products.values_list('product_id', flat=True),
+            [self.products[0].id, self.products[1].id]
+        )
+        response = self.client.get(reverse('store:comparison_list'))
+        self.assertCountEqual(response.context['products'], [self.products[0], self.products[1]])
+
+
+class CartServiceTest(TestCase):
+    """Tests for batch and atomic cart operations"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='shopper', password='testpass')
+        self.category = Category.objects.create(name='Skincare')
+        self.products = [
+            Product.objects.create(name=f'Product {i}', description='Description', price=Decimal('5.00'), category=self.category)
+            for i in range(5)
+        ]
+        self.cart = Cart.objects.create(user=self.user)
+
+    def quantities(self):
+        return dict(self.cart.items.values_list('product_id', 'quantity'))
+
+    def test_add_quantities_increments_in_place(self):
+        from .cart import add_quantities
+        CartItem.objects.create(cart=self.cart, product=self.products[0], quantity=2)
+
+        add_quantities(self.cart, {self.products[0].id: 1, self.products[1].id: 3})
+        add_quantities(self.cart, {self.products[0].id: 1})
+
+        self.assertEqual(self.quantities(), {self.products[0].id: 4, self.products[1].id: 3})
+
+    def test_set_quantities_upserts_and_removes(self):
+        from .cart import set_quantities
+        CartItem.objects.create(cart=self.cart, product=self.products[0], quantity=2)
+        CartItem.objects.create(cart=self.cart, product=self.products[1], quantity=2)
+
+        set_quantities(self.cart, {self.products[0].id: 5, self.products[1].id: 0, self.products[2].id: 1})
+
+        self.assertEqual(self.quantities(), {self.products[0].id: 5, self.products[2].id: 1})
+
+    def test_add_all_from_wishlist_uses_constant_queries(self):
+        wishlist = Wishlist.objects.create(user=self.user)
+        self.client.login(username='shopper', password='testpass')
+        url = reverse('store:cart_add', args=[self.products[0].id])
+
+        WishlistItem.objects.create(wishlist=wishlist, product=self.products[0])
+        with self.assertNumQueries(8):
+            self.client.post(url, {'add_all_from_wishlist': '1'})
+
+        for product in self.products[1:]:
+            WishlistItem.objects.create(wishlist=wishlist, product=product)
+        with self.assertNumQueries(8):
+            response = self.client.post(url, {'add_all_from_wishlist': '1'})
+
+        self.assertRedirects(response, reverse('store:cart_detail'))
+        expected = {product.id: 1 for product in self.products}
+        expected[self.products[0].id] = 2
+        self.assertEqual(self.quantities(), expected)
+
+    def test_sync_endpoint_sets_quantities(self):
+        import json
+        self.client.login(username='shopper', password='testpass')
+        CartItem.objects.create(cart=self.cart, product=self.products[0], quantity=2)
+        payload = [
+            {'product_id': self.products[0].id, 'qty': 0},
+            {'product_id': self.products[1].id, 'qty': 3},
+            {'product_id': 999999, 'qty': 1},
+        ]
+
+        response = self.client.post(reverse('store:cart_sync'), json.dumps(payload), content_type='application/json')
+
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['rejected'], [999999])
+        self.assertEqual(data['total_items'], 3)
+        self.assertEqual(data['total_price'], '15.00')
+        self.assertEqual(self.quantities(), {self.products[1].id: 3})
+
+    def test_sync_endpoint_works_for_guests(self):
+        import json
+        payload = [{'product_id': self.products[2].id, 'qty': 2}]
+        response = self.client.post(reverse('store:cart_sync'), json.dumps(payload), content_type='application/json')
+
+        self.assertEqual(response.json()['total_items'], 2)
+        self.assertEqual(self.client.session['cart'], {str(self.products[2].id): 2})
+
+    def test_sync_endpoint_rejects_malformed_payload(self):
+        import json
+        for payload in ({'product_id': 1}, [{'product_id': self.products[0].id, 'qty': 'two'}], [{'product_id': self.products[0].id, 'qty': 500}]):
+            response = self.client.post(reverse('store:cart_sync'), json.dumps(payload), content_type='application/json')
+            self.assertEqual(response.status_code, 400)
+        response = self.client.post(reverse('store:cart_sync'), 'not json', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+
+class CartPricingTest(TestCase):
+    """Tests comparing the SQL cart pricing engine with the Python reference"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='shopper', password='testpass')
+        self.category = Category.objects.create(name='Skincare')
+        self.cart = Cart.objects.create(user=self.user)
+        prices = ['9.99', '10.10', '0.05', '1234.56', '19.95', '7.00']
+        discounts = ['0', '15.00', '12.50', '33.33', '50.00', '99.99']
+        for i, (price, discount) in enumerate(zip(prices, discounts)):
+            product = Product.objects.create(
+                name=f'Product {i}', description='Description', category=self.category,
+                price=Decimal(price), discount_percentage=Decimal(discount), has_free_shipping=i % 2 == 0,
+                stock=10
+            )
+            CartItem.objects.create(cart=self.cart, product=product, quantity=i + 1)
+
+    def summary(self):
+        from .cart import DatabaseCart
+        request = type('Request', (), {'user': self.user})()
+        return DatabaseCart(request).get_summary()
+
+    def test_lines_match_python_reference(self):
+        summary = self.summary()
+        for line in summary.lines:
+            item = CartItem.objects.get(cart=self.cart, product=line.product)
+            self.assertEqual(line.unit_price, item.product.get_discounted_price())
+            self.assertEqual(line.line_total, item.get_price())
+
+    def test_totals_match_python_reference(self):
+        summary = self.summary()
+        self.assertEqual(summary.subtotal, self.cart.get_total_price())
+        self.assertEqual(summary.total_items, self.cart.get_total_items())
+        self.assertFalse(summary.free_shipping)
+
+    def test_coupon_is_applied_to_discounted_subtotal(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from .models import Coupon
+        coupon = Coupon.objects.create(
+            code='SAVE10', discount_type='percentage', discount_value=Decimal('10'),
+            valid_from=timezone.now() - timedelta(days=1), valid_to=timezone.now() + timedelta(days=1)
+        )
+        summary = self.summary().apply_coupon(coupon)
+        self.assertEqual(summary.discount, coupon.get_discount_amount(self.cart.get_total_price()))
+        self.assertEqual(summary.total, summary.subtotal - summary.discount)
+
+    def test_cart_detail_prices_cart_once(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        self.client.login(username='shopper', password='testpass')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('store:cart_detail'))
+        cart_queries = [q for q in queries.captured_queries if 'store_cartitem' in q['sql']]
+        self.assertEqual(len(cart_queries), 1)
+        self.assertEqual(response.context['cart_items_count'], self.cart.get_total_items())
+
+    def test_order_uses_discounted_prices(self):
+        expected_total = self.cart.get_total_price()
+        self.client.login(username='shopper', password='testpass')
+        response = self.client.post(reverse('store:order_create'), {
+            'first_name': 'A', 'last_name': 'B', 'email': 'a@example.com', 'address': 'Street',
+            'postal_code': '1', 'city': 'City', 'payment_method': 'credit_card',
+        })
+        order = Order.objects.get(user=self.user)
+        self.assertRedirects(response, reverse('store:order_detail', args=[order.id]))
+        self.assertEqual(order.subtotal_price, expected_total)
+        self.assertEqual(order.get_subtotal(), expected_total)
+        self.assertEqual(order.total_price, expected_total)
+        self.assertFalse(CartItem.objects.filter(cart=self.cart).exists())
+
+
+class EffectivePriceTest(TestCase):
+    """Tests for sorting and filtering products by their discounted price"""
+
+    def setUp(self):
+        self.category = Category.objects.create(name='Makeup')
+        # Raw price order differs from discounted price order
+        self.cheap = Product.objects.create(
+            name='Cheap', description='Description', category=self.category, price=Decimal('20.00')
+        )
+        self.sale = Product.objects.create(
+            name='Sale', description='Description', category=self.category,
+            price=Decimal('30.00'), discount_percentage=Decimal('50.00')
+        )
+        self.odd = Product.objects.create(
+            name='Odd', description='Description', category=self.category,
+            price=Decimal('10.10'), discount_percentage=Decimal('12.50')
+        )
+
+    def listing(self, **params):
+        response = self.client.get(reverse('store:product_list'), params)
+        return [product.name for product in response.context['products']]
+
+    def test_matches_python_reference(self):
+        for product in Product.objects.all():
+            self.assertEqual(product.effective_price, product.get_discounted_price())
+
+    def test_follows_save_and_bulk_update(self):
+        self.cheap.discount_percentage = Decimal('25.00')
+        self.cheap.save()
+        self.cheap.refresh_from_db()
+        self.assertEqual(self.cheap.effective_price, Decimal('15.00'))
+
+        Product.objects.filter(pk=self.sale.pk).update(price=Decimal('40.00'))
+        self.sale.refresh_from_db()
+        self.assertEqual(self.sale.effective_price, Decimal('20.00'))
+
+    def test_sort_by_discounted_price(self):
+        self.assertEqual(self.listing(sort='price_asc'), ['Odd', 'Sale', 'Cheap'])
+        self.assertEqual(self.listing(sort='price_desc'), ['Cheap', 'Sale', 'Odd'])
+
+    def test_filter_by_price_range(self):
+        self.assertEqual(self.listing(min_price='15', sort='price_asc'), ['Sale', 'Cheap'])
+        self.assertEqual(self.listing(max_price='15', sort='price_asc'), ['Odd', 'Sale'])
+        self.assertEqual(self.listing(min_price='8.84', max_price='8.84'), ['Odd'])
+
+    def test_invalid_price_range_is_ignored(self):
+        self.assertEqual(len(self.listing(min_price='abc', max_price='-1')), 3)
+
+
+class QueryPlanMixin:
+    """Assertions on the database's query plan for a queryset"""
+
+    def assertUsesIndex(self, queryset):
+        """Fail if EXPLAIN shows the query falling back to a full table scan"""
+        from django.db import connection, transaction
+        if connection.vendor == 'sqlite':
+            plan = queryset.explain()
+            # "SCAN table" without "USING ... INDEX" reads every row
+            full_scans = [
+                line for line in plan.splitlines()
+                if ' SCAN ' in f' {line} ' and 'INDEX' not in line
+            ]
+        elif connection.vendor == 'postgresql':
+            # Test tables are tiny, make the planner show which index it would use
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+                plan = queryset.explain()
+            full_scans = [line for line in plan.splitlines() if 'Seq Scan' in line]
+        else:
+            self.skipTest(f'No query plan check for {connection.vendor}')
+        self.assertFalse(full_scans, f'Full table scan in query plan:\n{plan}')
+
+    def assertSortsWithIndex(self, queryset):
+        """Fail if the query scans a table or sorts its rows instead of reading them in index order"""
+        from django.db import connection, transaction
+        self.assertUsesIndex(queryset)
+        if connection.vendor == 'sqlite':
+            plan = queryset.explain()
+            sorts = [line for line in plan.splitlines() if 'TEMP B-TREE' in line]
+        else:
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+                plan = queryset.explain()
+            sorts = [line for line in plan.splitlines() if 'Sort' in line and 'Sort Key' not in line]
+        self.assertFalse(sorts, f'Sort step in query plan:\n{plan}')
+
+
+class HotQueryPlanTest(QueryPlanMixin, TestCase):
+    """Tests that the catalog and order hot paths are served by indexes"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='planner', password='testpass')
+
+    def listing_queryset(self, **params):
+        from django.test import RequestFactory
+        from .views import ProductListView
+        view = ProductListView()
+        view.setup(RequestFactory().get(reverse('store:product_list'), params))
+        return view.get_queryset()
+
+    def test_product_list_sorts(self):
+        for sort in ('name', 'price_asc', 'price_desc', 'newest'):
+            with self.subTest(sort=sort):
+                self.assertSortsWithIndex(self.listing_queryset(sort=sort))
+
+    def test_product_list_price_range(self):
+        self.assertUsesIndex(self.listing_queryset(min_price='10', sort='price_asc'))
+
+    def test_home_listings(self):
+        context = self.client.get(reverse('store:home')).context
+        self.assertSortsWithIndex(context['featured_products'])
+        self.assertUsesIndex(context['carousel_products'])
+
+    def test_admin_order_list(self):
+        self.assertUsesIndex(Order.objects.order_by('-created_at')[:20])
+        self.assertUsesIndex(Order.objects.filter(status='pending').order_by('-created_at'))
+
+    def test_user_order_history(self):
+        self.assertUsesIndex(Order.objects.filter(user=self.user).order_by('-created_at'))
+
+    def test_recently_viewed(self):
+        from .models import RecentlyViewedProduct
+        self.assertUsesIndex(RecentlyViewedProduct.objects.filter(user=self.user).order_by('-viewed_at')[:5])
+
+    def test_import_lookup(self):
+        self.assertUsesIndex(Product.objects.filter(external_id='shop-brand-lipstick', data_source='shop'))
+
+
+class ProductImportKeyTest(TestCase):
+    """Tests for the unique external id of imported products"""
+
+    def test_external_id_is_unique_per_source(self):
+        from django.db import IntegrityError, transaction
+        category = Category.objects.create(name='Imported')
+        fields = {'description': 'Description', 'category': category, 'price': Decimal('5.00')}
+        Product.objects.create(name='A', external_id='shop-a', data_source='shop', **fields)
+        Product.objects.create(name='B', external_id='shop-a', data_source='other', **fields)
+        # Hand-made products have no external id
+        Product.objects.create(name='C', **fields)
+        Product.objects.create(name='D', **fields)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Product.objects.create(name='E', external_id='shop-a', data_source='shop', **fields)
+
+
+class QueryBudgetMixin:
+    """Assertions on the number of queries a view runs"""
+
+    def assertQueryBudget(self, url, budget, method='get', data=None):
+        """Request url and fail if it runs more than budget queries, listing repeated statements"""
+        from collections import Counter
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        with CaptureQueriesContext(connection) as context:
+            response = getattr(self.client, method)(url, data or {})
+        if len(context) > budget:
+            repeated = Counter(query['sql'] for query in context.captured_queries).most_common(3)
+            details = '\n'.join(f'{count}x {sql}' for sql, count in repeated if count > 1)
+            self.fail(f'{url} ran {len(context)} queries, budget is {budget}\n{details}')
+        return response
+
+
+class QueryBudgetTest(QueryBudgetMixin, TestCase):
+    """Per-URL query budgets; seeded with several rows of everything so N+1 queries exceed them"""
+
+    ROWS = 5
+
+    def setUp(self):
+        from .models import Review, ComparisonList, ComparisonItem, RecentlyViewedProduct
+        self.user = User.objects.create_user(username='shopper', password='testpass')
+        self.staff = User.objects.create_user(username='staff', password='testpass', is_staff=True)
+        self.categories = [Category.objects.create(name=f'Category {i}') for i in range(self.ROWS)]
+        self.products = []
+        for i in range(self.ROWS * 2):
+            product = Product.objects.create(
+                name=f'Product {i}', description='Description', category=self.categories[i % self.ROWS],
+                price=Decimal('10.00'), stock=5, featured=True
+            )
+            Review.objects.create(product=product, user=self.user, rating=4, title='Title', comment='Comment')
+            self.products.append(product)
+
+        cart = Cart.objects.create(user=self.user)
+        wishlist = Wishlist.objects.create(user=self.user)
+        comparison_list = ComparisonList.objects.create(user=self.user)
+        for product in self.products[:self.ROWS]:
+            CartItem.objects.create(cart=cart, product=product, quantity=1)
+            WishlistItem.objects.create(wishlist=wishlist, product=product)
+            ComparisonItem.objects.create(comparison_list=comparison_list, product=product)
+            RecentlyViewedProduct.objects.create(user=self.user, product=product)
+
+        self.orders = []
+        for i in range(self.ROWS):
+            order = Order.objects.create(
+                user=self.user, first_name='A', last_name='B', email='a@example.com',
+                address='Street', postal_code='1', city='City'
+            )
+            for product in self.products[:self.ROWS]:
+                OrderItem.objects.create(order=order, product=product, price=product.price, quantity=1)
+            self.orders.append(order)
+
+    def check_budgets(self, budgets):
+        from django.core.cache import cache
+        for name, args, budget in budgets:
+            # Budgets cover a cold cache
+            cache.clear()
+            with self.subTest(url=name):
+                response = self.assertQueryBudget(reverse(name, args=args), budget)
+                self.assertEqual(response.status_code, 200)
+
+    def test_public_views(self):
+        product = self.products[0]
+        self.check_budgets([
+            ('store:home', [], 3),
+            ('store:about', [], 0),
+            ('store:contact', [], 0),
+            ('store:product_list', [], 4),
+            ('store:product_detail', [product.id], 6),
+            ('store:cart_detail', [], 0),
+            ('store:comparison_list', [], 0),
+        ])
+
+    def test_customer_views(self):
+        self.client.force_login(self.user)
+        order = self.orders[0]
+        self.check_budgets([
+            ('store:home', [], 10),
+            ('store:product_detail', [self.products[0].id], 17),
+            ('store:cart_detail', [], 7),
+            ('store:wishlist_detail', [], 10),
+            ('store:comparison_list', [], 8),
+            ('store:order_list', [], 7),
+            ('store:order_detail', [order.id], 9),
+            ('store:order_create', [], 11),
+            ('profile', [], 7),
+        ])
+
+    def test_admin_views(self):
+        self.client.force_login(self.staff)
+        order, product, category = self.orders[0], self.products[0], self.categories[0]
+        self.check_budgets([
+            ('store:admin_dashboard', [], 12),
+            ('store:admin_order_list', [], 11),
+            ('store:admin_order_detail', [order.id], 9),
+            ('store:admin_order_update', [order.id], 9),
+            ('store:admin_user_list', [], 8),
+            ('store:admin_product_list', [], 8),
+            ('store:admin_product_create', [], 6),
+            ('store:admin_product_detail', [product.id], 11),
+            ('store:admin_product_update', [product.id], 8),
+            ('store:admin_product_delete', [product.id], 7),
+            ('store:admin_category_list', [], 7),
+            ('store:admin_category_create', [], 5),
+            ('store:admin_category_update', [category.id], 6),
+            ('store:admin_category_delete', [category.id], 6),
+        ])
+
+
+class QueryInstrumentationMiddlewareTest(TestCase):
+    """Tests for the query instrumentation middleware"""
+
+    TIMING = r'^db;dur=[\d.]+;desc="\d+ queries", app;dur=[\d.]+$'
+
+    def setUp(self):
+        category = Category.objects.create(name='Skincare')
+        Product.objects.create(name='Serum', description='Description', category=category, price=Decimal('10.00'))
+
+    def test_off_by_default_without_debug(self):
+        from django.conf import settings
+        self.assertFalse(settings.QUERY_INSTRUMENTATION)
+        response = self.client.get(reverse('store:product_list'))
+        self.assertNotIn('Server-Timing', response)
+
+    @override_settings(QUERY_INSTRUMENTATION=True)
+    def test_server_timing_header_is_for_staff(self):
+        self.assertNotIn('Server-Timing', self.client.get(reverse('store:product_list')))
+        self.client.force_login(User.objects.create_user(username='staff', password='testpass', is_staff=True))
+        self.assertRegex(self.client.get(reverse('store:product_list'))['Server-Timing'], self.TIMING)
+
+    @override_settings(QUERY_INSTRUMENTATION=True, DEBUG=True)
+    def test_server_timing_header_with_debug(self):
+        self.assertRegex(self.client.get(reverse('store:product_list'))['Server-Timing'], self.TIMING)
+
+    @override_settings(QUERY_INSTRUMENTATION=True)
+    def test_structured_log_line(self):
+        import json
+        with self.assertLogs('store.middleware', 'DEBUG') as logs:
+            self.client.get(reverse('store:product_list'))
+        self.assertEqual(logs.records[-1].levelname, 'DEBUG')
+        record = json.loads(logs.records[-1].getMessage())
+        self.assertEqual(record['path'], reverse('store:product_list'))
+        self.assertEqual(record['status'], 200)
+        self.assertGreater(record['queries'], 0)
+        self.assertIn('db_ms', record)
+
+    @override_settings(QUERY_INSTRUMENTATION=True, QUERY_BUDGET_WARNING=1)
+    def test_requests_over_budget_are_warnings(self):
+        with self.assertLogs('store.middleware', 'WARNING'):
+            self.client.get(reverse('store:product_list'))
+
+    def test_reports_duplicated_queries(self):
+        from .middleware import QueryRecorder
+        recorder = QueryRecorder()
+        for i in range(3):
+            recorder(lambda *args: None, 'SELECT 1 WHERE id = %s', [i], False, {})
+        recorder(lambda *args: None, 'SELECT 2', [], False, {})
+        self.assertEqual(recorder.count, 4)
+        self.assertEqual(recorder.duplicates(), [('SELECT 1 WHERE id = %s', 3)])
+
+
+class BenchmarkTest(TestCase):
+    """Tests for the benchmark data generator and load scenario"""
+
+    def generate(self, seed=7):
+        from .benchmarks.data import CatalogGenerator
+        return CatalogGenerator(seed=seed, batch_size=8).generate(
+            products=30, categories=6, users=4, orders=10, reviews=20
+        )
+
+    def test_generate_catalog(self):
+        from users.models import Profile
+        from .models import Review
+        counts = self.generate()
+        self.assertEqual(counts, {'categories': 6, 'products': 30, 'users': 4, 'orders': 10, 'reviews': 20})
+        self.assertEqual(Product.objects.filter(data_source='benchmark').count(), 30)
+        self.assertEqual(Review.objects.count(), 20)
+        self.assertTrue(OrderItem.objects.filter(order__user__username__startswith='bench_').exists())
+        self.assertTrue(User.objects.get(username='bench_staff').is_staff)
+        self.assertEqual(Profile.objects.filter(user__username__startswith='bench_').count(), 5)
+
+    def test_generation_is_repeatable_and_clearable(self):
+        from .benchmarks.data import clear_benchmark_data
+        self.generate()
+        names = list(Product.objects.order_by('external_id').values_list('name', 'price'))
+        clear_benchmark_data()
+        self.assertFalse(Product.objects.exists())
+        self.assertFalse(User.objects.filter(username__startswith='bench_').exists())
+        self.assertFalse(Category.objects.exists())
+        self.generate()
+        self.assertEqual(list(Product.objects.order_by('external_id').values_list('name', 'price')), names)
+
+    def test_run_load(self):
+        from .benchmarks.load import run_load
+        from .models import CheckoutKey
+        self.generate()
+        # Sold out products are not picked, and the ones bought are restocked before each journey
+        Product.objects.update(stock=1)
+        Product.objects.filter(id=Product.objects.order_by('id').first().id).update(stock=0)
+        results = run_load(iterations=4, warmup=0)
+        self.assertEqual(set(results['steps']), {
+            'home', 'product_list', 'search', 'product_detail', 'cart_add', 'checkout_form', 'checkout', 'admin_dashboard'
+        })
+        self.assertEqual(results['overall']['requests'], 32)
+        self.assertEqual(results['overall']['errors'], 0)
+        self.assertGreater(results['steps']['product_detail']['queries_mean'], 0)
+        self.assertEqual(Order.objects.filter(first_name='Bench', last_name='Shopper').count(), 4)
+        self.assertFalse(Order.objects.filter(first_name='Bench', items__product__stock=0).exists())
+        # Every checkout posted the key of the form it loaded
+        self.assertEqual(CheckoutKey.objects.exclude(order=None).count(), 4)
+        self.assertEqual(results['orders_placed'], 4)
+
+    def test_unexpected_responses_are_errors(self):
+        from .benchmarks.load import Reply, StepStats, is_expected
+        self.assertTrue(is_expected(Reply(200, 3, '', ''), 200))
+        self.assertFalse(is_expected(Reply(302, 3, '/login/', ''), 200))
+        # A checkout sent back to the cart placed nothing
+        self.assertTrue(is_expected(Reply(302, 9, '/orders/5/', ''), 'store:order_detail'))
+        self.assertFalse(is_expected(Reply(302, 9, reverse('store:cart_detail'), ''), 'store:order_detail'))
+        self.assertFalse(is_expected(Reply(200, 9, '', ''), 'store:order_detail'))
+        stats = StepStats()
+        stats.record(0.01, 302, 9, failed=True)
+        stats.record(0.01, 302, 9)
+        self.assertEqual(stats.summary()['errors'], 1)
+
+    def test_run_load_without_data(self):
+        from .benchmarks.load import run_load
+        with self.assertRaises(ValueError):
+            run_load(iterations=1)
+
+    def test_percentile_and_compare(self):
+        from .benchmarks.load import percentile, compare_results
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertIsNone(percentile([], 95))
+        baseline = {'steps': {'home': {'p95_ms': 100.0}}, 'overall': {'p95_ms': 50.0}}
+        current = {'steps': {'home': {'p95_ms': 80.0}}, 'overall': {'p95_ms': 50.0}}
+        rows = compare_results(baseline, current, metrics=('p95_ms',))
+        self.assertIn(('home', 'p95_ms', 100.0, 80.0, -20.0), rows)
+        self.assertIn(('overall', 'p95_ms', 50.0, 50.0, 0.0), rows)
+
+
+class DailySalesRollupTest(TestCase):
+    """Tests for the daily sales rollups behind the admin dashboard"""
+
+    CHECKOUT = {
+        'first_name': 'A', 'last_name': 'B', 'email': 'a@example.com', 'address': 'Street',
+        'postal_code': '1', 'city': 'City', 'payment_method': 'credit_card',
+    }
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='shopper', password='testpass')
+        self.staff = User.objects.create_user(username='staff', password='testpass', is_staff=True)
+        self.skincare = Category.objects.create(name='Skincare')
+        self.makeup = Category.objects.create(name='Makeup')
+        self.serum = Product.objects.create(
+            name='Serum', description='Description', category=self.skincare,
+            price=Decimal('10.10'), discount_percentage=Decimal('12.50'), stock=10
+        )
+        self.lipstick = Product.objects.create(
+            name='Lipstick', description='Description', category=self.makeup, price=Decimal('5.00'), stock=10
+        )
+
+    def checkout(self, *lines):
+        cart, _ = Cart.objects.get_or_create(user=self.user)
+        for product, quantity in lines:
+            CartItem.objects.create(cart=cart, product=product, quantity=quantity)
+        self.client.force_login(self.user)
+        self.client.post(reverse('store:order_create'), self.CHECKOUT)
+        return Order.objects.filter(user=self.user).latest('id')
+
+    def snapshot(self):
+        from .models import DailySales, DailyStatusSales, DailyCategorySales
+        return (
+            list(DailySales.objects.values_list('date', 'orders', 'revenue_cents', 'items')),
+            list(DailyStatusSales.objects.filter(orders__gt=0).values_list('date', 'status', 'orders', 'revenue_cents')),
+            list(DailyCategorySales.objects.values_list('date', 'category_id', 'revenue_cents', 'items')),
+        )
+
+    def test_checkout_records_order(self):
+        from .rollups import get_sales_totals, get_status_totals, get_category_totals
+        order = self.checkout((self.serum, 3), (self.lipstick, 1))
+        self.checkout((self.lipstick, 2))
+        totals = get_sales_totals()
+        self.assertEqual(totals['orders'], 2)
+        self.assertEqual(totals['items'], 6)
+        self.assertEqual(totals['revenue'], order.total_price + Decimal('10.00'))
+        self.assertEqual(get_status_totals()['pending']['orders'], 2)
+        self.assertEqual(get_category_totals(), [('Skincare', Decimal('26.52')), ('Makeup', Decimal('15.00'))])
+
+    def test_status_change_moves_order(self):
+        from .rollups import get_status_totals
+        order = self.checkout((self.serum, 1))
+        order = Order.objects.get(pk=order.pk)
+        order.status = 'shipped'
+        order.save()
+        statuses = get_status_totals()
+        self.assertNotIn('pending', statuses)
+        self.assertEqual(statuses['shipped'], {'orders': 1, 'revenue': order.total_price})
+
+        order.status = 'delivered'
+        order.save(update_fields=['status'])
+        self.assertEqual(set(get_status_totals()), {'delivered'})
+
+    def test_rebuild_matches_incremental_updates(self):
+        from io import StringIO
+        from django.core.management import call_command
+        order = self.checkout((self.serum, 3), (self.lipstick, 1))
+        self.checkout((self.lipstick, 2))
+        order.status = 'cancelled'
+        order.save()
+        incremental = self.snapshot()
+        call_command('rebuild_sales_rollups', stdout=StringIO())
+        self.assertEqual(self.snapshot(), incremental)
+
+    def test_rebuild_range_picks_up_bulk_changes(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from .rollups import rebuild_rollups, get_sales_totals
+        self.checkout((self.serum, 1))
+        Order.objects.update(total_price=Decimal('99.99'))
+        today = timezone.localdate()
+        self.assertEqual(rebuild_rollups(today - timedelta(days=1), today), 1)
+        self.assertEqual(get_sales_totals(today, today)['revenue'], Decimal('99.99'))
+        self.assertEqual(get_sales_totals(end=today - timedelta(days=1))['orders'], 0)
+
+    def test_dashboard_reads_rollups(self):
+        import json
+        from datetime import timedelta
+        from django.utils import timezone
+        order = self.checkout((self.serum, 1))
+        # Orders created outside checkout are not counted until the rollups are rebuilt
+        Order.objects.create(
+            user=self.user, first_name='A', last_name='B', email='a@example.com',
+            address='Street', postal_code='1', city='City', total_price=Decimal('50.00')
+        )
+        self.client.force_login(self.staff)
+        today = timezone.localdate()
+        response = self.client.get(reverse('store:admin_dashboard'), {
+            'start': (today - timedelta(days=6)).isoformat(), 'end': today.isoformat()
+        })
+        self.assertEqual(response.context['total_orders'], 1)
+        self.assertEqual(response.context['total_revenue'], order.total_price)
+        self.assertEqual(json.loads(response.context['status_data']), {'pending': 1})
+        self.assertEqual(json.loads(response.context['category_data']), {'Skincare': float(order.total_price)})
+        daily = json.loads(response.context['daily_data'])
+        self.assertEqual(len(daily), 7)
+        self.assertEqual(daily[-1]['orders'], 1)
+        self.assertEqual(response.context['range_totals']['revenue'], order.total_price)
+
+    def test_dashboard_ignores_invalid_range(self):
+        from django.utils import timezone
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('store:admin_dashboard'), {'start': 'yesterday', 'end': '2024-13-01'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['end_date'], timezone.localdate())
+        self.assertEqual((response.context['end_date'] - response.context['start_date']).days, 29)
+
+
+class UserStatsTest(TestCase):
+    """Tests for the cached admin user statistics and user search"""
+
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.staff = User.objects.create_user(username='staff', password='testpass', is_staff=True)
+        User.objects.create_superuser(username='root', password='testpass', email='root@example.com')
+        User.objects.create_user(
+            username='zoe', password='testpass', email='Zoe.Martin@Example.com', first_name='Zoé', last_name='Martin'
+        )
+        User.objects.create_user(username='gone', password='testpass', is_active=False)
+
+    def test_counts_in_one_query(self):
+        from .user_stats import count_user_stats
+        with self.assertNumQueries(1):
+            stats = count_user_stats()
+        self.assertEqual(stats, {
+            'total': 4, 'active': 3, 'inactive': 1, 'staff': 2, 'superusers': 1,
+            'customers': 2, 'new_month': 4, 'new_week': 4,
+        })
+
+    def test_cached_until_users_change(self):
+        from .user_stats import get_user_stats
+        self.assertEqual(get_user_stats()['total'], 4)
+        with self.assertNumQueries(0):
+            get_user_stats()
+
+        user = User.objects.create_user(username='new', password='testpass')
+        self.assertEqual(get_user_stats()['total'], 5)
+        user.is_staff = True
+        user.save()
+        self.assertEqual(get_user_stats()['staff'], 3)
+        user.delete()
+        self.assertEqual(get_user_stats()['total'], 4)
+
+    def test_login_keeps_cache(self):
+        from .user_stats import get_user_stats
+        get_user_stats()
+        self.client.login(username='zoe', password='testpass')
+        with self.assertNumQueries(0):
+            get_user_stats()
+
+    def test_search_normalized_column(self):
+        self.client.force_login(self.staff)
+        url = reverse('store:admin_user_list')
+        for query in ['ZOE', 'zoé', 'martin@example', '  Zoe   Martin ']:
+            with self.subTest(query=query):
+                response = self.client.get(url, {'search': query})
+                self.assertEqual([user.username for user in response.context['users']], ['zoe'])
+        response = self.client.get(url, {'search': 'nobody'})
+        self.assertEqual(list(response.context['users']), [])
+        self.assertEqual(response.context['total_users'], 4)
+
+    def test_search_text_follows_user_changes(self):
+        user = User.objects.get(username='gone')
+        user.first_name = 'Élodie'
+        user.save()
+        self.assertEqual(user.profile.search_text, 'gone\n\nelodie')
+
+    def test_search_matches_within_one_field(self):
+        self.client.force_login(self.staff)
+        # The end of the username and the start of the email
+        response = self.client.get(reverse('store:admin_user_list'), {'search': 'zoe zoe.martin'})
+        self.assertEqual(list(response.context['users']), [])
+
+    def test_search_finds_users_without_a_profile(self):
+        from users.models import Profile
+        Profile.objects.filter(user__username='zoe').delete()
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('store:admin_user_list'), {'search': 'Martin'})
+        self.assertEqual([user.username for user in response.context['users']], ['zoe'])
+
+
+class CategoryProductCountTest(TestCase):
+    """Tests for category product counts in the admin and the maintained product_count column"""
+
+    def setUp(self):
+        self.staff = User.objects.create_user(username='staff', password='testpass', is_staff=True)
+        self.skincare = Category.objects.create(name='Skincare')
+        self.makeup = Category.objects.create(name='Makeup')
+        self.serum = self.product('Serum', self.skincare)
+        self.product('Cream', self.skincare)
+        self.product('Retired', self.skincare, available=False)
+
+    def product(self, name, category, **fields):
+        return Product.objects.create(
+            name=name, description='Description', category=category, price=Decimal('10.00'), **fields
+        )
+
+    def counts(self):
+        return dict(Category.objects.values_list('name', 'product_count'))
+
+    def test_counts_follow_product_changes(self):
+        self.assertEqual(self.counts(), {'Skincare': 2, 'Makeup': 0})
+
+        serum = Product.objects.get(pk=self.serum.pk)
+        serum.category = self.makeup
+        serum.save()
+        self.assertEqual(self.counts(), {'Skincare': 1, 'Makeup': 1})
+
+        serum.available = False
+        serum.save()
+        self.assertEqual(self.counts(), {'Skincare': 1, 'Makeup': 0})
+
+        Product.objects.get(name='Cream').delete()
+        self.assertEqual(self.counts(), {'Skincare': 0, 'Makeup': 0})
+
+    def test_unchanged_save_skips_recount(self):
+        serum = Product.objects.get(pk=self.serum.pk)
+        serum.stock = 3
+        with self.assertNumQueries(1):
+            serum.save()
+
+    def test_deferred_counts_refresh_once(self):
+        from .signals import deferred_category_counts
+        with deferred_category_counts():
+            self.product('Lipstick', self.makeup)
+            self.product('Mascara', self.makeup)
+            self.assertEqual(self.counts()['Makeup'], 0)
+        self.assertEqual(self.counts(), {'Skincare': 2, 'Makeup': 2})
+
+    def test_refresh_fixes_drift(self):
+        Product.objects.update(available=True)
+        Category.refresh_product_counts()
+        self.assertEqual(self.counts(), {'Skincare': 3, 'Makeup': 0})
+
+    def test_admin_list_annotates_all_products(self):
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('store:admin_category_list'))
+        self.assertEqual(
+            [(category.name, category.num_products) for category in response.context['categories']],
+            [('Makeup', 0), ('Skincare', 3)]
+        )
+
+    def test_delete_refuses_category_with_products(self):
+        self.client.force_login(self.staff)
+        response = self.client.post(reverse('store:admin_category_delete', args=[self.skincare.id]))
+        self.assertRedirects(response, reverse('store:admin_category_list'))
+        self.assertTrue(Category.objects.filter(pk=self.skincare.pk).exists())
+        self.assertEqual(Product.objects.count(), 3)
+
+        self.client.post(reverse('store:admin_category_delete', args=[self.makeup.id]))
+        self.assertFalse(Category.objects.filter(pk=self.makeup.pk).exists())
+
+
+class ExportTest(TestCase):
+    """Tests for the streaming order and product exports"""
+
+    def setUp(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from .models import Coupon
+        self.staff = User.objects.create_user(username='staff', password='testpass', is_staff=True)
+        self.customer = User.objects.create_user(username='shopper', password='testpass')
+        category = Category.objects.create(name='Skincare')
+        self.serum = Product.objects.create(
+            name='=Serum', description='Description', category=category, price=Decimal('10.00')
+        )
+        self.cream = Product.objects.create(
+            name='Cream', description='Description', category=category, price=Decimal('20.00'), available=False
+        )
+        coupon = Coupon.objects.create(
+            code='SAVE', discount_value=Decimal('10'),
+            valid_from=timezone.now() - timedelta(days=1), valid_to=timezone.now() + timedelta(days=1)
+        )
+        self.orders = []
+        for i, status in enumerate(['pending', 'shipped', 'pending']):
+            order = Order.objects.create(
+                user=self.customer, first_name='A', last_name='B', email='a@example.com', address='Street',
+                postal_code='1', city='City', status=status, coupon=coupon if i == 0 else None,
+                total_price=Decimal('30.00')
+            )
+            OrderItem.objects.create(order=order, product=self.serum, price=Decimal('10.00'), quantity=1)
+            OrderItem.objects.create(order=order, product=self.cream, price=Decimal('20.00'), quantity=2)
+            self.orders.append(order)
+
+    def export(self, kind, **params):
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('store:admin_export', args=[kind]), params)
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content).decode()
+
+    def test_orders_csv(self):
+        import csv
+        response, content = self.export('orders', status='pending')
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertIn('attachment; filename="orders-', response['Content-Disposition'])
+        rows = list(csv.DictReader(content.splitlines()))
+        self.assertEqual([int(row['id']) for row in rows], [self.orders[0].id, self.orders[2].id])
+        self.assertEqual(rows[0]['coupon'], 'SAVE')
+        self.assertEqual(rows[0]['item_count'], '3')
+        self.assertEqual(rows[0]['items'], "1 x =Serum @ 10.00; 2 x Cream @ 20.00")
+        self.assertEqual(rows[1]['coupon'], '')
+
+    def test_orders_jsonl(self):
+        import json
+        from datetime import timedelta
+        from django.utils import timezone
+        today = timezone.localdate()
+        response, content = self.export('orders', format='jsonl', start=today.isoformat(), end=today.isoformat())
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        records = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual(len(records), 3)
+        self.assertEqual(records[1]['status'], 'shipped')
+        self.assertEqual(records[1]['total_price'], '30.00')
+        self.assertEqual(records[1]['items'][1], {
+            'product_id': self.cream.id, 'name': 'Cream', 'quantity': 2, 'price': '20.00'
+        })
+        _, content = self.export('orders', format='jsonl', end=(today - timedelta(days=1)).isoformat())
+        self.assertEqual(content, '')
+
+    def test_products_csv_escapes_formulas(self):
+        import csv
+        _, content = self.export('products', available='1')
+        rows = list(csv.DictReader(content.splitlines()))
+        self.assertEqual([row['name'] for row in rows], ["'=Serum"])
+        self.assertEqual(rows[0]['category'], 'Skincare')
+
+    def test_queries_per_chunk(self):
+        from .exports import export_lines
+        # One query for the orders, one for the items of each chunk of two orders
+        with self.assertNumQueries(3):
+            lines = list(export_lines('orders', 'csv', chunk_size=2))
+        self.assertEqual(len(lines), 4)
+
+    def test_staff_only(self):
+        url = reverse('store:admin_export', args=['orders'])
+        self.client.force_login(self.customer)
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.client.force_login(self.staff)
+        self.assertEqual(self.client.get(url, {'format': 'xml'}).status_code, 404)
+
+    def test_command(self):
+        import json
+        from io import StringIO
+        from django.core.management import call_command
+        out = StringIO()
+        call_command('export_data', 'orders', format='jsonl', status='shipped', stdout=out)
+        self.assertEqual([json.loads(line)['id'] for line in out.getvalue().splitlines()], [self.orders[1].id])
+
+    def test_benchmark(self):
+        from .benchmarks.export import run_export
+        results = run_export('orders', 'jsonl', chunk_size=2)
+        self.assertEqual(results['rows'], 3)
+        self.assertEqual(results['queries'], 3)
+        self.assertIsNotNone(results['peak_memory_mb'])
+
+
+class BulkProductEditTest(TestCase):
+    """Tests for bulk product editing in the store admin"""
+
+    def setUp(self):
+        self.staff = User.objects.create_user(username='staff', password='testpass', is_staff=True)
+        self.skincare = Category.objects.create(name='Skincare')
+        self.makeup = Category.objects.create(name='Makeup')
+        self.serum = self.product('Serum', self.skincare, price=Decimal('10.00'), stock=5)
+        self.cream = self.product('Cream', self.skincare, price=Decimal('19.99'), stock=1)
+        self.lipstick = self.product('Lipstick', self.makeup, price=Decimal('8.00'), stock=2)
+
+    def product(self, name, category, **fields):
+        return Product.objects.create(name=name, description='Description', category=category, **fields)
+
+    def post(self, button, **data):
+        self.client.force_login(self.staff)
+        return self.client.post(reverse('store:admin_product_bulk_edit'), {button: '1', **data})
+
+    def test_percentage_repricing_rounds_to_cents(self):
+        from .bulk_edit import apply_bulk_edit, build_updates, filter_products
+        count = apply_bulk_edit(filter_products(category=self.skincare), build_updates(price_percent=Decimal('10')))
+        self.assertEqual(count, 2)
+        prices = dict(Product.objects.values_list('name', 'price'))
+        self.assertEqual(prices, {'Serum': Decimal('11.00'), 'Cream': Decimal('21.99'), 'Lipstick': Decimal('8.00')})
+
+    def test_stock_change_stops_at_zero(self):
+        from .bulk_edit import apply_bulk_edit, build_updates
+        apply_bulk_edit(Product.objects.all(), build_updates(stock_change=-2, featured=True))
+        self.assertEqual(
+            set(Product.objects.values_list('name', 'stock', 'featured')),
+            {('Serum', 3, True), ('Cream', 0, True), ('Lipstick', 0, True)}
+        )
+
+    def test_history_records_replaced_values(self):
+        from .bulk_edit import apply_bulk_edit, build_updates
+        from .models import ProductHistory
+        apply_bulk_edit(Product.objects.all(), build_updates(price=Decimal('10.00'), stock=5))
+        # Serum already had both values, so only the other two products get a diff
+        self.assertEqual(
+            {entry.product.name: entry.product_data for entry in ProductHistory.objects.all()},
+            {'Cream': {'price': '19.99', 'stock': 1}, 'Lipstick': {'price': '8.00', 'stock': 2}}
+        )
+
+    def test_queries_per_batch_are_constant(self):
+        from .bulk_edit import apply_bulk_edit, build_updates
+        updates = build_updates(discount_percentage=Decimal('15'))
+        # One id query, then per batch: savepoint, history read, history insert, update, release
+        with self.assertNumQueries(1 + 5 * 2):
+            apply_bulk_edit(Product.objects.all(), updates, batch_size=2)
+
+    def test_availability_change_refreshes_category_counts(self):
+        from .bulk_edit import apply_bulk_edit, build_updates, filter_products
+        apply_bulk_edit(filter_products(category=self.skincare), build_updates(available=False))
+        self.assertEqual(dict(Category.objects.values_list('name', 'product_count')), {'Skincare': 0, 'Makeup': 1})
+
+    def test_preview_counts_without_changing(self):
+        response = self.post('preview', category=self.skincare.id, price='1.00')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['preview_count'], 2)
+        self.assertTrue(response.context['has_changes'])
+        self.assertEqual(Product.objects.get(pk=self.serum.pk).price, Decimal('10.00'))
+
+    def test_apply_updates_and_redirects(self):
+        response = self.post('apply', search='stick', set_available='0')
+        self.assertRedirects(response, reverse('store:admin_product_list'))
+        self.assertFalse(Product.objects.get(pk=self.lipstick.pk).available)
+        self.assertTrue(Product.objects.get(pk=self.serum.pk).available)
+
+    def test_apply_requires_a_change(self):
+        response = self.post('apply', category=self.skincare.id)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['form'].non_field_errors())
+
+    def test_conflicting_changes_are_rejected(self):
+        response = self.post('apply', price='5.00', price_percent='10')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Product.objects.get(pk=self.serum.pk).price, Decimal('10.00'))
+
+    def test_customers_cannot_bulk_edit(self):
+        customer = User.objects.create_user(username='customer', password='testpass')
+        self.client.force_login(customer)
+        self.client.post(reverse('store:admin_product_bulk_edit'), {'apply': '1', 'price': '1.00'})
+        self.assertEqual(Product.objects.get(pk=self.serum.pk).price, Decimal('10.00'))
+
+
+class ProductHistoryTest(TestCase):
+    """Tests for diff-based product history and its compaction"""
+
+    def setUp(self):
+        self.staff = User.objects.create_user(username='staff', password='testpass', is_staff=True)
+        self.skincare = Category.objects.create(name='Skincare')
+        self.makeup = Category.objects.create(name='Makeup')
+        self.product = Product.objects.create(
+            name='Serum', description='Description', category=self.skincare, price=Decimal('10.00'), stock=5
+        )
+
+    def edit(self, **changes):
+        from .forms import ProductForm
+        from .models import ProductHistory
+        product = Product.objects.get(pk=self.product.pk)
+        form = ProductForm(instance=product)
+        data = {name: form.initial.get(name) for name in form.fields if name != 'image'}
+        data.update(changes)
+        data = {name: value for name, value in data.items() if value is not False}
+        form = ProductForm(data, instance=product)
+        self.assertTrue(form.is_valid(), form.errors)
+        form.save()
+        return ProductHistory.record_form_changes(form)
+
+    def age(self, entry, days):
+        from datetime import timedelta
+        from django.utils import timezone
+        from .models import ProductHistory
+        ProductHistory.objects.filter(pk=entry.pk).update(created_at=timezone.now() - timedelta(days=days))
+
+    def test_form_edit_records_only_changed_fields(self):
+        entry = self.edit(price='12.50', category=self.makeup.id)
+        self.assertEqual(entry.kind, 'diff')
+        self.assertEqual(
+            entry.product_data, {'price': '10.00', 'category_id': self.skincare.id, 'category_name': 'Skincare'}
+        )
+        self.assertEqual(entry.previous_version()['price'], '10.00')
+        self.assertEqual(entry.previous_version()['name'], 'Serum')
+
+    def test_unchanged_edit_records_nothing(self):
+        from .models import ProductHistory
+        self.assertIsNone(self.edit(price='10'))
+        self.assertFalse(ProductHistory.objects.exists())
+
+    def test_large_values_are_compressed(self):
+        long_description = 'A much longer description. ' * 50
+        self.edit(description=long_description)
+        entry = self.edit(description='Short')
+        self.assertTrue(entry.compressed)
+        self.assertLess(len(entry.data), 200)
+        self.assertEqual(entry.product_data, {'description': long_description.strip()})
+
+    def test_admin_update_view_records_history(self):
+        from .models import ProductHistory
+        self.client.force_login(self.staff)
+        data = {
+            'name': 'Serum', 'description': 'Description', 'price': '11.00', 'category': self.skincare.id,
+            'stock': 5, 'available': 'on', 'discount_percentage': '0',
+            'additional_images-TOTAL_FORMS': '0', 'additional_images-INITIAL_FORMS': '0',
+        }
+        self.client.post(reverse('store:admin_product_update', args=[self.product.id]), data)
+        self.assertEqual(ProductHistory.objects.get().product_data, {'price': '10.00'})
+
+    def test_public_detail_page_skips_history(self):
+        self.edit(price='12.00')
+        url = reverse('store:product_detail', args=[self.product.id])
+        response = self.client.get(url)
+        self.assertNotIn('previous_version', response.context)
+
+        self.client.force_login(self.staff)
+        response = self.client.get(url)
+        self.assertEqual(response.context['previous_version']['price'], '10.00')
+
+    def test_compaction_keeps_one_snapshot_per_period(self):
+        from .history import compact_history
+        from .models import ProductHistory
+        first = self.edit(price='11.00')
+        second = self.edit(stock=3)
+        recent = self.edit(name='Night Serum')
+        self.age(first, 200)
+        self.age(second, 200)
+
+        removed, dropped = compact_history(keep_days=90, period='month')
+        self.assertEqual((removed, dropped), (1, 0))
+        snapshot, = ProductHistory.objects.filter(kind='snapshot')
+        # The product as it was before the oldest edit of the period
+        self.assertEqual(snapshot.product_data['price'], '10.00')
+        self.assertEqual(snapshot.product_data['stock'], 5)
+        self.assertEqual(snapshot.product_data['name'], 'Serum')
+        self.assertTrue(ProductHistory.objects.filter(pk=recent.pk, kind='diff').exists())
+
+        # Compacting again changes nothing, and expired entries are dropped
+        self.assertEqual(compact_history(keep_days=90), (0, 0))
+        self.assertEqual(compact_history(keep_days=90, drop_days=120), (0, 1))
+        self.assertEqual(list(ProductHistory.objects.values_list('pk', flat=True)), [recent.pk])
+
+
+class ProductImagePathTest(TestCase):
+    """Tests for keeping the legacy image_path column in sync with image"""
+
+    def setUp(self):
+        self.category = Category.objects.create(name='Skincare')
+        self.product = Product.objects.create(
+            name='Serum', description='Description', category=self.category, price=Decimal('10.00'),
+            image='product_images/serum.jpg'
+        )
+
+    def test_create_sets_image_path(self):
+        self.assertEqual(Product.objects.get(pk=self.product.pk).image_path, 'product_images/serum.jpg')
+
+    def test_save_with_image_is_one_query(self):
+        product = Product.objects.get(pk=self.product.pk)
+        product.stock = 3
+        with self.assertNumQueries(1):
+            product.save()
+
+        product.image = 'product_images/serum-new.jpg'
+        with self.assertNumQueries(1):
+            product.save()
+        self.assertEqual(Product.objects.get(pk=self.product.pk).image_path, 'product_images/serum-new.jpg')
+
+    def test_update_fields_include_image_path(self):
+        product = Product.objects.get(pk=self.product.pk)
+        product.image = 'product_images/other.jpg'
+        product.stock = 7
+        product.save(update_fields=['image'])
+        product = Product.objects.get(pk=self.product.pk)
+        self.assertEqual((product.image_path, product.stock), ('product_images/other.jpg', 0))
+
+    def test_upload_records_stored_name(self):
+        import tempfile
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from django.test import override_settings
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            for _ in range(2):
+                product = Product.objects.get(pk=self.product.pk)
+                product.image = SimpleUploadedFile('upload.jpg', b'image data')
+                product.save()
+            product = Product.objects.get(pk=self.product.pk)
+            # The second upload is renamed by the storage to avoid a clash
+            self.assertNotEqual(product.image.name, 'product_images/upload.jpg')
+            self.assertEqual(product.image_path, product.image.name)
+
+
+class DatabaseConnectionsTest(TestCase):
+    """Tests for the database connection settings and the connection benchmark"""
+
+    SQLITE = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': 'db.sqlite3'}
+    POSTGRES = {'ENGINE': 'django.db.backends.postgresql', 'NAME': 'shop', 'OPTIONS': {'sslmode': 'require'}}
+
+    def test_defaults_keep_connections_with_health_checks(self):
+        from ecommerce.database import configure_connections
+        config = configure_connections(self.SQLITE, {})
+        self.assertEqual((config['CONN_MAX_AGE'], config['CONN_HEALTH_CHECKS']), (600, True))
+        self.assertIn('PRAGMA journal_mode=WAL', config['OPTIONS']['init_command'])
+        self.assertIn('PRAGMA busy_timeout=5000', config['OPTIONS']['init_command'])
+        self.assertEqual(config['OPTIONS']['transaction_mode'], 'IMMEDIATE')
+
+        config = configure_connections(self.POSTGRES, {'DB_CONN_MAX_AGE': '0', 'DB_CONN_HEALTH_CHECKS': 'no'})
+        self.assertEqual((config['CONN_MAX_AGE'], config['CONN_HEALTH_CHECKS']), (0, False))
+        self.assertEqual(config['OPTIONS'], {'sslmode': 'require'})
+
+    def test_pool_replaces_persistent_connections(self):
+        from ecommerce.database import configure_connections
+        config = configure_connections(self.POSTGRES, {'DB_POOL': 'true', 'DB_POOL_MAX_SIZE': '20'})
+        self.assertEqual(config['CONN_MAX_AGE'], 0)
+        self.assertEqual(config['OPTIONS']['pool'], {'min_size': 2, 'max_size': 20, 'timeout': 10})
+        self.assertNotIn('pool', self.POSTGRES['OPTIONS'])
+
+    def test_invalid_settings_are_rejected(self):
+        from django.core.exceptions import ImproperlyConfigured
+        from ecommerce.database import configure_connections
+        with self.assertRaises(ImproperlyConfigured):
+            configure_connections(self.SQLITE, {'DB_POOL': '1'})
+        with self.assertRaises(ImproperlyConfigured):
+            configure_connections(self.SQLITE, {'DB_CONN_MAX_AGE': 'forever'})
+
+    def test_sqlite_pragmas_applied_on_connect(self):
+        from django.db import connection
+        if connection.vendor != 'sqlite':
+            self.skipTest('SQLite only')
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)  # NORMAL
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], 5000)
+
+    def test_connection_benchmark(self):
+        from django.db import connections
+        from .benchmarks.connections import run_connection_benchmark
+        category = Category.objects.create(name='Skincare')
+        Product.objects.create(name='Serum', description='Description', category=category, price=Decimal('10.00'))
+        settings_before = dict(connections.settings['default'])
+
+        results = run_connection_benchmark(requests=3, modes=['per-request', 'persistent'])
+        self.assertEqual(list(results['modes']), ['per-request', 'persistent'])
+        for summary in results['modes'].values():
+            self.assertEqual((summary['requests'], summary['errors']), (3, 0))
+        self.assertEqual(connections.settings['default'], settings_before)
+
+        with self.assertRaises(ValueError):
+            run_connection_benchmark(requests=1, modes=['teleport'])
+
+
+class ReplicaTrackingMixin:
+    """Checks that a product page keeps its recently viewed tracking off the replica"""
+
+    def assertTracksViewsOnThePrimary(self, get):
+        from django.db import DEFAULT_DB_ALIAS
+        from django.test import override_settings
+        from ecommerce.routers import ReplicaRouter
+        from .models import RecentlyViewedProduct
+
+        class RecordingRouter(ReplicaRouter):
+            """Records where reads would go, then runs them on the only test database"""
+            def __init__(self):
+                self.reads = []
+
+            def db_for_read(self, model, **hints):
+                self.reads.append((model, super().db_for_read(model, **hints)))
+                return DEFAULT_DB_ALIAS
+
+        user = User.objects.create_user(username='viewer', password='testpass')
+        category = Category.objects.create(name='Skincare')
+        products = [
+            Product.objects.create(name=f'Serum {i}', description='Description', category=category, price=Decimal('10.00'))
+            for i in range(12)
+        ]
+        for product in products[1:]:
+            RecentlyViewedProduct.objects.create(user=user, product=product)
+        router = RecordingRouter()
+        with override_settings(REPLICA_DATABASE='replica', DATABASE_ROUTERS=[router]):
+            get(user, reverse('store:product_detail', args=[products[0].id]))
+
+        # The list is trimmed back to ten items, keeping the product just viewed
+        self.assertEqual(RecentlyViewedProduct.objects.filter(user=user).count(), 10)
+        self.assertTrue(RecentlyViewedProduct.objects.filter(user=user, product=products[0]).exists())
+        self.assertIn((Product, 'replica'), router.reads)
+        tracking = {alias for model, alias in router.reads if model is RecentlyViewedProduct}
+        self.assertEqual(tracking, {'default'})
+
+
+class ReplicaRoutingTest(ReplicaTrackingMixin, TestCase):
+    """Tests for routing catalog and report reads to a read replica"""
+
+    def setUp(self):
+        from django.test import RequestFactory
+        self.factory = RequestFactory()
+
+    def middleware(self):
+        from ecommerce.routers import ReplicaMiddleware, read_database
+        from django.http import HttpResponse
+        seen = []
+
+        def get_response(request):
+            seen.append(read_database())
+            return HttpResponse()
+        return ReplicaMiddleware(get_response), seen
+
+    def test_router_reads_replica_only_inside_use_replica(self):
+        from django.test import override_settings
+        from ecommerce.routers import ReplicaRouter, use_replica
+        router = ReplicaRouter()
+        with override_settings(REPLICA_DATABASE='replica'):
+            self.assertEqual(router.db_for_read(Product), 'default')
+            with use_replica():
+                self.assertEqual(router.db_for_read(Product), 'replica')
+                self.assertEqual(router.db_for_write(Product), 'default')
+            self.assertEqual(router.db_for_read(Product), 'default')
+        with use_replica():
+            self.assertEqual(router.db_for_read(Product), 'default')
+
+    def test_writes_make_reads_sticky(self):
+        from django.test import override_settings
+        from ecommerce.routers import STICKY_COOKIE
+        with override_settings(REPLICA_DATABASE='replica', REPLICA_STICKY_SECONDS=30):
+            middleware, seen = self.middleware()
+            response = middleware(self.factory.post('/cart/add/1/'))
+            cookie = response.cookies[STICKY_COOKIE]
+            self.assertEqual(cookie['max-age'], 30)
+
+            request = self.factory.get('/products/')
+            request.COOKIES[STICKY_COOKIE] = cookie.value
+            middleware(request)
+
+            expired = self.factory.get('/products/')
+            expired.COOKIES[STICKY_COOKIE] = '1000'
+            middleware(expired)
+
+            garbled = self.factory.get('/products/')
+            garbled.COOKIES[STICKY_COOKIE] = 'soon'
+            middleware(garbled)
+        self.assertEqual(seen, ['default', 'default', 'replica', 'replica'])
+
+    def test_no_replica_sets_no_cookie(self):
+        middleware, seen = self.middleware()
+        response = middleware(self.factory.post('/cart/add/1/'))
+        self.assertEqual(dict(response.cookies), {})
+        self.assertEqual(seen, ['default'])
+
+    def test_replica_views_render_inside_block(self):
+        from django.template import engines
+        from django.template.response import SimpleTemplateResponse
+        from django.test import override_settings
+        from django.views.generic import View
+        from ecommerce.routers import ReplicaReadMixin, read_database
+
+        class ReportView(ReplicaReadMixin, View):
+            def get(self, request):
+                # read_database() stands in for a lazy queryset evaluated by the template
+                return SimpleTemplateResponse(engines['django'].from_string('{{ database }}'), {'database': read_database})
+
+        with override_settings(REPLICA_DATABASE='replica'):
+            response = ReportView.as_view()(self.factory.get('/report/'))
+        self.assertEqual(response.content, b'replica')
+
+    def test_product_page_tracks_views_on_the_primary(self):
+        def get(user, url):
+            self.client.force_login(user)
+            self.client.get(url)
+        self.assertTracksViewsOnThePrimary(get)
+
+
+class AsyncViewsTest(ReplicaTrackingMixin, TestCase):
+    """Tests for the async home, product list and product detail views served under ASGI"""
+
+    def setUp(self):
+        self.category = Category.objects.create(name='Skincare')
+        self.products = [
+            Product.objects.create(
+                name=f'Serum {i}', description='Description', category=self.category, price=Decimal('10.00') + i,
+                featured=i < 2,
+            )
+            for i in range(30)
+        ]
+        self.user = User.objects.create_user(username='shopper', password='testpass123', is_staff=True)
+        Review.objects.create(product=self.products[0], user=self.user, rating=4, title='Nice', comment='Good')
+
+    def compare(self, url):
+        """Request url from the sync views and the async ones and compare their contexts"""
+        from asgiref.sync import async_to_sync
+        from django.test import AsyncClient, override_settings
+        sync_response = self.client.get(url)
+        async_client = AsyncClient()
+        async_client.force_login(self.user)
+        with override_settings(ROOT_URLCONF='ecommerce.asgi_urls'):
+            async_response = async_to_sync(async_client.get)(url)
+        self.assertEqual(async_response.status_code, sync_response.status_code)
+        return sync_response, async_response
+
+    def assertRaisesNotFound(self, view_class, url, **kwargs):
+        # Django renders async views' exceptions in a worker thread outside the test transaction, so call the view
+        from asgiref.sync import async_to_sync
+        from django.http import Http404
+        from django.test import AsyncRequestFactory
+        with self.assertRaises(Http404):
+            async_to_sync(view_class.as_view())(AsyncRequestFactory().get(url), **kwargs)
+
+    def values(self, context, key):
+        from django.db.models import QuerySet
+        value = context[key]
+        if isinstance(value, (list, QuerySet)):
+            return [item.pk for item in value]
+        return getattr(value, 'pk', value)
+
+    def test_async_urls_use_async_views(self):
+        from asgiref.sync import iscoroutinefunction
+        from django.urls import resolve
+        for name, args in [('home', []), ('product_list', []), ('product_detail', [1])]:
+            path = reverse(f'store:{name}', args=args)
+            self.assertFalse(iscoroutinefunction(resolve(path).func))
+            self.assertTrue(iscoroutinefunction(resolve(path, urlconf='ecommerce.asgi_urls').func))
+        self.assertEqual(resolve('/cart/', urlconf='ecommerce.asgi_urls').url_name, 'cart_detail')
+
+    def test_product_detail_tracks_views_on_the_primary(self):
+        from asgiref.sync import async_to_sync
+        from django.test import AsyncClient, override_settings
+
+        def get(user, url):
+            client = AsyncClient()
+            client.force_login(user)
+            with override_settings(ROOT_URLCONF='ecommerce.asgi_urls'):
+                async_to_sync(client.get)(url)
+        self.assertTracksViewsOnThePrimary(get)
+
+    def test_home_matches_sync_view(self):
+        self.client.force_login(self.user)
+        self.client.get(reverse('store:product_detail', args=[self.products[3].pk]))
+        sync_response, async_response = self.compare(reverse('store:home'))
+        for key in ('categories', 'carousel_products', 'featured_products', 'recently_viewed_products'):
+            self.assertEqual(self.values(async_response.context, key), self.values(sync_response.context, key), key)
+        self.assertContains(async_response, 'Serum 0')
+
+    def test_product_list_matches_sync_view(self):
+        from . import async_views
+        self.client.force_login(self.user)
+        for query in ('', '?page=2&sort=price_desc', '?page=last', '?show_all=1', '?q=Serum 1&min_price=11'):
+            sync_response, async_response = self.compare(reverse('store:product_list') + query)
+            for key in ('products', 'categories', 'total_products', 'is_paginated', 'sort', 'min_price'):
+                self.assertEqual(self.values(async_response.context, key), self.values(sync_response.context, key), key)
+        self.assertRaisesNotFound(async_views.ProductListView, reverse('store:product_list') + '?page=9')
+
+    def test_product_detail_matches_sync_view(self):
+        from . import async_views
+        from .models import RecentlyViewedProduct
+        self.client.force_login(self.user)
+        self.client.get(reverse('store:product_detail', args=[self.products[5].pk]))
+        sync_response, async_response = self.compare(reverse('store:product_detail', args=[self.products[0].pk]))
+        for key in (
+            'product', 'reviews', 'user_has_reviewed', 'rating_count', 'rating_avg', 'rating_distribution',
+            'additional_images', 'related_products', 'recently_viewed_products', 'exclusive_features'
+        ):
+            self.assertEqual(self.values(async_response.context, key), self.values(sync_response.context, key), key)
+        self.assertTrue(async_response.context['user_has_reviewed'])
+        self.assertEqual(
+            RecentlyViewedProduct.objects.filter(user=self.user).order_by('-viewed_at').first().product, self.products[0]
+        )
+        self.assertRaisesNotFound(async_views.ProductDetailView, reverse('store:product_detail', args=[99999]), pk=99999)
+
+    def test_async_benchmark(self):
+        from .benchmarks.asgi import run_async_benchmark
+        results = run_async_benchmark(requests=3)
+        self.assertEqual(list(results['modes']), ['wsgi', 'asgi'])
+        for summary in results['modes'].values():
+            self.assertEqual((summary['requests'], summary['errors']), (3, 0))
+        with self.assertRaises(ValueError):
+            run_async_benchmark(requests=1, modes=['gevent'])
+
+
+class TaskQueueTest(TestCase):
+    """Tests for the database-backed task queue, run by an in-process worker"""
+
+    def setUp(self):
+        from .task_queue import REGISTRY, task
+        self.calls = []
+        self.failures = 0
+
+        def flaky(value):
+            self.calls.append(value)
+            if self.failures:
+                self.failures -= 1
+                raise RuntimeError('try again')
+
+        self.flaky = task(name='tests.flaky', max_attempts=3, retry_delay=10)(flaky)
+        self.addCleanup(REGISTRY.pop, 'tests.flaky')
+
+    def worker(self):
+        from .task_queue import Worker
+        return Worker(threads=2)
+
+    def test_worker_runs_due_tasks(self):
+        from .models import Task
+        from .task_queue import enqueue
+        first = self.flaky.enqueue(value=1)
+        later = enqueue('tests.flaky', delay=60, value=2)
+        self.assertEqual(self.worker().run_until_empty(), 1)
+        self.assertEqual(self.calls, [1])
+        first.refresh_from_db()
+        self.assertEqual((first.status, first.attempts, first.locked_by), (Task.DONE, 1, ''))
+        self.assertIsNotNone(first.finished_at)
+        self.assertEqual(Task.objects.get(id=later.id).status, Task.PENDING)
+        with self.assertRaises(KeyError):
+            enqueue('tests.missing')
+
+    def test_failed_tasks_are_retried_with_backoff(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from .models import Task
+        self.failures = 3
+        queued = self.flaky.enqueue(value='x')
+        for attempt, delay in [(1, 10), (2, 20)]:
+            start = timezone.now()
+            self.worker().run_until_empty()
+            queued.refresh_from_db()
+            self.assertEqual((queued.status, queued.attempts), (Task.PENDING, attempt))
+            self.assertIn('try again', queued.last_error)
+            self.assertGreaterEqual(queued.run_at, start + timedelta(seconds=delay))
+            Task.objects.filter(id=queued.id).update(run_at=timezone.now())
+
+        self.worker().run_until_empty()
+        queued.refresh_from_db()
+        self.assertEqual((queued.status, queued.attempts), (Task.FAILED, 3))
+        self.assertEqual(self.calls, ['x', 'x', 'x'])
+
+    def test_expired_lease_is_claimed_again(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from .models import Task
+        from .task_queue import claim_tasks, run_task
+        self.flaky.enqueue(value=1)
+        [lost] = claim_tasks('worker-a', 10)
+        self.assertEqual(claim_tasks('worker-b', 10), [])
+
+        Task.objects.filter(id=lost.id).update(locked_until=timezone.now() - timedelta(seconds=1))
+        [claimed] = claim_tasks('worker-b', 10)
+        self.assertEqual((claimed.id, claimed.attempts), (lost.id, 2))
+        # The first worker no longer holds the lease, so its late result is ignored
+        self.failures = 1
+        run_task(lost)
+        self.assertTrue(run_task(claimed))
+        self.assertEqual(Task.objects.get(id=lost.id).status, Task.DONE)
+
+    def test_checkout_work_runs_in_the_worker(self):
+        from django.core import mail
+        from .models import Task
+        user = User.objects.create_user(username='shopper', password='testpass', email='a@example.com')
+        category = Category.objects.create(name='Skincare')
+        product = Product.objects.create(
+            name='Serum', description='Description', category=category, price=Decimal('20.00'), stock=5
+        )
+        CartItem.objects.create(cart=Cart.objects.create(user=user), product=product, quantity=2)
+        self.client.login(username='shopper', password='testpass')
+
+        self.client.post(reverse('store:order_create'), {
+            'first_name': 'A', 'last_name': 'B', 'email': 'a@example.com', 'address': 'Street',
+            'postal_code': '1', 'city': 'City', 'payment_method': 'credit_card',
+        })
+        self.assertEqual(list(Task.objects.values_list('name', flat=True)), ['store.send_order_confirmation'])
+        self.assertEqual(mail.outbox, [])
+
+        self.assertEqual(self.worker().run_until_empty(), 1)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['a@example.com'])
+        self.assertIn('Total: 40.00', mail.outbox[0].body)
+
+        # A second run, after a lost lease or a retry, doesn't email the customer again
+        from .tasks import send_order_confirmation
+        order = Order.objects.get(user=user)
+        send_order_confirmation(order_id=order.id)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIsNotNone(Order.objects.get(id=order.id).confirmation_sent_at)
+
+    def test_failed_confirmation_is_sent_on_retry(self):
+        from unittest import mock
+        from django.core import mail
+        from .tasks import send_order_confirmation
+        user = User.objects.create_user(username='shopper', password='testpass')
+        order = Order.objects.create(
+            user=user, first_name='A', last_name='B', email='a@example.com', address='Street',
+            postal_code='1', city='City', total_price=Decimal('40.00')
+        )
+        with mock.patch('store.tasks.send_mail', side_effect=OSError('SMTP down')), self.assertRaises(OSError):
+            send_order_confirmation(order_id=order.id)
+        self.assertIsNone(Order.objects.get(id=order.id).confirmation_sent_at)
+        send_order_confirmation(order_id=order.id)
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_purge_finished_tasks(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from .models import Task
+        from .task_queue import purge_finished_tasks
+        old, recent, pending = [self.flaky.enqueue(value=i) for i in range(3)]
+        Task.objects.filter(id=old.id).update(status=Task.DONE, finished_at=timezone.now() - timedelta(days=8))
+        Task.objects.filter(id=recent.id).update(status=Task.FAILED, finished_at=timezone.now())
+        self.assertEqual(purge_finished_tasks(keep_days=7), 1)
+        self.assertEqual(set(Task.objects.values_list('id', flat=True)), {recent.id, pending.id})
+
+
+class TaskWorkerThreadsTest(TransactionTestCase):
+    """The worker's thread pool runs tasks on its own connections"""
+
+    def test_run_once_on_thread_pool(self):
+        from .models import Task
+        from .task_queue import REGISTRY, Worker, task
+        done = []
+        record = task(name='tests.record')(lambda value: done.append(value))
+        self.addCleanup(REGISTRY.pop, 'tests.record')
+        for value in range(6):
+            record.enqueue(value=value)
+        Worker(threads=3).run(once=True)
+        self.assertEqual(sorted(done), list(range(6)))
+        self.assertEqual(Task.objects.filter(status=Task.DONE).count(), 6)
+
+
+class StockReservationTest(QueryPlanMixin, TestCase):
+    """Tests for checkout stock reservations and available stock"""
+
+    CHECKOUT = {
+        'first_name': 'A', 'last_name': 'B', 'email': 'a@example.com', 'address': 'Street',
+        'postal_code': '1', 'city': 'City', 'payment_method': 'credit_card',
+    }
+
+    def setUp(self):
+        self.category = Category.objects.create(name='Skincare')
+        self.product = Product.objects.create(
+            name='Rare Serum', description='Description', category=self.category, price=Decimal('50.00'),
+            stock=3, limited_edition=True
+        )
+        self.alice = User.objects.create_user(username='alice', password='testpass')
+        self.bob = User.objects.create_user(username='bob', password='testpass')
+
+    def add_to_cart(self, user, quantity):
+        cart, _ = Cart.objects.get_or_create(user=user)
+        CartItem.objects.update_or_create(cart=cart, product=self.product, defaults={'quantity': quantity})
+
+    def test_reservations_hold_stock(self):
+        from .inventory import OutOfStock, get_available_stock, reserve_stock
+        reserve_stock(self.alice, {self.product.id: 2})
+        self.assertEqual(get_available_stock([self.product.id], self.bob), {self.product.id: 1})
+        with self.assertRaises(OutOfStock) as raised:
+            reserve_stock(self.bob, {self.product.id: 2})
+        self.assertEqual(raised.exception.shortages, {self.product: 1})
+        self.assertFalse(self.bob.stock_reservations.exists())
+
+        reserve_stock(self.bob, {self.product.id: 1})
+        # A shopper's own reservation is theirs to use
+        self.assertEqual(get_available_stock([self.product.id], self.alice), {self.product.id: 2})
+        reserve_stock(self.alice, {self.product.id: 1})
+        self.assertEqual(self.alice.stock_reservations.get().quantity, 1)
+
+    def test_expired_reservations_stop_counting(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from .inventory import get_available_stock, reserve_stock, release_expired_reservations
+        from .models import StockReservation
+        reserve_stock(self.alice, {self.product.id: 3})
+        self.assertEqual(get_available_stock([self.product.id]), {self.product.id: 0})
+        StockReservation.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(get_available_stock([self.product.id]), {self.product.id: 3})
+        self.assertEqual(release_expired_reservations(), 1)
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_sweep_task_schedules_itself(self):
+        from .models import Task
+        from .task_queue import Worker
+        from .tasks import release_reservations
+        release_reservations.enqueue(every=60)
+        Worker().run_until_empty()
+        self.assertEqual(Task.objects.filter(name='store.release_expired_reservations', status=Task.PENDING).count(), 1)
+
+    def test_checkout_reserves_then_takes_stock(self):
+        from .models import StockReservation
+        self.add_to_cart(self.alice, 2)
+        self.client.force_login(self.alice)
+        response = self.client.get(reverse('store:order_create'))
+        self.assertIsNotNone(response.context['reserved_until'])
+        self.assertEqual(StockReservation.objects.get(user=self.alice).quantity, 2)
+
+        self.client.post(reverse('store:order_create'), self.CHECKOUT)
+        self.assertTrue(Order.objects.filter(user=self.alice).exists())
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 1)
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_checkout_fails_when_stock_is_reserved(self):
+        from .inventory import reserve_stock
+        reserve_stock(self.alice, {self.product.id: 2})
+        self.add_to_cart(self.bob, 2)
+        self.client.force_login(self.bob)
+        response = self.client.post(reverse('store:order_create'), self.CHECKOUT)
+        self.assertRedirects(response, reverse('store:cart_detail'))
+        self.assertFalse(Order.objects.exists())
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 3)
+
+        response = self.client.get(reverse('store:cart_detail'))
+        self.assertEqual([line.product for line in response.context['short_lines']], [self.product])
+        self.assertContains(response, 'Rare Serum (1 left)')
+
+    def test_cancel_puts_items_back_in_stock(self):
+        self.add_to_cart(self.alice, 2)
+        self.client.force_login(self.alice)
+        self.client.post(reverse('store:order_create'), self.CHECKOUT)
+        order = Order.objects.get(user=self.alice)
+        self.client.post(reverse('store:order_cancel', args=[order.id]))
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 3)
+        # A repeated cancel finds the order no longer pending
+        self.client.post(reverse('store:order_cancel', args=[order.id]))
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 3)
+
+    def test_staff_status_changes_move_stock(self):
+        staff = User.objects.create_user(username='staff', password='testpass', is_staff=True)
+        self.add_to_cart(self.alice, 2)
+        self.client.force_login(self.alice)
+        self.client.post(reverse('store:order_create'), self.CHECKOUT)
+        order = Order.objects.get(user=self.alice)
+        self.client.force_login(staff)
+        url = reverse('store:admin_order_update', args=[order.id])
+
+        def set_status(status, stock):
+            response = self.client.post(url, {'status': status})
+            self.product.refresh_from_db()
+            self.assertEqual(self.product.stock, stock)
+            return response
+
+        set_status('cancelled', 3)
+        set_status('processing', 1)
+        set_status('shipped', 1)
+        set_status('cancelled', 3)
+        # Reopening fails, changing nothing, once the stock was sold to someone else
+        Product.objects.filter(id=self.product.id).update(stock=1)
+        response = set_status('pending', 1)
+        self.assertFormError(response.context['form'], 'status', 'Not enough stock to reopen this order: Rare Serum (1 left).')
+        order.refresh_from_db()
+        self.assertEqual(order.status, 'cancelled')
+
+    def test_in_stock_filter(self):
+        from .inventory import in_stock, reserve_stock
+        sold_out = Product.objects.create(name='Sold Out', description='Description', category=self.category, price=Decimal('5.00'))
+        response = self.client.get(reverse('store:product_list'), {'in_stock': 'true'})
+        self.assertEqual(list(response.context['products']), [self.product])
+        reserve_stock(self.alice, {self.product.id: 3})
+        response = self.client.get(reverse('store:product_list'), {'in_stock': 'true'})
+        self.assertEqual(list(response.context['products']), [])
+        self.assertIn(sold_out, Product.objects.all())
+        self.assertUsesIndex(Product.objects.filter(available=True, stock__gt=0))
+        self.assertUsesIndex(in_stock(Product.objects.filter(available=True)))
+
+    def test_in_stock_filter_is_kept_across_pages(self):
+        Product.objects.bulk_create([
+            Product(name=f'Serum {i}', description='Description', category=self.category, price=Decimal('5.00'), stock=1)
+            for i in range(24)
+        ])
+        response = self.client.get(reverse('store:product_list'), {'in_stock': 'true'})
+        self.assertContains(response, 'href="?page=2&sort=name&in_stock=true"')
+        self.assertContains(response, 'href="?show_all=1&sort=name&in_stock=true"')
+
+
+class StockReservationRaceTest(TransactionTestCase):
+    """Concurrent shoppers can't reserve more than a limited edition product's stock"""
+
+    def test_concurrent_reservations(self):
+        import random
+        import threading
+        import time
+        from django.db import OperationalError, connections
+        from .inventory import OutOfStock, reserve_stock
+        from .models import StockReservation
+        product = Product.objects.create(
+            name='Rare Serum', description='Description', category=Category.objects.create(name='Skincare'),
+            price=Decimal('50.00'), stock=5, limited_edition=True
+        )
+        users = [User.objects.create_user(username=f'shopper{i}', password='testpass') for i in range(12)]
+        outcomes = []
+        start = threading.Barrier(len(users))
+
+        def shop(user):
+            start.wait()
+            try:
+                for _ in range(200):
+                    try:
+                        reserve_stock(user, {product.id: 1})
+                        outcomes.append('reserved')
+                        return
+                    except OperationalError:
+                        # Shared-cache SQLite reports lock conflicts instead of waiting
+                        time.sleep(random.random() / 100)
+            except OutOfStock:
+                outcomes.append('out of stock')
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=shop, args=(user,)) for user in users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(outcomes.count('reserved'), 5)
+        self.assertEqual(outcomes.count('out of stock'), 7)
+        self.assertEqual(StockReservation.objects.filter(product=product).count(), 5)
+
+
+class CheckoutIdempotencyTest(TestCase):
+    """Tests for idempotency keys on the checkout form"""
+
+    def setUp(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from .models import Coupon
+        self.user = User.objects.create_user(username='shopper', password='testpass')
+        category = Category.objects.create(name='Skincare')
+        self.product = Product.objects.create(
+            name='Serum', description='Description', category=category, price=Decimal('20.00'), stock=5
+        )
+        CartItem.objects.create(cart=Cart.objects.create(user=self.user), product=self.product, quantity=2)
+        self.coupon = Coupon.objects.create(
+            code='SAVE10', discount_type='percentage', discount_value=Decimal('10'),
+            valid_from=timezone.now() - timedelta(days=1), valid_to=timezone.now() + timedelta(days=1)
+        )
+        self.client.force_login(self.user)
+        session = self.client.session
+        session['coupon_id'] = self.coupon.id
+        session.save()
+
+    def checkout(self, key):
+        return self.client.post(reverse('store:order_create'), {
+            'first_name': 'A', 'last_name': 'B', 'email': 'a@example.com', 'address': 'Street',
+            'postal_code': '1', 'city': 'City', 'payment_method': 'credit_card', 'idempotency_key': key,
+        })
+
+    def assertPlacedOnce(self, responses):
+        from .models import Task
+        order = Order.objects.get(user=self.user)
+        for response in responses:
+            self.assertRedirects(response, reverse('store:order_detail', args=[order.id]))
+        self.product.refresh_from_db()
+        self.coupon.refresh_from_db()
+        self.assertEqual((self.product.stock, self.coupon.current_uses), (3, 1))
+        self.assertEqual(Task.objects.filter(name='store.send_order_confirmation').count(), 1)
+        return order
+
+    def test_form_carries_a_new_key(self):
+        from .idempotency import valid_key
+        keys = {self.client.get(reverse('store:order_create')).context['form']['idempotency_key'].value() for _ in range(2)}
+        self.assertEqual(len(keys), 2)
+        self.assertTrue(all(valid_key(key) for key in keys))
+
+    def test_resubmission_returns_the_same_order(self):
+        from .idempotency import new_key
+        from .models import CheckoutKey
+        key = new_key()
+        order = self.assertPlacedOnce([self.checkout(key), self.checkout(key)])
+        self.assertEqual(CheckoutKey.objects.get(key=key).order, order)
+
+    def test_concurrent_submission_waits_for_the_first_order(self):
+        from unittest import mock
+        from .idempotency import claim_key, new_key, placed_order_id
+        key = new_key()
+        self.checkout(key)
+        # The second submission saw the cart and checked for the key just before the first one committed
+        CartItem.objects.create(cart=Cart.objects.get(user=self.user), product=self.product, quantity=2)
+        with mock.patch('store.views.placed_order_id', side_effect=[None, placed_order_id(self.user, key)]):
+            response = self.checkout(key)
+        self.assertPlacedOnce([response])
+        with self.assertRaises(Exception):
+            claim_key(self.user, key)
+
+    def test_keys_are_per_user_and_expire(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from .idempotency import new_key, placed_order_id, purge_expired_keys
+        from .models import CheckoutKey
+        key = new_key()
+        self.checkout(key)
+        other = User.objects.create_user(username='other', password='testpass')
+        self.assertIsNone(placed_order_id(other, key))
+        CheckoutKey.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(purge_expired_keys(), 1)
+
+    def test_submission_finding_the_cart_cleared_goes_to_the_order(self):
+        from unittest import mock
+        from .idempotency import new_key, placed_order_id
+        key = new_key()
+        self.checkout(key)
+        # The first submission committed and cleared the cart between the key check and reading the cart
+        with mock.patch('store.views.placed_order_id', side_effect=[None, placed_order_id(self.user, key)]):
+            response = self.checkout(key)
+        self.assertPlacedOnce([response])
+
+
+class CouponMixin:
+    """Coupons and orders using them"""
+
+    def create_coupon(self, code='SAVE10', **fields):
+        from datetime import timedelta
+        from django.utils import timezone
+        from .models import Coupon
+        return Coupon.objects.create(
+            code=code, discount_type='percentage', discount_value=Decimal('10'),
+            valid_from=timezone.now() - timedelta(days=1), valid_to=timezone.now() + timedelta(days=1), **fields
+        )
+
+    def create_order(self, user, coupon=None):
+        return Order.objects.create(
+            user=user, first_name='A', last_name='B', email='a@example.com', address='Street',
+            postal_code='1', city='City', coupon=coupon, discount_amount=Decimal('2.00'), total_price=Decimal('18.00')
+        )
+
+class CouponServiceTest(CouponMixin, QueryPlanMixin, TestCase):
+    """Tests for cached coupon lookups and usage claims"""
+
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.user = User.objects.create_user(username='shopper', password='testpass')
+
+    def test_codes_match_in_any_case_from_the_cache(self):
+        from .coupons import get_coupon
+        coupon = self.create_coupon()
+        self.assertEqual(get_coupon(' save10 '), coupon)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_coupon('Save10'), coupon)
+        self.assertIsNone(get_coupon('WELCOME'))
+        with self.assertNumQueries(0):
+            self.assertIsNone(get_coupon('welcome'))
+        # Saving a coupon clears what was cached for its code and id
+        welcome = self.create_coupon('WELCOME')
+        self.assertEqual(get_coupon('welcome'), welcome)
+        coupon.code = 'SAVE15'
+        coupon.save()
+        self.assertIsNone(get_coupon('SAVE10'))
+        self.assertEqual(get_coupon('save15').code, 'SAVE15')
+
+    def test_code_lookup_uses_the_index(self):
+        from .coupons import code_lookup
+        self.create_coupon()
+        self.assertUsesIndex(code_lookup('SAVE10'))
+
+    def test_lookup_checks_validity_and_user_limit(self):
+        from .coupons import CouponError, claim_coupon, lookup_coupon
+        coupon = self.create_coupon(max_uses_per_user=1)
+        self.assertEqual(lookup_coupon('save10', self.user), coupon)
+        claim_coupon(coupon, self.create_order(self.user, coupon))
+        with self.assertRaisesMessage(CouponError, 'maximum number of times'):
+            lookup_coupon('save10', self.user)
+        self.assertEqual(lookup_coupon('save10', User.objects.create_user(username='other')), coupon)
+        coupon.active = False
+        coupon.save()
+        with self.assertRaisesMessage(CouponError, 'no longer valid'):
+            lookup_coupon('save10')
+        with self.assertRaisesMessage(CouponError, 'Invalid coupon code'):
+            lookup_coupon('nope')
+
+    def test_claims_stop_at_the_caps(self):
+        from .coupons import CouponError, claim_coupon
+        from .models import CouponUse
+        coupon = self.create_coupon(max_uses=2, max_uses_per_user=1)
+        use = claim_coupon(coupon, self.create_order(self.user, coupon))
+        self.assertEqual((use.user, use.discount_amount), (self.user, Decimal('2.00')))
+        # The user's second claim is rolled back, and doesn't count towards max_uses
+        with self.assertRaises(CouponError):
+            claim_coupon(coupon, self.create_order(self.user, coupon))
+        other = User.objects.create_user(username='other')
+        claim_coupon(coupon, self.create_order(other, coupon))
+        with self.assertRaisesMessage(CouponError, 'no longer valid'):
+            claim_coupon(coupon, self.create_order(User.objects.create_user(username='third'), coupon))
+        coupon.refresh_from_db()
+        self.assertEqual(coupon.current_uses, 2)
+        self.assertEqual(CouponUse.objects.count(), 2)
+
+    def test_apply_matches_codes_in_any_case(self):
+        coupon = self.create_coupon()
+        self.client.force_login(self.user)
+        self.client.post(reverse('store:coupon_apply'), {'code': 'save10'})
+        self.assertEqual(self.client.session['coupon_id'], coupon.id)
+
+    def test_checkout_fails_when_the_last_use_is_taken(self):
+        from .models import Coupon
+        coupon = self.create_coupon(max_uses=1)
+        product = Product.objects.create(
+            name='Serum', description='Description', category=Category.objects.create(name='Skincare'),
+            price=Decimal('20.00'), stock=5
+        )
+        CartItem.objects.create(cart=Cart.objects.create(user=self.user), product=product, quantity=1)
+        self.client.force_login(self.user)
+        self.client.post(reverse('store:coupon_apply'), {'code': 'SAVE10'})
+        self.client.get(reverse('store:order_create'))
+
+        # Another order takes the last use while the cached coupon still shows it as free
+        Coupon.objects.filter(id=coupon.id).update(current_uses=1)
+        response = self.client.post(reverse('store:order_create'), {
+            'first_name': 'A', 'last_name': 'B', 'email': 'a@example.com', 'address': 'Street',
+            'postal_code': '1', 'city': 'City', 'payment_method': 'credit_card',
+        })
+        self.assertRedirects(response, reverse('store:order_create'))
+        self.assertFalse(Order.objects.exists())
+        product.refresh_from_db()
+        self.assertEqual(product.stock, 5)
+        self.assertIsNone(self.client.session['coupon_id'])
+
+
+class CouponClaimRaceTest(CouponMixin, TransactionTestCase):
+    """Concurrent orders can't use a coupon more often than its caps allow"""
+
+    def race(self, orders):
+        import random
+        import threading
+        import time
+        from django.db import OperationalError, connections, transaction
+        from .coupons import CouponError, claim_coupon
+        outcomes = []
+        start = threading.Barrier(len(orders))
+
+        def place(order):
+            start.wait()
+            try:
+                for _ in range(200):
+                    try:
+                        with transaction.atomic():
+                            claim_coupon(order.coupon, order)
+                        outcomes.append('claimed')
+                        return
+                    except OperationalError:
+                        # Shared-cache SQLite reports lock conflicts instead of waiting
+                        time.sleep(random.random() / 100)
+            except CouponError:
+                outcomes.append('refused')
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=place, args=(order,)) for order in orders]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return outcomes
+
+    def test_concurrent_claims_stop_at_max_uses(self):
+        from .models import CouponUse
+        coupon = self.create_coupon(max_uses=5)
+        orders = [self.create_order(User.objects.create_user(username=f'shopper{i}'), coupon) for i in range(12)]
+        outcomes = self.race(orders)
+        self.assertEqual((outcomes.count('claimed'), outcomes.count('refused')), (5, 7))
+        coupon.refresh_from_db()
+        self.assertEqual(coupon.current_uses, 5)
+        self.assertEqual(CouponUse.objects.count(), 5)
+
+    def test_concurrent_claims_stop_at_the_user_limit(self):
+        from .models import CouponUse
+        coupon = self.create_coupon(max_uses_per_user=2)
+        user = User.objects.create_user(username='shopper')
+        outcomes = self.race([self.create_order(user, coupon) for _ in range(6)])
+        self.assertEqual((outcomes.count('claimed'), outcomes.count('refused')), (2, 4))
+        coupon.refresh_from_db()
+        self.assertEqual(coupon.current_uses, 2)
+        self.assertEqual(CouponUse.objects.filter(user=user).count(), 2)
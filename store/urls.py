@@ -23,6 +23,7 @@ urlpatterns = [
     path('cart/', views.cart_detail, name='cart_detail'),
     path('cart/add/<int:product_id>/', views.cart_add, name='cart_add'),
     path('cart/remove/<int:product_id>/', views.cart_remove, name='cart_remove'),
+    path('cart/sync/', views.cart_sync, name='cart_sync'),
 
     # Wishlist views
     path('wishlist/', views.wishlist_detail, name='wishlist_detail'),
@@ -47,10 +48,14 @@ urlpatterns = [
     path('store-admin/orders/<int:pk>/update/', views.AdminOrderUpdateView.as_view(), name='admin_order_update'),
     path('store-admin/orders/<int:pk>/', views.AdminOrderDetailView.as_view(), name='admin_order_detail'),
     path('store-admin/users/', admin_views.UserListView.as_view(), name='admin_user_list'),
+    re_path(r'^store-admin/export/(?P<kind>orders|products)/$', admin_views.ExportView.as_view(), name='admin_export'),
       # Admin Product Management
     path('store-admin/products/', 
          admin_views.ProductListView.as_view(), 
          name='admin_product_list'),
+    path('store-admin/products/bulk-edit/', 
+         admin_views.ProductBulkEditView.as_view(), 
+         name='admin_product_bulk_edit'),
     path('store-admin/products/create/', 
          admin_views.ProductCreateView.as_view(), 
          name='admin_product_create'),
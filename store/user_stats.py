@@ -0,0 +1,47 @@
+"""
+User statistics for the admin pages.
+
+All counters come from one conditional-aggregate query over auth_user,
+cached for USER_STATS_CACHE_TIMEOUT seconds (60 by default). Saving or
+deleting a user clears the cache through signals in store.signals, so
+the figures only lag behind bulk changes made with queryset.update(),
+and only until the timeout.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db.models import Count, Q
+from django.utils import timezone
+
+
+CACHE_KEY = 'store:user_stats'
+
+
+def count_user_stats():
+    """Count users by status and role in a single query"""
+    now = timezone.now()
+    return User.objects.aggregate(
+        total=Count('id'),
+        active=Count('id', filter=Q(is_active=True)),
+        inactive=Count('id', filter=Q(is_active=False)),
+        staff=Count('id', filter=Q(is_staff=True)),
+        superusers=Count('id', filter=Q(is_superuser=True)),
+        customers=Count('id', filter=Q(is_staff=False, is_superuser=False)),
+        new_month=Count('id', filter=Q(date_joined__gte=now - timedelta(days=30))),
+        new_week=Count('id', filter=Q(date_joined__gte=now - timedelta(days=7))),
+    )
+
+
+def get_user_stats():
+    """The counters of count_user_stats(), from the cache when fresh"""
+    stats = cache.get(CACHE_KEY)
+    if stats is None:
+        stats = count_user_stats()
+        cache.set(CACHE_KEY, stats, getattr(settings, 'USER_STATS_CACHE_TIMEOUT', 60))
+    return stats
+
+
+def clear_user_stats():
+    cache.delete(CACHE_KEY)
@@ -1,23 +1,39 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
+from django.contrib.auth.views import redirect_to_login
+from django.views.decorators.http import require_POST
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.contrib import messages
 from django.views.generic import ListView, DetailView, CreateView, UpdateView, DeleteView, TemplateView
-from django.db.models import Q, Sum, Count, F
-from django.db import models, transaction
+from django.db.models import Q, Sum, Count, F, Avg, Case, When, IntegerField, FloatField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.db import IntegrityError, models, transaction
 from django.urls import reverse
 from django.http import JsonResponse, HttpResponseRedirect
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
 from django.utils import timezone
-from django.contrib.auth.models import User
 from .models import (
   Category, Product, Order, OrderItem, Cart, CartItem, Review,
-  Wishlist, WishlistItem, Coupon, CouponUse, ComparisonList, ComparisonItem
+  Wishlist, WishlistItem
 )
 from .forms import OrderCreateForm, CartAddProductForm, ReviewForm, CouponApplyForm
+from .recommendations import get_recommendations
+from .cart import get_cart, get_cart_summary, parse_cart_lines
+from .pricing import CartSummary
+from .tasks import send_order_confirmation
+from .coupons import CouponError, check_coupon, claim_coupon, get_coupon_by_id
+from .idempotency import attach_order, claim_key, new_key, placed_order_id, valid_key
+from .inventory import (
+  OutOfStock, commit_stock, get_available_stock, in_stock, release_reservations, reserve_stock
+)
+from .rollups import record_order, get_sales_totals, get_status_totals, get_category_totals, get_daily_series
+from .user_stats import get_user_stats
+from .comparison import get_comparison_storage, get_comparison_products, build_comparison_rows
+from ecommerce.routers import ReplicaReadMixin, use_primary, use_replica
 import json
 import logging
-from decimal import Decimal
+from datetime import date, timedelta
+from decimal import Decimal, InvalidOperation
 
 
 # Custom error handlers
@@ -41,15 +57,30 @@ def contact(request):
 logger = logging.getLogger(__name__)
 
 
+def with_ratings(queryset):
+  """
+  Annotate products with avg_rating and review_count so listings don't query reviews per product.
+  Correlated subqueries rather than a join keep the query ungrouped, so sorts still walk their index.
+  """
+  reviews = Review.objects.filter(product=OuterRef('pk')).order_by().values('product')
+  return queryset.annotate(
+    avg_rating=Subquery(reviews.annotate(avg=Avg('rating')).values('avg'), output_field=FloatField()),
+    review_count=Coalesce(
+      Subquery(reviews.annotate(count=Count('id')).values('count'), output_field=IntegerField()), Value(0)
+    ),
+  )
+
+
+@use_replica()
 def home(request):
   """Home page view with featured products, categories, and recently viewed products"""
   categories = Category.objects.all()[:6]
   
   # Get featured products for the carousel
-  carousel_products = Product.objects.filter(available=True, featured=True)[:5]
+  carousel_products = with_ratings(Product.objects.filter(available=True, featured=True))[:5]
   
   # Get other featured products (that aren't in the carousel) for the regular display
-  featured_products = Product.objects.filter(available=True).order_by('-created_at')[:8]
+  featured_products = with_ratings(Product.objects.filter(available=True)).order_by('-created_at')[:8]
 
   context = {
     'categories': categories,
@@ -60,9 +91,9 @@ def home(request):
 
   # Add recently viewed products if user is authenticated
   if request.user.is_authenticated:
-    from .models import RecentlyViewedProduct
-    recently_viewed = RecentlyViewedProduct.get_recently_viewed(request.user)
-    recently_viewed_products = [item.product for item in recently_viewed][:4]
+    recently_viewed_products = with_ratings(
+      Product.objects.filter(recentlyviewedproduct__user=request.user)
+    ).order_by('-recentlyviewedproduct__viewed_at')[:4]
     context['recently_viewed_products'] = recently_viewed_products
 
   return render(request, 'store/home.html', context)
@@ -80,7 +111,7 @@ def sort_redirect(request, sort_option):
   return HttpResponseRedirect(url)
 
 
-class ProductListView(ListView):
+class ProductListView(ReplicaReadMixin, ListView):
   """List view for all products with pagination and filtering"""
   model = Product
   template_name = 'store/product_list.html'
@@ -94,8 +125,18 @@ class ProductListView(ListView):
       return None  # Return None to disable pagination
     return self.paginate_by
 
+  def get_price_param(self, name):
+    """Return a non-negative price from the query string, or None if missing or invalid"""
+    try:
+      value = Decimal(self.request.GET.get(name, ''))
+    except InvalidOperation:
+      return None
+    if not value.is_finite() or value < 0:
+      return None
+    return value
+
   def get_queryset(self):
-    queryset = Product.objects.filter(available=True)
+    queryset = with_ratings(Product.objects.filter(available=True).select_related('category'))
 
     # Filter by category if provided
     category_id = self.request.GET.get('category')
@@ -124,12 +165,26 @@ class ProductListView(ListView):
     if self.request.GET.get('limited_edition') == 'true':
       queryset = queryset.filter(limited_edition=True)
 
-    # Sort products
+    # Products with stock left once checkout reservations are taken off
+    if self.request.GET.get('in_stock') == 'true':
+      queryset = in_stock(queryset)
+
+    # Filter by discounted price range
+    min_price = self.get_price_param('min_price')
+    if min_price is not None:
+      queryset = queryset.filter(effective_price__gte=min_price)
+
+    max_price = self.get_price_param('max_price')
+    if max_price is not None:
+      queryset = queryset.filter(effective_price__lte=max_price)
+
+    # Sort products, prices sort on what customers actually pay
     sort = self.request.GET.get('sort', 'name')
     if sort == 'price_asc':
-      queryset = queryset.order_by('price')
+      queryset = queryset.order_by('effective_price', 'id')
     elif sort == 'price_desc':
-      queryset = queryset.order_by('-price')
+      # Both keys descending so the price index can be read backwards
+      queryset = queryset.order_by('-effective_price', '-id')
     elif sort == 'newest':
       queryset = queryset.order_by('-created_at')
     else:
@@ -144,6 +199,9 @@ class ProductListView(ListView):
     context['query'] = self.request.GET.get('q', '')
     context['sort'] = self.request.GET.get('sort', 'name')
     context['show_all'] = self.request.GET.get('show_all', '')
+    context['min_price'] = self.get_price_param('min_price')
+    context['max_price'] = self.get_price_param('max_price')
+    context['in_stock'] = self.request.GET.get('in_stock') == 'true'
 
     # Add total product count
     context['total_products'] = Product.objects.filter(available=True).count()
@@ -151,18 +209,61 @@ class ProductListView(ListView):
     return context
 
 
-class ProductDetailView(DetailView):
+def fallback_related_products(product):
+  """Products of the same category (or any available ones) for products without recommendations"""
+  if product.category_id:
+    products = Product.objects.filter(category_id=product.category_id)
+  else:
+    products = Product.objects.filter(available=True)
+  return products.select_related('category').exclude(id=product.id)[:4]
+
+
+def rating_aggregates():
+  """aggregate() arguments counting reviews, their average and distribution in a single query"""
+  return {
+    'count': Count('id'),
+    'avg': Avg('rating'),
+    **{f'r{rating}': Count(Case(When(rating=rating, then=1), output_field=IntegerField())) for rating in range(1, 6)},
+  }
+
+
+def rating_stats(rating_counts):
+  """Rating statistics for the product page from the result of rating_aggregates()"""
+  stats = {
+    'rating_count': rating_counts['count'],
+    'rating_avg': 0,
+    'rating_distribution': {1: 0, 2: 0, 3: 0, 4: 0, 5: 0},
+    'rating_percentage': {1: 0, 2: 0, 3: 0, 4: 0, 5: 0}
+  }
+
+  if stats['rating_count'] > 0:
+    stats['rating_avg'] = rating_counts['avg'] or 0
+
+    # Update distribution dictionary
+    stats['rating_distribution'] = {rating: rating_counts[f'r{rating}'] for rating in range(1, 6)}
+
+    # Calculate percentage for each rating
+    for rating in range(1, 6):
+      stats['rating_percentage'][rating] = (stats['rating_distribution'][rating] / stats['rating_count']) * 100
+
+  return stats
+
+
+class ProductDetailView(ReplicaReadMixin, DetailView):
   """Detail view for a single product"""
   model = Product
   template_name = 'store/product_detail.html'
 
+  def get_queryset(self):
+    return Product.objects.select_related('category')
+
   def get_context_data(self, **kwargs):
     context = super().get_context_data(**kwargs)
     context['cart_product_form'] = CartAddProductForm()
 
     # Add review form and reviews to context
     context['review_form'] = ReviewForm()
-    reviews = self.object.reviews.all()
+    reviews = self.object.reviews.select_related('user')
     context['reviews'] = reviews
 
     # Check if the current user has already reviewed this product
@@ -185,28 +286,32 @@ class ProductDetailView(DetailView):
     # Get exclusive features
     context['exclusive_features'] = self.object.get_exclusive_features()
 
-    # Get related products from the same category if category exists
-    if self.object.category:
-      context['related_products'] = Product.objects.filter(
-        category=self.object.category
-      ).exclude(id=self.object.id)[:4]
+    # Prefer precomputed "frequently bought together" neighbours, then
+    # content-based similar products, then the same category
+    recommendations = get_recommendations(self.object)
+    if recommendations['bought_together']:
+      context['related_products'] = recommendations['bought_together']
+      context['similar_products'] = recommendations['similar']
+    elif recommendations['similar']:
+      context['related_products'] = recommendations['similar']
     else:
-      context['related_products'] = Product.objects.filter(
-        available=True
-      ).exclude(id=self.object.id)[:4]
+      context['related_products'] = fallback_related_products(self.object)
 
-    # Get the most recent history record for this product
-    try:
-      history = self.object.history.first()
-      if history:
-        context['previous_version'] = history.product_data
-    except Exception as e:
-      logger.error(f"Error retrieving product history: {e}")
+    # Only staff see the previous version, so customers' page views never read history
+    if self.request.user.is_staff:
+      try:
+        history = self.object.history.first()
+        if history:
+          context['previous_version'] = history.previous_version()
+      except Exception as e:
+        logger.error(f"Error retrieving product history: {e}")
 
     # Get recently viewed products for the user (excluding current product)
     if self.request.user.is_authenticated:
       from .models import RecentlyViewedProduct
-      recently_viewed = RecentlyViewedProduct.get_recently_viewed(self.request.user)
+      # The list is written on every product page, read it where it was written
+      with use_primary():
+        recently_viewed = list(RecentlyViewedProduct.get_recently_viewed(self.request.user))
       # Convert to list of products and exclude current product
       recently_viewed_products = [item.product for item in recently_viewed if item.product.id != self.object.id][:4]
       context['recently_viewed_products'] = recently_viewed_products
@@ -215,43 +320,7 @@ class ProductDetailView(DetailView):
 
   def _calculate_rating_stats(self, reviews):
     """Calculate detailed rating statistics for a product"""
-    from django.db.models import Avg, Count, Case, When, IntegerField
-
-    stats = {
-      'rating_count': reviews.count(),
-      'rating_avg': 0,
-      'rating_distribution': {1: 0, 2: 0, 3: 0, 4: 0, 5: 0},
-      'rating_percentage': {1: 0, 2: 0, 3: 0, 4: 0, 5: 0}
-    }
-
-    if stats['rating_count'] > 0:
-      # Use aggregation to calculate average rating
-      avg_rating = reviews.aggregate(Avg('rating'))['rating__avg']
-      stats['rating_avg'] = avg_rating or 0
-
-      # Use aggregation to count ratings by value
-      rating_counts = reviews.aggregate(
-        r1=Count(Case(When(rating=1, then=1), output_field=IntegerField())),
-        r2=Count(Case(When(rating=2, then=1), output_field=IntegerField())),
-        r3=Count(Case(When(rating=3, then=1), output_field=IntegerField())),
-        r4=Count(Case(When(rating=4, then=1), output_field=IntegerField())),
-        r5=Count(Case(When(rating=5, then=1), output_field=IntegerField()))
-      )
-
-      # Update distribution dictionary
-      stats['rating_distribution'] = {
-        1: rating_counts['r1'],
-        2: rating_counts['r2'],
-        3: rating_counts['r3'],
-        4: rating_counts['r4'],
-        5: rating_counts['r5']
-      }
-
-      # Calculate percentage for each rating
-      for rating in range(1, 6):
-        stats['rating_percentage'][rating] = (stats['rating_distribution'][rating] / stats['rating_count']) * 100
-
-    return stats
+    return rating_stats(reviews.aggregate(**rating_aggregates()))
 
   def get(self, request, *args, **kwargs):
     response = super().get(request, *args, **kwargs)
@@ -259,45 +328,36 @@ class ProductDetailView(DetailView):
     # Track this product view in recently viewed products
     if request.user.is_authenticated:
       from .models import RecentlyViewedProduct
-      RecentlyViewedProduct.add_product_view(request.user, self.object)
+      # Its count and trim read the user's own writes, which the replica may not have yet
+      with use_primary():
+        RecentlyViewedProduct.add_product_view(request.user, self.object)
 
     return response
 
 
-@login_required
 def cart_add(request, product_id):
   """Add a product to the cart"""
   # Check if we're adding all items from wishlist
   add_all_from_wishlist = request.POST.get('add_all_from_wishlist')
 
   if add_all_from_wishlist:
+    # Wishlists belong to registered users only
+    if not request.user.is_authenticated:
+      return redirect_to_login(request.get_full_path())
+
     try:
-      # Get the user's wishlist
-      wishlist = get_object_or_404(Wishlist, user=request.user)
-      wishlist_items = wishlist.items.all()
+      # Add one of each wishlist product with a single set-based increment
+      product_ids = list(
+        WishlistItem.objects.filter(wishlist__user=request.user).values_list('product_id', flat=True)
+      )
 
-      if not wishlist_items:
+      if not product_ids:
         messages.warning(request, "Your wishlist is empty.")
         return redirect('store:wishlist_detail')
 
-      # Get or create cart
-      cart, created = Cart.objects.get_or_create(user=request.user)
-
-      # Add each wishlist item to cart
-      added_count = 0
-      for wishlist_item in wishlist_items:
-        cart_item, item_created = CartItem.objects.get_or_create(
-          cart=cart,
-          product=wishlist_item.product,
-          defaults={'quantity': 0}
-        )
-
-        # If item already in cart, increment quantity by 1
-        cart_item.quantity += 1
-        cart_item.save()
-        added_count += 1
+      get_cart(request).add_quantities({product_id: 1 for product_id in product_ids})
 
-      messages.success(request, f'{added_count} items added to your cart from your wishlist.')
+      messages.success(request, f'{len(product_ids)} items added to your cart from your wishlist.')
       return redirect('store:cart_detail')
 
     except Exception as e:
@@ -305,32 +365,22 @@ def cart_add(request, product_id):
       messages.error(request, "There was an error adding wishlist items to your cart.")
       return redirect('store:wishlist_detail')
 
-  # Regular add to cart functionality
+  # Regular add to cart functionality, guests get a session cart
   product = get_object_or_404(Product, id=product_id)
 
   try:
-    # Get or create cart
-    cart, created = Cart.objects.get_or_create(user=request.user)
-
-    # Get or create cart item
-    cart_item, item_created = CartItem.objects.get_or_create(
-      cart=cart,
-      product=product,
-      defaults={'quantity': 0}
-    )
+    cart = get_cart(request)
 
     # Update quantity
     if request.method == 'POST':
       form = CartAddProductForm(request.POST)
       if form.is_valid():
         cd = form.cleaned_data
-        cart_item.quantity = cd['quantity']
-        cart_item.save()
+        cart.add(product, quantity=cd['quantity'], override_quantity=True)
         messages.success(request, f'{product.name} added to your cart.')
     else:
       # If GET request, just add 1
-      cart_item.quantity += 1
-      cart_item.save()
+      cart.add(product)
       messages.success(request, f'{product.name} added to your cart.')
 
   except Exception as e:
@@ -340,17 +390,18 @@ def cart_add(request, product_id):
   return redirect('store:cart_detail')
 
 
-@login_required
 def cart_remove(request, product_id):
   """Remove a product from the cart"""
   product = get_object_or_404(Product, id=product_id)
 
   try:
-    cart = get_object_or_404(Cart, user=request.user)
-
-    cart_item = get_object_or_404(CartItem, cart=cart, product=product)
-    cart_item.delete()
-    messages.success(request, f'{product.name} removed from your cart.')
+    if get_cart(request).remove(product):
+      # Give back stock held for a checkout the customer didn't finish
+      if request.user.is_authenticated:
+        release_reservations(request.user)
+      messages.success(request, f'{product.name} removed from your cart.')
+    else:
+      messages.error(request, f'{product.name} is not in your cart.')
   except Exception as e:
     logger.error(f"Error removing product from cart: {e}")
     messages.error(request, "There was an error removing the product from your cart.")
@@ -358,18 +409,61 @@ def cart_remove(request, product_id):
   return redirect('store:cart_detail')
 
 
-@login_required
+@require_POST
+def cart_sync(request):
+  """
+  Set the quantities of several cart lines in one request.
+
+  Expects a JSON list of {"product_id": ..., "qty": ...}; a qty of 0
+  removes the line. Returns the updated cart as JSON.
+  """
+  try:
+    lines = json.loads(request.body)
+    quantities, rejected = parse_cart_lines(lines)
+  except ValueError as e:
+    return JsonResponse({'error': str(e)}, status=400)
+
+  cart = get_cart(request)
+  try:
+    cart.set_quantities(quantities)
+  except Exception as e:
+    logger.error(f"Error syncing cart: {e}")
+    return JsonResponse({'error': 'There was an error updating your cart.'}, status=500)
+
+  summary = cart.get_summary()
+  return JsonResponse({
+    'items': [
+      {'product_id': line.product.id, 'qty': line.quantity, 'unit_price': str(line.unit_price), 'price': str(line.line_total)}
+      for line in summary.lines
+    ],
+    'rejected': rejected,
+    'total_items': summary.total_items,
+    'total_price': str(summary.subtotal),
+    'free_shipping': summary.free_shipping,
+  })
+
+
 def cart_detail(request):
   """Display the cart contents"""
   try:
-    cart, created = Cart.objects.get_or_create(user=request.user)
-    cart_items = cart.items.all()
+    summary = get_cart_summary(request)
   except Exception as e:
     logger.error(f"Error retrieving cart: {e}")
-    cart_items = []
+    summary = CartSummary()
     messages.error(request, "There was an error retrieving your cart.")
 
-  return render(request, 'store/cart_detail.html', {'cart_items': cart_items})
+  # Stock left for each line, counting the shopper's own reservations as theirs
+  user = request.user if request.user.is_authenticated else None
+  available_stock = get_available_stock([line.product.id for line in summary.lines], user) if summary.lines else {}
+  short_lines = [line for line in summary.lines if line.quantity > available_stock.get(line.product.id, 0)]
+
+  return render(request, 'store/cart_detail.html', {
+    'cart_items': summary.lines,
+    'cart_total': summary.subtotal,
+    'cart_summary': summary,
+    'available_stock': {str(product_id): max(stock, 0) for product_id, stock in available_stock.items()},
+    'short_lines': short_lines,
+  })
 
 
 @login_required
@@ -386,22 +480,11 @@ def coupon_apply(request):
       return redirect('store:order_create')
 
     # Handle coupon application
-    form = CouponApplyForm(request.POST)
+    form = CouponApplyForm(request.POST, user=request.user)
     if form.is_valid():
-      code = form.cleaned_data['code']
-      try:
-        coupon = Coupon.objects.get(code__iexact=code, active=True)
-
-        # Verify coupon is valid
-        if coupon.is_valid():
-          # Store coupon in session
-          request.session['coupon_id'] = coupon.id
-          messages.success(request, f"Coupon '{coupon.code}' applied successfully!")
-        else:
-          messages.error(request, "This coupon is no longer valid.")
-      except Coupon.DoesNotExist:
-        request.session['coupon_id'] = None
-        messages.error(request, "Invalid coupon code.")
+      # Store coupon in session
+      request.session['coupon_id'] = form.coupon.id
+      messages.success(request, f"Coupon '{form.coupon.code}' applied successfully!")
     else:
       for field, errors in form.errors.items():
         for error in errors:
@@ -415,10 +498,22 @@ def coupon_apply(request):
 def order_create(request):
   """Create a new order"""
   try:
-    cart, created = Cart.objects.get_or_create(user=request.user)
-    cart_items = cart.items.all()
-
-    if not cart_items:
+    # A resubmitted form (double click, refresh, retry) goes to the order it already placed
+    idempotency_key = request.POST.get('idempotency_key', '') if request.method == 'POST' else ''
+    if not valid_key(idempotency_key):
+      idempotency_key = None
+    if idempotency_key:
+      placed_order = placed_order_id(request.user, idempotency_key)
+      if placed_order:
+        return redirect('store:order_detail', placed_order)
+
+    summary = get_cart_summary(request)
+
+    if summary.is_empty:
+      # A concurrent submission of this form may have placed the order and cleared the cart since the check above
+      placed_order = placed_order_id(request.user, idempotency_key) if idempotency_key else None
+      if placed_order:
+        return redirect('store:order_detail', placed_order)
       messages.warning(request, "Your cart is empty. Please add some products before checkout.")
       return redirect('store:product_list')
 
@@ -426,26 +521,22 @@ def order_create(request):
     coupon = None
     coupon_id = request.session.get('coupon_id')
     if coupon_id:
+      coupon = get_coupon_by_id(coupon_id)
       try:
-        coupon = Coupon.objects.get(id=coupon_id, active=True)
-        if not coupon.is_valid():
-          messages.warning(request, "The coupon is no longer valid and has been removed.")
-          coupon = None
-          request.session['coupon_id'] = None
-      except Coupon.DoesNotExist:
+        check_coupon(coupon, request.user)
+      except CouponError as e:
+        if coupon is not None:
+          messages.warning(request, f"{e} The coupon has been removed.")
         coupon = None
         request.session['coupon_id'] = None
 
-    # Calculate cart total
-    cart_total = sum(item.get_price() for item in cart_items)
-
-    # Calculate discount if coupon exists
-    discount = Decimal('0.00')
-    if coupon:
-      discount = coupon.get_discount_amount(cart_total)
-
-    # Final total after discount
-    total_after_discount = cart_total - discount
+    # Price the cart once, with discounted prices and the coupon applied
+    summary = summary.apply_coupon(coupon)
+    cart_total = summary.subtotal
+    discount = summary.discount
+    total_after_discount = summary.total
+    quantities = {line.product.id: line.quantity for line in summary.lines}
+    reserved_until = None
 
     if request.method == 'POST':
       form = OrderCreateForm(request.POST)
@@ -460,39 +551,61 @@ def order_create(request):
           order.coupon = coupon
           order.discount_amount = discount
 
-        order.save()
-
-        for item in cart_items:
-          OrderItem.objects.create(
-            order=order,
-            product=item.product,
-            price=item.product.price,
-            quantity=item.quantity
-          )
+        try:
+          with transaction.atomic():
+            # Storing the key first makes a concurrent submission of the same form wait here
+            claim = claim_key(request.user, idempotency_key) if idempotency_key else None
+
+            # Take the items out of stock, failing if their reservations lapsed and the stock is gone
+            commit_stock(request.user, quantities)
+            order.save()
+
+            # Count the coupon's use, failing if another order took its last one
+            if coupon:
+              claim_coupon(coupon, order)
+
+            OrderItem.objects.bulk_create([
+              OrderItem(
+                order=order,
+                product=line.product,
+                price=line.unit_price,
+                quantity=line.quantity
+              )
+              for line in summary.lines
+            ])
+            record_order(order)
+            if claim:
+              attach_order(claim, order)
+
+            # Follow-up work runs in the background worker, queued only if the order commits
+            send_order_confirmation.enqueue(order_id=order.id)
+        except IntegrityError:
+          # Another submission of this form placed the order first
+          placed_order = placed_order_id(request.user, idempotency_key) if idempotency_key else None
+          if placed_order is None:
+            raise
+          return redirect('store:order_detail', placed_order)
+        except CouponError as e:
+          messages.error(request, f"{e} The coupon has been removed, please review your order.")
+          request.session['coupon_id'] = None
+          return redirect('store:order_create')
 
-        # If coupon was applied, record its use
+        # Clear coupon from session
         if coupon:
-          coupon.current_uses += 1
-          coupon.save()
-
-          CouponUse.objects.create(
-            coupon=coupon,
-            user=request.user,
-            order=order,
-            discount_amount=discount
-          )
-
-          # Clear coupon from session
           request.session['coupon_id'] = None
 
         # Clear the cart
-        cart_items.delete()
+        get_cart(request).clear()
 
         messages.success(request, "Your order has been successfully placed!")
         return redirect('store:order_detail', order.id)
     else:
+      # Hold the cart's quantities while the customer fills in the form
+      reserved_until = reserve_stock(request.user, quantities)
+
       # Pre-fill form with user information
       initial_data = {
+        'idempotency_key': new_key(),
         'first_name': request.user.first_name,
         'last_name': request.user.last_name,
         'email': request.user.email,
@@ -503,14 +616,19 @@ def order_create(request):
     coupon_form = CouponApplyForm()
 
     return render(request, 'store/order_create.html', {
-      'cart_items': cart_items,
+      'cart_items': summary.lines,
+      'cart_summary': summary,
       'form': form,
       'coupon_form': coupon_form,
       'cart_total': cart_total,
       'coupon': coupon,
       'discount': discount,
-      'total_after_discount': total_after_discount
+      'total_after_discount': total_after_discount,
+      'reserved_until': reserved_until,
     })
+  except OutOfStock as e:
+    messages.error(request, f"Some items in your cart are no longer available in that quantity: {e}. Please update your cart.")
+    return redirect('store:cart_detail')
   except Exception as e:
     logger.error(f"Error creating order: {e}")
     messages.error(request, "There was an error processing your order. Please try again.")
@@ -521,7 +639,7 @@ def order_create(request):
 def order_detail(request, order_id):
   """Display order details"""
   try:
-    order = get_object_or_404(Order, id=order_id, user=request.user)
+    order = get_object_or_404(Order.objects.prefetch_related('items__product'), id=order_id, user=request.user)
     return render(request, 'store/order_detail.html', {'order': order})
   except Exception as e:
     logger.error(f"Error retrieving order: {e}")
@@ -547,7 +665,11 @@ def order_cancel(request, order_id):
   if request.method == 'POST':
     try:
       with transaction.atomic():  # Added transaction atomic
-        order = get_object_or_404(Order, id=order_id, user=request.user, status='pending')
+        # Lock the order so a second cancel waits, then finds it no longer pending
+        order = get_object_or_404(
+          Order.objects.select_for_update(), id=order_id, user=request.user, status='pending'
+        )
+        # Saving the status puts the items back in stock, see store.signals
         order.status = 'cancelled'
         order.save()
         messages.success(request, f"Order #{order.id} has been cancelled.")
@@ -557,7 +679,7 @@ def order_cancel(request, order_id):
   return redirect('store:order_list')
 
 
-class AdminOrderListView(LoginRequiredMixin, UserPassesTestMixin, ListView):
+class AdminOrderListView(ReplicaReadMixin, LoginRequiredMixin, UserPassesTestMixin, ListView):
   """Admin view for all orders"""
   model = Order
   template_name = 'store/admin/order_list.html'
@@ -568,7 +690,7 @@ class AdminOrderListView(LoginRequiredMixin, UserPassesTestMixin, ListView):
     return self.request.user.is_staff
 
   def get_queryset(self):
-    queryset = Order.objects.all().order_by('-created_at')
+    queryset = Order.objects.select_related('user').prefetch_related('items__product').order_by('-created_at')
 
     # Filter by status if provided
     status = self.request.GET.get('status')
@@ -581,14 +703,15 @@ class AdminOrderListView(LoginRequiredMixin, UserPassesTestMixin, ListView):
     context = super().get_context_data(**kwargs)
     context['status'] = self.request.GET.get('status', '')
 
-    # Add statistics for dashboard
-    context['total_orders'] = Order.objects.count()
-    context['pending_orders'] = Order.objects.filter(status='pending').count()
-    context['total_revenue'] = Order.objects.aggregate(Sum('total_price'))['total_price__sum'] or 0
+    # Statistics come from the daily sales rollups rather than scanning orders
+    totals = get_sales_totals()
+    statuses = get_status_totals()
+    context['total_orders'] = totals['orders']
+    context['pending_orders'] = statuses.get('pending', {}).get('orders', 0)
+    context['total_revenue'] = totals['revenue']
 
     # Orders by status chart data
-    status_data = Order.objects.values('status').annotate(count=Count('id'))
-    context['status_data'] = json.dumps({item['status']: item['count'] for item in status_data})
+    context['status_data'] = json.dumps({status: item['orders'] for status, item in statuses.items()})
 
     return context
 
@@ -602,6 +725,18 @@ class AdminOrderUpdateView(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
   def test_func(self):
     return self.request.user.is_staff
 
+  def get_queryset(self):
+    return Order.objects.prefetch_related('items__product')
+
+  def form_valid(self, form):
+    # Reopening a cancelled order takes its items out of stock again, if they are still there
+    try:
+      with transaction.atomic():
+        return super().form_valid(form)
+    except OutOfStock as e:
+      form.add_error('status', f"Not enough stock to reopen this order: {e}.")
+      return self.form_invalid(form)
+
   def get_success_url(self):
     messages.success(self.request, f"Order #{self.object.id} has been updated.")
     return reverse('store:admin_order_list')
@@ -616,6 +751,9 @@ class AdminOrderDetailView(LoginRequiredMixin, UserPassesTestMixin, DetailView):
     def test_func(self):
         return self.request.user.is_staff
 
+    def get_queryset(self):
+        return Order.objects.select_related('user').prefetch_related('items__product__category')
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         return context
@@ -683,7 +821,7 @@ def wishlist_detail(request):
   """Display the wishlist contents"""
   try:
     wishlist, created = Wishlist.objects.get_or_create(user=request.user)
-    wishlist_items = wishlist.items.all().order_by('-added_at')
+    wishlist_items = wishlist.items.select_related('product__category').order_by('-added_at')
   except Exception as e:
     logger.error(f"Error retrieving wishlist: {e}")
     wishlist_items = []
@@ -745,198 +883,123 @@ def wishlist_remove(request, product_id):
 
 def comparison_list_detail(request):
   """Display the comparison list"""
-  # Get or create comparison list
-  comparison_list = None
+  storage = get_comparison_storage(request)
 
-  if request.user.is_authenticated:
-    # For authenticated users, get or create their comparison list
-    comparison_list, created = ComparisonList.objects.get_or_create(user=request.user)
-  else:
-    # For anonymous users, use session ID
-    session_id = request.session.session_key
-    if not session_id:
-      request.session.save()
-      session_id = request.session.session_key
-
-    comparison_list, created = ComparisonList.objects.get_or_create(session_id=session_id)
-
-  # Get comparison items
-  comparison_items = comparison_list.products.all().select_related('product')
-  products = [item.product for item in comparison_items]
-
-  # Get all product attributes for comparison
-  attributes = {}
-  if products:
-    # Basic attributes all products have
-    attributes['Price'] = {p.id: f"${p.price}" for p in products}
-    attributes['Category'] = {p.id: p.category.name if p.category else "Uncategorized" for p in products}
-    attributes['In Stock'] = {p.id: "Yes" if p.stock > 0 else "No" for p in products}
-    attributes['Stock Count'] = {p.id: p.stock for p in products}
-
-    # Get average rating with error handling
-    attributes['Rating'] = {}
-    for p in products:
-      try:
-        rating = p.get_average_rating()
-        attributes['Rating'][p.id] = f"{rating:.1f}/5.0" if rating is not None else "No ratings"
-      except (AttributeError, TypeError):
-        # Handle case where method doesn't exist or returns None
-        attributes['Rating'][p.id] = "No ratings"
-
-    # Get review count with error handling
-    attributes['Reviews'] = {}
-    for p in products:
-      try:
-        count = p.get_review_count()
-        attributes['Reviews'][p.id] = count if count is not None else 0
-      except AttributeError:
-        # Handle case where method doesn't exist
-        attributes['Reviews'][p.id] = 0
-
-  return render(request, 'store/comparison_list.html', {
-    'comparison_list': comparison_list,
+  # Build the table from one annotated query, newest products first
+  products = get_comparison_products(storage.get_product_ids())
+
+  response = render(request, 'store/comparison_list.html', {
     'products': products,
-    'attributes': attributes
+    'comparison_rows': build_comparison_rows(products)
   })
+  return storage.update_response(response)
 
 
 def comparison_add(request, product_id):
   """Add a product to the comparison list"""
   product = get_object_or_404(Product, id=product_id)
+  storage = get_comparison_storage(request)
 
-  # Get or create comparison list
-  comparison_list = None
-
-  if request.user.is_authenticated:
-    # For authenticated users, get or create their comparison list
-    comparison_list, created = ComparisonList.objects.get_or_create(user=request.user)
+  if storage.add(product.id):
+    messages.success(request, f'{product.name} added to your comparison list.')
   else:
-    # For anonymous users, use session ID
-    session_id = request.session.session_key
-    if not session_id:
-      request.session.save()
-      session_id = request.session.session_key
-
-    comparison_list, created = ComparisonList.objects.get_or_create(session_id=session_id)
-
-  # Check if product is already in comparison list
-  if ComparisonItem.objects.filter(comparison_list=comparison_list, product=product).exists():
     messages.info(request, f'{product.name} is already in your comparison list.')
-  else:
-    # Add product to comparison list
-    ComparisonItem.objects.create(comparison_list=comparison_list, product=product)
-    messages.success(request, f'{product.name} added to your comparison list.')
 
   # Redirect back to the product page if coming from there, otherwise to comparison list
   next_url = request.GET.get('next')
   if next_url:
-    return redirect(next_url)
-  return redirect('store:comparison_list')
+    return storage.update_response(redirect(next_url))
+  return storage.update_response(redirect('store:comparison_list'))
 
 
 def comparison_remove(request, product_id):
   """Remove a product from the comparison list"""
   product = get_object_or_404(Product, id=product_id)
+  storage = get_comparison_storage(request)
 
-  # Get comparison list
-  comparison_list = None
-
-  if request.user.is_authenticated:
-    comparison_list = get_object_or_404(ComparisonList, user=request.user)
+  if storage.remove(product.id):
+    messages.success(request, f'{product.name} removed from your comparison list.')
   else:
-    session_id = request.session.session_key
-    if session_id:
-      comparison_list = get_object_or_404(ComparisonList, session_id=session_id)
-
-  if comparison_list:
-    # Remove product from comparison list
-    try:
-      comparison_item = get_object_or_404(ComparisonItem, comparison_list=comparison_list, product=product)
-      comparison_item.delete()
-      messages.success(request, f'{product.name} removed from your comparison list.')
-    except:
-      messages.error(request, f'Could not remove {product.name} from your comparison list.')
+    messages.error(request, f'Could not remove {product.name} from your comparison list.')
 
-  return redirect('store:comparison_list')
+  return storage.update_response(redirect('store:comparison_list'))
 
 
 def comparison_clear(request):
   """Clear all products from the comparison list"""
-  # Get comparison list
-  comparison_list = None
-
-  if request.user.is_authenticated:
-    comparison_list = get_object_or_404(ComparisonList, user=request.user)
-  else:
-    session_id = request.session.session_key
-    if session_id:
-      comparison_list = get_object_or_404(ComparisonList, session_id=session_id)
-
-  if comparison_list:
-    # Clear comparison list
-    comparison_list.clear()
-    messages.success(request, 'Your comparison list has been cleared.')
+  storage = get_comparison_storage(request)
+  storage.clear()
+  messages.success(request, 'Your comparison list has been cleared.')
 
-  return redirect('store:comparison_list')
+  return storage.update_response(redirect('store:comparison_list'))
 
 
-class AdminDashboardView(LoginRequiredMixin, UserPassesTestMixin, TemplateView):
+class AdminDashboardView(ReplicaReadMixin, LoginRequiredMixin, UserPassesTestMixin, TemplateView):
   """Admin dashboard with statistics and charts"""
   template_name = 'store/admin/dashboard.html'
+  # Days shown by the charts when no range is given, and the longest range allowed
+  default_days = 30
+  max_days = 366
 
   def test_func(self):
     return self.request.user.is_staff
+
+  def get_date_param(self, name):
+    """Return a date from the query string, or None if missing or invalid"""
+    try:
+      return date.fromisoformat(self.request.GET.get(name, ''))
+    except ValueError:
+      return None
+
+  def get_date_range(self):
+    """Chart range from the start and end parameters, the last default_days days by default"""
+    today = timezone.localdate()
+    end = self.get_date_param('end') or today
+    start = self.get_date_param('start') or end - timedelta(days=self.default_days - 1)
+    if start > end:
+      start, end = end, start
+    return max(start, end - timedelta(days=self.max_days - 1)), end
+
   def get_context_data(self, **kwargs):
     context = super().get_context_data(**kwargs)
-    
-    # Get date 30 days ago for stats
-    from datetime import timedelta
-    from django.utils import timezone
-    thirty_days_ago = timezone.now() - timedelta(days=30)
-    seven_days_ago = timezone.now() - timedelta(days=7)
 
-    # Basic statistics
+    # Basic statistics, sales figures are read from the daily rollups
+    totals = get_sales_totals()
+    users = get_user_stats()
     context['total_products'] = Product.objects.count()
-    context['total_orders'] = Order.objects.count()
-    context['total_users'] = User.objects.count()
-    context['total_revenue'] = Order.objects.aggregate(Sum('total_price'))['total_price__sum'] or 0
-    
+    context['total_orders'] = totals['orders']
+    context['total_users'] = users['total']
+    context['total_revenue'] = totals['revenue']
+
     # User statistics
-    context['new_users_month'] = User.objects.filter(date_joined__gte=thirty_days_ago).count()
-    context['new_users_week'] = User.objects.filter(date_joined__gte=seven_days_ago).count()
-    context['active_users'] = User.objects.filter(is_active=True).count()
-    context['staff_users'] = User.objects.filter(is_staff=True).count()
+    context['new_users_month'] = users['new_month']
+    context['new_users_week'] = users['new_week']
+    context['active_users'] = users['active']
+    context['staff_users'] = users['staff']
 
     # Recent orders
-    context['recent_orders'] = Order.objects.order_by('-created_at')[:5]
+    context['recent_orders'] = Order.objects.select_related('user').order_by('-created_at')[:5]
+
+    # Charts cover the selected date range
+    start, end = self.get_date_range()
+    context['start_date'] = start
+    context['end_date'] = end
 
     # Orders by status
-    status_data = Order.objects.values('status').annotate(count=Count('id'))
-    context['status_data'] = json.dumps({item['status']: item['count'] for item in status_data})
+    statuses = get_status_totals(start, end)
+    context['status_data'] = json.dumps({status: item['orders'] for status, item in statuses.items()})
 
     # Sales by category
-    category_data = OrderItem.objects.exclude(
-      product__category__isnull=True
-    ).values('product__category__name').annotate(
-      total=Sum(F('price') * F('quantity'), output_field=models.DecimalField())
-    ).order_by('-total')[:5]
-
-    # Add uncategorized products if any
-    uncategorized_total = OrderItem.objects.filter(
-      product__category__isnull=True
-    ).aggregate(
-      total=Sum(F('price') * F('quantity'), output_field=models.DecimalField())
-    )['total'] or 0
-
-    # Prepare data for JSON
-    category_json_data = {
-      item['product__category__name']: float(item['total']) for item in category_data
-    }
-
-    # Add uncategorized if there are any
-    if uncategorized_total > 0:
-      category_json_data['Uncategorized'] = float(uncategorized_total)
+    context['category_data'] = json.dumps({
+      name: float(revenue) for name, revenue in get_category_totals(start, end, limit=5)
+    })
 
-    context['category_data'] = json.dumps(category_json_data)
+    # Daily sales, with the range totals summed from the same rows
+    series = get_daily_series(start, end)
+    context['daily_data'] = json.dumps([dict(day, revenue=float(day['revenue'])) for day in series])
+    context['range_totals'] = {
+      'orders': sum(day['orders'] for day in series),
+      'revenue': sum(day['revenue'] for day in series),
+    }
 
     return context
\ No newline at end of file
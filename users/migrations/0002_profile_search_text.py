@@ -0,0 +1,62 @@
+# Generated by Django 5.2 on 2026-10-19 18:39
+
+import unicodedata
+
+from django.db import migrations, models
+
+
+# Frozen copy of users.models.user_search_text as it was when this migration was written
+def user_search_text(user):
+    value = ' '.join([user.username, user.email, user.first_name, user.last_name])
+    decomposed = unicodedata.normalize('NFKD', value or '')
+    stripped = ''.join(char for char in decomposed if not unicodedata.combining(char))
+    return ' '.join(stripped.casefold().split())
+
+
+def fill_search_text(apps, schema_editor):
+    Profile = apps.get_model('users', 'Profile')
+    batch = []
+    for profile in Profile.objects.select_related('user').iterator(chunk_size=2000):
+        profile.search_text = user_search_text(profile.user)
+        batch.append(profile)
+        if len(batch) >= 2000:
+            Profile.objects.bulk_update(batch, ['search_text'])
+            batch = []
+    Profile.objects.bulk_update(batch, ['search_text'])
+
+
+def create_trigram_index(apps, schema_editor):
+    """
+    On PostgreSQL, a trigram index lets search_text LIKE '%term%' use an
+    index instead of scanning every profile. Other databases skip it.
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS users_profile_search_trgm_idx '
+        'ON users_profile USING gin (search_text gin_trgm_ops)'
+    )
+
+
+def drop_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS users_profile_search_trgm_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='search_text',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.RunPython(fill_search_text, migrations.RunPython.noop),
+        migrations.RunPython(create_trigram_index, drop_trigram_index),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2 on 2026-10-19 20:25
+
+import unicodedata
+
+from django.db import migrations
+
+
+def normalize_search_text(value):
+    decomposed = unicodedata.normalize('NFKD', value or '')
+    stripped = ''.join(char for char in decomposed if not unicodedata.combining(char))
+    return ' '.join(stripped.casefold().split())
+
+
+# Frozen copy of users.models.user_search_text as it was when this migration was written
+def user_search_text(user):
+    full_name = f'{user.first_name} {user.last_name}'
+    return '\n'.join(normalize_search_text(value) for value in [user.username, user.email, full_name])
+
+
+def refill_search_text(apps, schema_editor):
+    """Rewrite search_text with one field per line"""
+    Profile = apps.get_model('users', 'Profile')
+    batch = []
+    for profile in Profile.objects.select_related('user').iterator(chunk_size=2000):
+        profile.search_text = user_search_text(profile.user)
+        batch.append(profile)
+        if len(batch) >= 2000:
+            Profile.objects.bulk_update(batch, ['search_text'])
+            batch = []
+    Profile.objects.bulk_update(batch, ['search_text'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_profile_search_text'),
+    ]
+
+    operations = [
+        migrations.RunPython(refill_search_text, migrations.RunPython.noop),
+    ]
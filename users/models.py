@@ -3,9 +3,28 @@ from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
 # from PIL import Image  # Uncommented the PIL import
 import logging
+import unicodedata
 
 logger = logging.getLogger(__name__)
 
+
+def normalize_search_text(value):
+    """Lowercase value, strip accents and collapse whitespace, so searches match one plain column"""
+    decomposed = unicodedata.normalize('NFKD', value or '')
+    stripped = ''.join(char for char in decomposed if not unicodedata.combining(char))
+    return ' '.join(stripped.casefold().split())
+
+
+# Normalized search terms never contain a newline, so a match can't span two fields
+SEARCH_TEXT_SEPARATOR = '\n'
+
+
+def user_search_text(user):
+    """The text admin user searches match against: username, email and full name, one per line"""
+    full_name = f'{user.first_name} {user.last_name}'
+    return SEARCH_TEXT_SEPARATOR.join(normalize_search_text(value) for value in [user.username, user.email, full_name])
+
+
 class Profile(models.Model):
     """
     Extended user profile model.
@@ -41,6 +60,8 @@ class Profile(models.Model):
         choices=USER_TYPE_CHOICES,
         default='customer'
     )
+    # Normalized copy of the user's username, email and name, see user_search_text()
+    search_text = models.TextField(blank=True, default='', editable=False)
 
     def clean(self):
         """Validate model fields"""
@@ -51,7 +72,11 @@ class Profile(models.Model):
         return f'{self.user.username} Profile'
 
     def save(self, *args, **kwargs):
-        """Override save method to resize profile image"""
+        """Override save method to refresh the search text and resize profile image"""
+        self.search_text = user_search_text(self.user)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'search_text'}
         super().save(*args, **kwargs)
 
         # try: